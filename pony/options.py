@@ -61,6 +61,10 @@ CONSOLE_ENCODING = None
 # db options
 PREFETCHING = True
 MAX_FETCH_COUNT = None
+TRANSLATOR_CACHE_SIZE = 1000  # None means unbounded cache
+CONSTRUCTED_SQL_CACHE_SIZE = 2000
+QUERY_RESULT_CACHE_SIZE = 1000  # shared cache for results of queries marked with .cached()
+SLOW_QUERY_LOG_SIZE = 100  # number of recent slow queries kept in Database.slow_queries
 
 # used for select(...).show()
 CONSOLE_WIDTH = 80
@@ -0,0 +1,105 @@
+from __future__ import absolute_import, print_function, division
+
+# The state of db_session is thread-local, so each `async with db_session` block is served by one worker
+# thread from a shared bounded pool for its whole duration. Only entering and leaving the session,
+# Query.fetch() and Entity.flush() are dispatched to that worker automatically. Everything else that
+# sends queries to the database (Entity[...], lazy attribute loading, Query.count(), etc.) raises
+# TransactionError when called from the coroutine and should be wrapped in `await aio.run(func)`.
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+from pony.orm import core
+from pony.orm.core import TransactionError
+from pony.utils import throw
+
+__all__ = 'run',
+
+class WorkerPool(object):
+    def __init__(pool, max_size=10):
+        pool.max_size = max_size
+        pool.size = 0
+        pool.idle = []
+        pool.waiters = deque()
+        pool.lock = Lock()
+    def acquire(pool):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        with pool.lock:
+            if pool.idle: future.set_result(pool.idle.pop())
+            elif pool.size < pool.max_size:
+                pool.size += 1
+                future.set_result(ThreadPoolExecutor(max_workers=1))
+            else: pool.waiters.append((loop, future))
+        return future
+    def release(pool, worker):
+        with pool.lock:
+            while pool.waiters:
+                loop, future = pool.waiters.popleft()
+                if future.cancelled() or loop.is_closed(): continue
+                loop.call_soon_threadsafe(pool._hand_over, future, worker)
+                return
+            pool.idle.append(worker)
+    def _hand_over(pool, future, worker):
+        if future.cancelled(): pool.release(worker)
+        else: future.set_result(worker)
+
+pool = WorkerPool()
+task_sessions = WeakKeyDictionary()  # asyncio.Task -> [worker, nesting counter]
+
+def current_task():
+    if hasattr(asyncio, 'current_task'): return asyncio.current_task()
+    return asyncio.Task.current_task()
+
+async def enter_session(db_session):
+    task = current_task()
+    if task is None: throw(TransactionError, '`async with db_session` can be used only inside asyncio task')
+    session = task_sessions.get(task)
+    if session is None:
+        worker = await pool.acquire()
+        session = task_sessions[task] = [ worker, 0 ]
+    session[1] += 1
+    loop = asyncio.get_event_loop()
+    try: await loop.run_in_executor(session[0], db_session.__enter__)
+    except BaseException:
+        release(task)
+        raise
+
+async def exit_session(db_session, exc_type=None, exc=None, tb=None):
+    task = current_task()
+    session = task_sessions.get(task)
+    assert session is not None
+    loop = asyncio.get_event_loop()
+    try: await loop.run_in_executor(session[0], db_session.__exit__, exc_type, exc, tb)
+    finally: release(task)
+
+def release(task):
+    session = task_sessions[task]
+    session[1] -= 1
+    if session[1]: return
+    del task_sessions[task]
+    worker = session[0]
+    # if the task was cancelled, the session can still be open in the worker thread
+    worker.submit(reset_worker).add_done_callback(lambda future: pool.release(worker))
+
+def reset_worker():
+    while core.local.db_context_counter:
+        core.local.db_session.__exit__(asyncio.CancelledError, asyncio.CancelledError(), None)
+
+def in_task_session():
+    # True when called from a coroutine whose task has entered `async with db_session`,
+    # i.e. from the event loop thread and not from the session worker thread
+    if core.local.db_session is not None: return False
+    try: task = current_task()
+    except RuntimeError: return False
+    return task is not None and task in task_sessions
+
+def run(func, *args, **kwargs):
+    session = task_sessions.get(current_task())
+    if session is None: throw(TransactionError, 'db_session is required when working with the database')
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(session[0], partial(func, *args, **kwargs))
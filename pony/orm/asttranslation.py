@@ -14,6 +14,11 @@ class ASTTranslator(object):
         translator.tree = tree
         translator.pre_methods = {}
         translator.post_methods = {}
+    def __getstate__(translator):
+        state = translator.__dict__.copy()
+        state['pre_methods'] = {}
+        state['post_methods'] = {}
+        return state
     def dispatch(translator, node):
         cls = node.__class__
 
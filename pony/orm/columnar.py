@@ -0,0 +1,129 @@
+from __future__ import absolute_import, print_function, division
+from pony.py23compat import izip, imap, int_types
+
+from array import array
+from datetime import date, datetime
+
+try: import numpy
+except ImportError: numpy = None
+
+from pony.orm.core import EntityMeta
+from pony.orm.dbapiprovider import Converter, BoolConverter, IntConverter, RealConverter
+from pony.orm.sqltranslation import load_value_from_row
+from pony.utils import throw
+
+try: array('q')
+except ValueError: int_typecode = 'l'  # Python 2 has no 'q' typecode
+else: int_typecode = 'q'
+
+array_typecodes = {'int': int_typecode, 'float': 'd', 'bool': 'B'}
+numpy_dtypes = {'int': 'int64', 'float': 'float64', 'bool': 'bool', 'date': 'datetime64[D]', 'datetime': 'datetime64[us]'}
+
+# The element type of a column depends only on the type of the attribute, and not on the values of each chunk.
+# Values are converted by attribute converters before they are placed into arrays. If the converter only casts
+# values to int, float or bool, the array is built from the database values directly. Python arrays and NumPy
+# arrays cannot hold None, so NULL is stored as NaN in float columns and as NaT in date and datetime columns.
+# Int and bool columns containing NULLs are returned as NumPy masked arrays, or as lists when NumPy is not used
+nan = float('nan')
+
+def get_function(method):
+    return getattr(method, '__func__', method)
+
+cast_functions = { get_function(method) for method in (
+    Converter.sql2py, IntConverter.sql2py, RealConverter.sql2py, BoolConverter.sql2py) }
+
+def is_cast(converter):
+    return get_function(converter.sql2py) in cast_functions \
+           and get_function(converter.dbval2val) is get_function(Converter.dbval2val)
+
+def get_kind(converter):
+    py_type = converter.py_type
+    if py_type is bool: return 'bool'
+    if py_type in int_types: return 'int'
+    if py_type is float: return 'float'
+    if py_type is datetime: return 'datetime'
+    if py_type is date: return 'date'
+    return None
+
+def convert_values(converter, values):
+    return [ load_value_from_row(converter, value) for value in values ]
+
+def array_convert(kind, converter, values):
+    typecode = array_typecodes.get(kind)
+    converted = not is_cast(converter)
+    if converted: values = convert_values(converter, values)
+    if typecode is None or kind != 'float' and None in values:
+        return values if converted else convert_values(converter, values)
+    items = values
+    if None in values: items = [ nan if value is None else value for value in values ]
+    elif kind == 'bool' and not converted: items = imap(bool, values)
+    try: return array(typecode, items)
+    except (TypeError, OverflowError): return values if converted else convert_values(converter, values)
+
+def array_combine(kind, converter, pieces):
+    typecode = array_typecodes.get(kind)
+    if typecode is not None and all(isinstance(piece, array) for piece in pieces):
+        result = array(typecode)
+        for piece in pieces: result.extend(piece)
+        return result
+    result = []
+    for piece in pieces:
+        if type(piece) is list: result.extend(piece)
+        else: result.extend(convert_values(converter, piece))
+    return result
+
+def numpy_convert(kind, converter, values):
+    dtype = numpy_dtypes.get(kind)
+    if kind in array_typecodes and is_cast(converter):
+        try:
+            if None not in values: return numpy.fromiter(values, dtype, len(values))
+            if kind == 'float': return numpy.array(values, dtype=dtype)
+        except (TypeError, ValueError, OverflowError): pass
+    values = convert_values(converter, values)
+    if dtype is not None:
+        try:
+            if kind == 'float' or None not in values: return numpy.array(values, dtype=dtype)
+            mask = [ value is None for value in values ]
+            data = numpy.array([ 0 if value is None else value for value in values ], dtype=dtype)
+            return numpy.ma.masked_array(data, mask=mask)
+        except (TypeError, ValueError, OverflowError): pass
+    result = numpy.empty(len(values), dtype=object)
+    result[:] = values
+    return result
+
+def numpy_combine(kind, converter, pieces):
+    if not pieces: return numpy.array([], dtype=numpy_dtypes.get(kind, object))
+    if len(pieces) == 1: return pieces[0]
+    if any(numpy.ma.isMaskedArray(piece) for piece in pieces): return numpy.ma.concatenate(pieces)
+    return numpy.concatenate(pieces)
+
+def fetch_columns(query, chunk_size, use_numpy):
+    if chunk_size < 1: throw(ValueError, 'chunk_size must be positive number. Got: %r' % chunk_size)
+    translator = query._translator
+    if isinstance(translator.expr_type, EntityMeta): throw(TypeError,
+        'Query returning entity instances cannot be converted to columns')
+    converters = []
+    for func, slice_or_offset, src in translator.row_layout:
+        if func.func is not load_value_from_row: throw(TypeError,
+            'Expression %s returns entity instances and cannot be converted to column' % src)
+        converters.append(func.args[0])
+    kinds = [ get_kind(converter) for converter in converters ]
+    convert, combine = (numpy_convert, numpy_combine) if use_numpy else (array_convert, array_combine)
+    pieces = [ [] for converter in converters ]
+
+    sql, arguments, attr_offsets, query_key = query._construct_sql_and_arguments()
+    database = query._database
+    if query._for_update: database._get_cache().immediate = True
+    cursor = database._exec_sql(sql, arguments, server_side_cursor=True)
+    cursor.arraysize = chunk_size
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows: break
+            for kind, converter, column_pieces, values in izip(kinds, converters, pieces, izip(*rows)):
+                column_pieces.append(convert(kind, converter, values))
+    finally: cursor.close()
+    columns = [ combine(kind, converter, column_pieces)
+                for kind, converter, column_pieces in izip(kinds, converters, pieces) ]
+    if type(translator.expr_type) is not tuple: return columns[0]
+    return columns
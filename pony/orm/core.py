@@ -10,7 +10,7 @@ from decimal import Decimal
 from random import shuffle, randint, random
 from threading import Lock, RLock, currentThread as current_thread, _MainThread
 from contextlib import contextmanager
-from collections import defaultdict
+from collections import defaultdict, deque
 from hashlib import md5
 from inspect import isgeneratorfunction
 
@@ -28,7 +28,7 @@ from pony.orm.dbapiprovider import (
 from pony import utils
 from pony.utils import localbase, decorator, cut_traceback, cut_traceback_depth, throw, reraise, truncate_repr, \
      get_lambda_args, pickle_ast, unpickle_ast, deprecated, import_module, parse_expr, is_ident, tostring, strjoin, \
-     between, concat, coalesce, HashableDict
+     between, concat, coalesce, HashableDict, LRUCache
 
 __all__ = [
     'pony',
@@ -41,13 +41,13 @@ __all__ = [
     'OrmError', 'ERDiagramError', 'DBSchemaError', 'MappingError',
     'TableDoesNotExist', 'TableIsNotEmpty', 'ConstraintError', 'CacheIndexError',
     'ObjectNotFound', 'MultipleObjectsFoundError', 'TooManyObjectsFoundError', 'OperationWithDeletedObjectError',
-    'TransactionError', 'ConnectionClosedError', 'TransactionIntegrityError', 'IsolationError',
+    'TransactionError', 'ConnectionClosedError', 'PoolTimeoutError', 'TransactionIntegrityError', 'IsolationError',
     'CommitException', 'RollbackException', 'UnrepeatableReadError', 'OptimisticCheckError',
     'UnresolvableCyclicDependency', 'UnexpectedError', 'DatabaseSessionIsOver',
     'DatabaseContainsIncorrectValue', 'DatabaseContainsIncorrectEmptyValue',
     'TranslationError', 'ExprEvalError', 'PermissionError',
 
-    'Database', 'sql_debug', 'set_sql_debug', 'sql_debugging', 'show',
+    'Database', 'EntityCache', 'RoundRobinPolicy', 'LeastOutstandingPolicy', 'sql_debug', 'set_sql_debug', 'sql_debugging', 'show',
 
     'PrimaryKey', 'Required', 'Optional', 'Set', 'Discriminator',
     'composite_key', 'composite_index',
@@ -84,6 +84,7 @@ def set_sql_debug(debug=True, show_values=None):
 
 orm_logger = logging.getLogger('pony.orm')
 sql_logger = logging.getLogger('pony.orm.sql')
+slow_query_logger = logging.getLogger('pony.orm.slow_query')
 
 orm_log_level = logging.INFO
 
@@ -116,6 +117,22 @@ def log_sql(sql, arguments=None):
             sql = '%s\n%s' % (sql, format_arguments(arguments))
         print(sql, end='\n\n')
 
+def redact_arguments(arguments):
+    if arguments is None: return None
+    if type(arguments) is list: return [ redact_arguments(args) for args in arguments ]
+    if isinstance(arguments, dict): return dict.fromkeys(arguments, '?')
+    return ('?',) * len(arguments)
+
+def get_user_frame(frame_depth):
+    frame = sys._getframe(frame_depth+1)
+    while frame is not None:
+        module_name = frame.f_globals.get('__name__')
+        if module_name and not (module_name.startswith('pony.') and not
+                                module_name.startswith(('pony.orm.tests', 'pony.orm.examples'))):
+            return frame
+        frame = frame.f_back
+    return None
+
 def format_arguments(arguments):
     if type(arguments) is not list: return args2str(arguments)
     return '\n'.join(args2str(args) for args in arguments)
@@ -164,6 +181,7 @@ class TooManyObjectsFoundError(OrmError): pass
 class OperationWithDeletedObjectError(OrmError): pass
 class TransactionError(OrmError): pass
 class ConnectionClosedError(TransactionError): pass
+class PoolTimeoutError(TransactionError): pass
 
 class TransactionIntegrityError(TransactionError):
     def __init__(exc, msg, original_exc=None):
@@ -366,16 +384,19 @@ select_re = re.compile(r'\s*select\b', re.IGNORECASE)
 
 class DBSessionContextManager(object):
     __slots__ = 'retry', 'retry_exceptions', 'allowed_exceptions', \
-                'immediate', 'ddl', 'serializable', 'strict', 'optimistic', \
+                'immediate', 'ddl', 'serializable', 'strict', 'optimistic', 'read_only', \
                 'sql_debug', 'show_values'
     def __init__(db_session, retry=0, immediate=False, ddl=False, serializable=False, strict=False, optimistic=True,
-                 retry_exceptions=(TransactionError,), allowed_exceptions=(), sql_debug=None, show_values=None):
+                 retry_exceptions=(TransactionError,), allowed_exceptions=(), sql_debug=None, show_values=None,
+                 read_only=False):
         if retry is not 0:
             if type(retry) is not int: throw(TypeError,
                 "'retry' parameter of db_session must be of integer type. Got: %s" % type(retry))
             if retry < 0: throw(TypeError,
                 "'retry' parameter of db_session must not be negative. Got: %d" % retry)
             if ddl: throw(TypeError, "'ddl' and 'retry' parameters of db_session cannot be used together")
+        if read_only and (immediate or ddl or serializable): throw(TypeError,
+            "'read_only' parameter of db_session cannot be used together with 'immediate', 'ddl' or 'serializable'")
         if not callable(allowed_exceptions) and not callable(retry_exceptions):
             for e in allowed_exceptions:
                 if e in retry_exceptions: throw(TypeError,
@@ -387,6 +408,7 @@ class DBSessionContextManager(object):
         db_session.immediate = immediate or ddl or serializable or not optimistic
         db_session.strict = strict
         db_session.optimistic = optimistic and not serializable
+        db_session.read_only = read_only
         db_session.retry_exceptions = retry_exceptions
         db_session.allowed_exceptions = allowed_exceptions
         db_session.sql_debug = sql_debug
@@ -406,6 +428,14 @@ class DBSessionContextManager(object):
         if db_session.retry is not 0: throw(TypeError,
             "@db_session can accept 'retry' parameter only when used as decorator and not as context manager")
         db_session._enter()
+    def __aenter__(db_session):
+        if db_session.retry is not 0: throw(TypeError,
+            "@db_session can accept 'retry' parameter only when used as decorator and not as context manager")
+        from pony.orm import aio
+        return aio.enter_session(db_session)
+    def __aexit__(db_session, exc_type=None, exc=None, tb=None):
+        from pony.orm import aio
+        return aio.exit_session(db_session, exc_type, exc, tb)
     def _enter(db_session):
         if local.db_session is None:
             assert not local.db_context_counter
@@ -512,10 +542,13 @@ class DBSessionContextManager(object):
                         output = interact(iterator, input, exc_info)
                     except StopIteration as e:
                         for cache in _get_caches():
-                            if cache.modified or cache.in_transaction: throw(TransactionError,
-                                'You need to manually commit() changes before exiting from the generator')
+                            if cache.modified or cache.in_transaction and not (cache.read_transaction or cache.read_only):
+                                throw(TransactionError,
+                                      'You need to manually commit() changes before exiting from the generator')
                         raise
                     for cache in _get_caches():
+                        if cache.in_transaction and (cache.read_transaction or cache.read_only):
+                            cache.provider.commit(cache.connection, cache)
                         if cache.modified or cache.in_transaction: throw(TransactionError,
                             'You need to manually commit() changes before yielding from the generator')
                 except:
@@ -615,6 +648,10 @@ def throw_db_session_is_over(action, obj, attr=None):
     msg = 'Cannot %s %s%s: the database session is over'
     throw(DatabaseSessionIsOver, msg % (action, safe_repr(obj), '.%s' % attr.name if attr else ''))
 
+def throw_db_session_is_read_only(action, obj, attr=None):
+    msg = 'Cannot %s %s%s: the database session is read-only'
+    throw(TransactionError, msg % (action, safe_repr(obj), '.%s' % attr.name if attr else ''))
+
 def with_transaction(*args, **kwargs):
     deprecated(3, "@with_transaction decorator is deprecated, use @db_session decorator instead")
     return db_session(*args, **kwargs)
@@ -640,8 +677,11 @@ class Database(object):
         self._insert_cache = {}
 
         # ER-diagram related stuff:
-        self._translator_cache = {}
-        self._constructed_sql_cache = {}
+        self._translator_cache = LRUCache(options.TRANSLATOR_CACHE_SIZE)
+        self._constructed_sql_cache = LRUCache(options.CONSTRUCTED_SQL_CACHE_SIZE)
+        self._query_result_cache = QueryResultCache(options.QUERY_RESULT_CACHE_SIZE)
+        self._shared_cache_lock = Lock()
+        self._shared_cache_version = 0  # incremented each time shared entity caches are invalidated
         self.entities = {}
         self.schema = None
         self.Entity = type.__new__(EntityMeta, 'Entity', (Entity,), {})
@@ -651,8 +691,14 @@ class Database(object):
         self._global_stats = {}
         self._global_stats_lock = RLock()
         self._dblocal = DbLocal()
+        self.slow_query_threshold = None
+        self.slow_query_explain = False
+        self.slow_query_redact_arguments = False
+        self.slow_queries = deque(maxlen=options.SLOW_QUERY_LOG_SIZE)
 
         self.provider = None
+        self.replicas = []
+        self.replica_policy = None
         if args or kwargs: self._bind(*args, **kwargs)
     @cut_traceback
     def bind(self, *args, **kwargs):
@@ -664,6 +710,15 @@ class Database(object):
         if args: provider, args = args[0], args[1:]
         elif 'provider' not in kwargs: throw(TypeError, 'Database provider is not specified')
         else: provider = kwargs.pop('provider')
+        replicas = kwargs.pop('replicas', ())
+        replica_policy = kwargs.pop('replica_policy', 'round_robin')
+        if isinstance(replica_policy, basestring):
+            policy_cls = replica_policies.get(replica_policy)
+            if policy_cls is None: throw(ValueError, 'Unknown replica policy: %r' % replica_policy)
+            replica_policy = policy_cls()
+        elif not all(hasattr(replica_policy, name) for name in ('choose', 'acquired', 'released')): throw(TypeError,
+            'replica_policy must be policy name or object with choose(), acquired() and released() methods. '
+            'Got: %r' % replica_policy)
         if isinstance(provider, type) and issubclass(provider, DBAPIProvider):
             provider_cls = provider
         else:
@@ -673,6 +728,16 @@ class Database(object):
             provider_module = import_module('pony.orm.dbproviders.' + provider)
             provider_cls = provider_module.provider_cls
         self.provider = provider_cls(*args, **kwargs)
+        for replica in replicas:
+            if isinstance(replica, dict): self.replicas.append(provider_cls(**replica))
+            elif isinstance(replica, (tuple, list)): self.replicas.append(provider_cls(*replica))
+            else: self.replicas.append(provider_cls(replica))
+        self.replica_policy = replica_policy
+    def _get_read_provider(database, cache):
+        replicas = database.replicas
+        if not replicas or cache.replica_failed: return database.provider
+        if cache.immediate or cache.modified: return database.provider
+        return database.replica_policy.choose(replicas)
     @property
     def last_sql(database):
         return database._dblocal.last_sql
@@ -686,6 +751,24 @@ class Database(object):
         stat = stats.get(sql)
         if stat is not None: stat.query_executed(query_start_time)
         else: stats[sql] = QueryStat(sql, query_start_time)
+    @cut_traceback
+    def set_slow_query_log(database, threshold, explain=False, redact_arguments=False):
+        if threshold is not None and not threshold >= 0: throw(ValueError,
+            'Slow query threshold must be non-negative number of seconds or None. Got: %r' % threshold)
+        database.slow_query_threshold = threshold
+        database.slow_query_explain = explain
+        database.slow_query_redact_arguments = redact_arguments
+    def _log_slow_query(database, sql, arguments, duration, provider, connection, in_transaction=False):
+        frame = get_user_frame(frame_depth=2)
+        explain = None
+        if database.slow_query_explain and type(arguments) is not list and select_re.match(sql):
+            try: explain = provider.explain(connection, sql, arguments, in_transaction)
+            except DBException as e:
+                if local.debug: log_orm('EXPLAIN FAILED: %s' % e)
+        if database.slow_query_redact_arguments: arguments = redact_arguments(arguments)
+        query = SlowQuery(sql, arguments, duration, frame, explain)
+        database.slow_queries.append(query)
+        if has_handlers(slow_query_logger): slow_query_logger.warning('%s', query)
     def merge_local_stats(database):
         setdefault = database._global_stats.setdefault
         with database._global_stats_lock:
@@ -698,14 +781,33 @@ class Database(object):
         with database._global_stats_lock:
             return {sql: stat.copy() for sql, stat in iteritems(database._global_stats)}
     @property
+    def pool_stats(database):
+        pool_stats = getattr(database.provider.pool, 'stats', None)
+        return pool_stats.copy() if pool_stats is not None else None
+    @property
+    def query_cache_stats(database):
+        return dict(translators=database._translator_cache.get_stats(),
+                    sql=database._constructed_sql_cache.get_stats(),
+                    results=database._query_result_cache.lru.get_stats())
+    @cut_traceback
+    def set_query_cache_dir(database, dirname):
+        """Store translated queries in the directory, so other processes do not translate them again.
+
+        Cache files are loaded with pickle, so the directory must be writable only by trusted users:
+        a crafted cache file executes arbitrary code when the query is translated. Passing None
+        disables the cache.
+        """
+        from pony.orm import querycache
+        querycache.set_query_cache_dir(database, dirname)
+    @property
     def global_stats_lock(database):
         deprecated(3, "global_stats_lock is deprecated, just use global_stats property without any locking")
         return database._global_stats_lock
     @cut_traceback
     def get_connection(database):
         cache = database._get_cache()
-        if not cache.in_transaction:
-            cache.immediate = True
+        if not cache.in_transaction or cache.read_transaction:
+            if not cache.read_only: cache.immediate = True
             cache.prepare_connection_for_query_execution()
             cache.in_transaction = True
         connection = cache.connection
@@ -719,13 +821,19 @@ class Database(object):
         cache = local.db2cache.get(database)
         if cache is not None: cache.rollback()
         provider.disconnect()
+        for replica in database.replicas: replica.disconnect()
     def _get_cache(database):
         if database.provider is None: throw(MappingError, 'Database object is not bound with a provider yet')
         cache = local.db2cache.get(database)
         if cache is not None: return cache
         if not local.db_context_counter and not (
                 pony.MODE == 'INTERACTIVE' and current_thread().__class__ is _MainThread
-            ): throw(TransactionError, 'db_session is required when working with the database')
+            ):
+            aio = sys.modules.get('pony.orm.aio')
+            if aio is not None and aio.in_task_session(): throw(TransactionError,
+                'Database cannot be accessed from the event loop thread inside of `async with db_session`. '
+                'Use `await aio.run(func)` instead')
+            throw(TransactionError, 'db_session is required when working with the database')
         cache = local.db2cache[database] = SessionCache(database)
         return cache
     @cut_traceback
@@ -744,6 +852,7 @@ class Database(object):
             except: transact_reraise(RollbackException, [sys.exc_info()])
     @cut_traceback
     def execute(database, sql, globals=None, locals=None):
+        database._get_cache().modified_tables.add(None)  # tables modified by raw SQL are unknown
         return database._exec_raw_sql(sql, globals, locals, frame_depth=cut_traceback_depth+1, start_transaction=True)
     def _exec_raw_sql(database, sql, globals, locals, frame_depth, start_transaction=False):
         provider = database.provider
@@ -802,6 +911,9 @@ class Database(object):
             database._insert_cache[query_key] = cached_sql
         else: sql, adapter = cached_sql
         arguments = adapter(values_list(kwargs))  # order of values same as order of keys
+        cache = database._get_cache()
+        cache.invalidate_query_results({table_name})
+        cache.modified_tables.add(table_name)
         if returning is not None:
             return database._exec_sql(sql, arguments, returning_id=True, start_transaction=True)
         cursor = database._exec_sql(sql, arguments, start_transaction=True)
@@ -809,23 +921,30 @@ class Database(object):
     def _ast2sql(database, sql_ast):
         sql, adapter = database.provider.ast2sql(sql_ast)
         return sql, adapter
-    def _exec_sql(database, sql, arguments=None, returning_id=False, start_transaction=False):
+    def _exec_sql(database, sql, arguments=None, returning_id=False, start_transaction=False,
+                  server_side_cursor=False):
         cache = database._get_cache()
         if start_transaction: cache.immediate = True
         connection = cache.prepare_connection_for_query_execution()
-        cursor = connection.cursor()
+        provider = cache.provider
+        cursor = provider.server_side_cursor(connection) if server_side_cursor else connection.cursor()
         if local.debug: log_sql(sql, arguments)
-        provider = database.provider
         t = time()
         try: new_id = provider.execute(cursor, sql, arguments, returning_id)
         except Exception as e:
             connection = cache.reconnect(e)
-            cursor = connection.cursor()
+            provider = cache.provider
+            cursor = provider.server_side_cursor(connection) if server_side_cursor else connection.cursor()
             if local.debug: log_sql(sql, arguments)
             t = time()
             new_id = provider.execute(cursor, sql, arguments, returning_id)
         if cache.immediate: cache.in_transaction = True
         database._update_local_stat(sql, t)
+        threshold = database.slow_query_threshold
+        if threshold is not None:
+            duration = time() - t
+            if duration >= threshold:
+                database._log_slow_query(sql, arguments, duration, provider, connection, cache.in_transaction)
         if not returning_id: return cursor
         if PY2 and type(new_id) is long: new_id = int(new_id)
         return new_id
@@ -843,6 +962,8 @@ class Database(object):
             entity._link_reverse_attrs_()
         for entity in entities:
             entity._check_table_options_()
+        for entity in entities:
+            entity._init_vals_type_()
 
         def get_columns(table, column_names):
             column_dict = table.column_dict
@@ -946,6 +1067,9 @@ class Database(object):
                     else: pass  # virtual attribute of one-to-one pair
             entity._attrs_with_columns_ = [ attr for attr in entity._attrs_
                                                  if not attr.is_collection and attr.columns ]
+            entity._shared_cache_attrs_ = [ attr for attr in entity._attrs_with_columns_
+                                                 if attr.pk_offset is None and not attr.lazy ]
+            entity._has_lazy_attrs_ = any(attr.lazy for attr in chain(entity._attrs_, entity._subclass_attrs_))
             if not table.pk_index:
                 if len(entity._pk_columns_) == 1 and entity._pk_attrs_[0].auto: is_pk = "auto"
                 else: is_pk = True
@@ -1087,19 +1211,19 @@ class Database(object):
         finally:
             assert local.perms_context and local.perms_context[0] is database
             local.perms_context = None
-    def _get_schema_dict(database):
+    def _get_schema_dict(database, check_perms=True):
         result = []
         user = get_current_user()
         for entity in sorted(database.entities.values(), key=attrgetter('_id_')):
-            if not can_view(user, entity): continue
+            if check_perms and not can_view(user, entity): continue
             attrs = []
             for attr in entity._new_attrs_:
-                if not can_view(user, attr): continue
+                if check_perms and not can_view(user, attr): continue
                 d = dict(name=attr.name, type=attr.py_type.__name__, kind=attr.__class__.__name__)
                 if attr.auto: d['auto'] = True
                 if attr.reverse:
-                    if not can_view(user, attr.reverse.entity): continue
-                    if not can_view(user, attr.reverse): continue
+                    if check_perms and not can_view(user, attr.reverse.entity): continue
+                    if check_perms and not can_view(user, attr.reverse): continue
                     d['reverse'] = attr.reverse.name
                 if attr.lazy: d['lazy'] = True
                 if attr.nullable: d['nullable'] = True
@@ -1115,8 +1239,8 @@ class Database(object):
                 d['compositeKeys'] = [ [ attr.name for attr in attrs ] for attrs in entity._composite_keys_ ]
             result.append(d)
         return result
-    def _get_schema_json(database):
-        schema_json = json.dumps(database._get_schema_dict(), default=basic_converter, sort_keys=True)
+    def _get_schema_json(database, check_perms=True):
+        schema_json = json.dumps(database._get_schema_dict(check_perms), default=basic_converter, sort_keys=True)
         schema_hash = md5(schema_json.encode('utf-8')).hexdigest()
         return schema_json, schema_hash
     @cut_traceback
@@ -1550,6 +1674,26 @@ class DbLocal(localbase):
         dblocal.stats = {}
         dblocal.last_sql = None
 
+class SlowQuery(object):
+    __slots__ = 'sql', 'arguments', 'duration', 'filename', 'lineno', 'function', 'explain'
+    def __init__(query, sql, arguments, duration, frame=None, explain=None):
+        query.sql = sql
+        query.arguments = arguments
+        query.duration = duration
+        if frame is None: query.filename = query.lineno = query.function = None
+        else:
+            code = frame.f_code
+            query.filename, query.lineno, query.function = code.co_filename, frame.f_lineno, code.co_name
+        query.explain = explain
+    def __repr__(query):
+        return '<SlowQuery %.3f sec at %s:%s>' % (query.duration, query.filename, query.lineno)
+    def __str__(query):
+        lines = [ 'Slow query (%.3f sec) at %s:%s in %s()' % (query.duration, query.filename, query.lineno, query.function),
+                  query.sql ]
+        if query.arguments: lines.append(format_arguments(query.arguments))
+        if query.explain: lines.extend(' '.join(imap(unicode, row)) for row in query.explain)
+        return '\n'.join(lines)
+
 class QueryStat(object):
     def __init__(stat, sql, query_start_time=None):
         if query_start_time is not None:
@@ -1594,6 +1738,87 @@ class QueryStat(object):
         if not stat.db_count: return None
         return stat.sum_time / stat.db_count
 
+class EntityCache(object):
+    # Shared entity cache is invalidated only by commits made through the same Database object
+    # in the current process. Changes made by other processes or by other Database objects
+    # are not seen until the entry expires, so ttl should be set if the table is updated elsewhere
+    def __init__(cache, max_size=1000, ttl=None):
+        cache.lru = LRUCache(max_size)
+        cache.ttl = ttl
+    def get(cache, key):
+        entry = cache.lru.get(key)
+        if entry is None: return None
+        value, expires = entry
+        if expires is not None and expires < time():
+            cache.lru.pop(key)
+            return None
+        return value
+    def set(cache, key, value):
+        ttl = cache.ttl
+        cache.lru[key] = value, (time() + ttl if ttl is not None else None)
+    def delete(cache, key):
+        cache.lru.pop(key)
+    def clear(cache):
+        cache.lru.clear()
+    def get_stats(cache):
+        return cache.lru.get_stats()
+
+class RoundRobinPolicy(object):
+    def __init__(policy):
+        policy.counter = itertools.count()
+    def choose(policy, replicas):
+        return replicas[next(policy.counter) % len(replicas)]
+    def acquired(policy, replica):
+        pass
+    def released(policy, replica):
+        pass
+
+class LeastOutstandingPolicy(object):
+    def __init__(policy):
+        policy.lock = Lock()
+        policy.outstanding = defaultdict(int)
+    def choose(policy, replicas):
+        with policy.lock:
+            outstanding = policy.outstanding
+            return min(replicas, key=lambda replica: outstanding[replica])
+    def acquired(policy, replica):
+        with policy.lock: policy.outstanding[replica] += 1
+    def released(policy, replica):
+        with policy.lock: policy.outstanding[replica] -= 1
+
+replica_policies = {'round_robin': RoundRobinPolicy, 'least_outstanding': LeastOutstandingPolicy}
+
+class QueryResultCache(object):
+    def __init__(cache, max_size=None):
+        cache.lru = LRUCache(max_size)
+        cache.lock = Lock()
+        cache.last_version = 0  # versions are taken from one counter, so they can be compared with a snapshot
+        cache.version = 0
+        cache.table_versions = {}
+    def get_versions(cache, table_names):
+        get_version = cache.table_versions.get
+        return cache.version, tuple(get_version(table_name, 0) for table_name in table_names)
+    def is_newer(cache, versions, snapshot_version):
+        version, table_versions = versions
+        return version > snapshot_version or any(v > snapshot_version for v in table_versions)
+    def get(cache, key, versions):
+        entry = cache.lru.get(key)
+        if entry is None: return None
+        rows, entry_versions, expires = entry
+        if entry_versions != versions or expires is not None and expires < time():
+            cache.lru.pop(key)
+            return None
+        return rows
+    def set(cache, key, versions, rows, ttl=None):
+        cache.lru[key] = rows, versions, (time() + ttl if ttl is not None else None)
+    def invalidate(cache, table_names):
+        with cache.lock:
+            table_versions = cache.table_versions
+            cache.last_version = version = cache.last_version + 1
+            for table_name in table_names:
+                if table_name is None: cache.version = version
+                else: table_versions[table_name] = version
+
 class SessionCache(object):
     def __init__(cache, database):
         cache.is_alive = True
@@ -1610,11 +1835,20 @@ class SessionCache(object):
         cache.objects_to_save = []
         cache.saved_objects = []
         cache.query_results = {}
+        cache.fetched_groups = {}
+        cache.shared_cache_keys = []
+        cache.shared_cache_version = database._shared_cache_version
+        cache.snapshot_version = database._query_result_cache.last_version
+        cache.modified_tables = set()
         cache.modified = False
         cache.db_session = db_session = local.db_session
         cache.immediate = db_session is not None and db_session.immediate
+        cache.read_only = db_session is not None and db_session.read_only
         cache.connection = None
+        cache.provider = database.provider
+        cache.replica_failed = False
         cache.in_transaction = False
+        cache.read_transaction = False
         cache.saved_fk_state = None
         cache.perm_cache = defaultdict(lambda : defaultdict(dict))  # user -> perm -> cls_or_attr_or_obj -> bool
         cache.user_roles_cache = defaultdict(dict)  # user -> obj -> roles
@@ -1623,27 +1857,61 @@ class SessionCache(object):
         assert cache.connection is None
         if cache.in_transaction: throw(ConnectionClosedError,
             'Transaction cannot be continued because database connection failed')
-        provider = cache.database.provider
-        connection = provider.connect()
+        database = cache.database
+        provider = cache.provider = database._get_read_provider(cache)
+        is_replica = provider is not database.provider
+        try: connection = provider.connect()
+        except DBException as e:
+            if not is_replica: raise
+            if local.debug: log_orm('REPLICA CONNECTION FAILED: %s' % e)
+            cache.replica_failed = True
+            return cache.connect()
+        if is_replica: database.replica_policy.acquired(provider)
         try: provider.set_transaction_mode(connection, cache)  # can set cache.in_transaction
         except:
-            provider.drop(connection, cache)
+            cache.drop_connection(connection)
             raise
         cache.connection = connection
         return connection
+    def drop_connection(cache, connection):
+        provider = cache.provider
+        try: provider.drop(connection, cache)
+        finally:
+            if provider is not cache.database.provider: cache.database.replica_policy.released(provider)
     def reconnect(cache, exc):
-        provider = cache.database.provider
+        provider = cache.provider
         if exc is not None:
-            exc = getattr(exc, 'original_exc', exc)
-            if not provider.should_reconnect(exc): reraise(*sys.exc_info())
+            is_replica = provider is not cache.database.provider
+            if is_replica and isinstance(exc, OperationalError): pass  # fall back to primary
+            else:
+                exc = getattr(exc, 'original_exc', exc)
+                if not provider.should_reconnect(exc): reraise(*sys.exc_info())
             if local.debug: log_orm('CONNECTION FAILED: %s' % exc)
+            pool_stats = getattr(provider.pool, 'stats', None)
+            if pool_stats is not None: pool_stats.reconnect_requested()
             connection = cache.connection
             assert connection is not None
             cache.connection = None
-            provider.drop(connection, cache)
+            cache.drop_connection(connection)
+            if is_replica: cache.replica_failed = True
         else: assert cache.connection is None
         return cache.connect()
+    def switch_to_primary(cache):
+        connection = cache.connection
+        provider = cache.provider
+        assert connection is not None and (not cache.in_transaction or cache.read_transaction)
+        if local.debug: log_orm('SWITCH FROM REPLICA TO PRIMARY')
+        cache.connection = None
+        try:
+            if cache.in_transaction: provider.rollback(connection, cache)
+            provider.release(connection, cache)
+        finally: cache.database.replica_policy.released(provider)
+        cache.provider = cache.database.provider
+        return cache.connect()
     def prepare_connection_for_query_execution(cache):
+        if not cache.in_transaction:
+            # the snapshot of a new transaction includes all changes that invalidated results before this point
+            cache.snapshot_version = cache.database._query_result_cache.last_version
         db_session = local.db_session
         if db_session is not None and cache.db_session is None:
             # This situation can arise when a transaction was started
@@ -1653,13 +1921,22 @@ class SessionCache(object):
                 try: cache.flush_and_commit()
                 finally: local.db_session = db_session
             cache.db_session = db_session
-            cache.immediate = cache.immediate or db_session.immediate
+            cache.read_only = db_session.read_only
+            cache.immediate = not cache.read_only and (cache.immediate or db_session.immediate)
         else: assert cache.db_session is db_session, (cache.db_session, db_session)
+        if cache.read_only and cache.immediate:
+            cache.immediate = False
+            throw(TransactionError, 'Cannot modify or lock data inside read-only db_session')
         connection = cache.connection
         if connection is None: connection = cache.connect()
-        elif cache.immediate and not cache.in_transaction:
-            provider = cache.database.provider
-            try: provider.set_transaction_mode(connection, cache)  # can set cache.in_transaction
+        elif cache.provider is not cache.database.provider and cache.immediate:
+            connection = cache.switch_to_primary()
+        elif cache.immediate and cache.read_transaction or \
+                (cache.immediate or cache.read_only) and not cache.in_transaction:
+            provider = cache.provider
+            try:
+                if cache.read_transaction: provider.commit(connection, cache)  # finish read before write
+                provider.set_transaction_mode(connection, cache)  # can set cache.in_transaction
             except Exception as e: connection = cache.reconnect(e)
         if not cache.noflush_counter and cache.modified: cache.flush()
         return connection
@@ -1676,11 +1953,22 @@ class SessionCache(object):
             if cache.modified: cache.flush()
             if cache.in_transaction:
                 assert cache.connection is not None
-                cache.database.provider.commit(cache.connection, cache)
+                cache.provider.commit(cache.connection, cache)
+            database = cache.database
+            if cache.modified_tables:
+                database._query_result_cache.invalidate(cache.modified_tables)
+                cache.modified_tables.clear()
+            if cache.shared_cache_keys:
+                with database._shared_cache_lock: database._shared_cache_version += 1
+                for shared_cache, key in cache.shared_cache_keys:
+                    if key is None: shared_cache.clear()
+                    else: shared_cache.delete(key)
+                del cache.shared_cache_keys[:]
             cache.for_update.clear()
+            cache.fetched_groups.clear()
             cache.query_results.clear()
             cache.max_id_cache.clear()
-            cache.immediate = True
+            cache.immediate = not cache.read_only
         except:
             cache.rollback()
             raise
@@ -1694,18 +1982,21 @@ class SessionCache(object):
         database = cache.database
         x = local.db2cache.pop(database); assert x is cache
         cache.is_alive = False
-        provider = database.provider
+        provider = cache.provider
         connection = cache.connection
         if connection is None: return
         cache.connection = None
 
         try:
-            if rollback:
-                try: provider.rollback(connection, cache)
-                except:
-                    provider.drop(connection, cache)
-                    raise
-            provider.release(connection, cache)
+            try:
+                if rollback:
+                    try: provider.rollback(connection, cache)
+                    except:
+                        provider.drop(connection, cache)
+                        raise
+                provider.release(connection, cache)
+            finally:
+                if provider is not database.provider: database.replica_policy.released(provider)
         finally:
             db_session = cache.db_session or local.db_session
             if db_session:
@@ -1720,7 +2011,7 @@ class SessionCache(object):
                             if attr.is_collection:
                                 if not setdata.is_fully_loaded: obj._vals_[attr] = None
 
-            cache.objects = cache.objects_to_save = cache.saved_objects = cache.query_results \
+            cache.objects = cache.objects_to_save = cache.saved_objects = cache.query_results = cache.fetched_groups \
                 = cache.indexes = cache.seeds = cache.for_update = cache.max_id_cache \
                 = cache.modified_collections = cache.collection_statistics = None
     @contextmanager
@@ -1728,6 +2019,15 @@ class SessionCache(object):
         cache.noflush_counter += 1
         try: yield
         finally: cache.noflush_counter -= 1
+    def invalidate_query_results(cache, table_names):
+        query_results = cache.query_results
+        for query_key, (result_tables, result) in items_list(query_results):
+            if None in result_tables or not table_names.isdisjoint(result_tables): del query_results[query_key]
+    def discard_from_shared_cache(cache, obj):
+        shared_cache = obj._cache_
+        key = obj.__class__.__name__, obj._get_raw_pkval_()
+        shared_cache.delete(key)
+        cache.shared_cache_keys.append((shared_cache, key))
     def flush(cache):
         if cache.noflush_counter: return
         assert cache.is_alive
@@ -1740,13 +2040,15 @@ class SessionCache(object):
                 for obj in cache.objects_to_save:  # can grow during iteration
                     if obj is not None: obj._before_save_()
 
-                cache.query_results.clear()
                 modified_m2m = cache._calc_modified_m2m()
+                modified_tables = {obj._table_ for obj in cache.objects_to_save if obj is not None}
+                modified_tables.update(attr.table for attr in modified_m2m)
+                cache.invalidate_query_results(modified_tables)
+                cache.modified_tables.update(modified_tables)
                 for attr, (added, removed) in iteritems(modified_m2m):
                     if not removed: continue
                     attr.remove_m2m(removed)
-                for obj in cache.objects_to_save:
-                    if obj is not None: obj._save_()
+                cache._save_objects()
                 for attr, (added, removed) in iteritems(modified_m2m):
                     if not added: continue
                     attr.add_m2m(added)
@@ -1760,6 +2062,48 @@ class SessionCache(object):
         else:
             if cache.modified: throw(TransactionError,
                 'Recursion depth limit reached in obj._after_save_() call')
+    def _save_objects(cache):
+        batches = {}
+        def save_batches(*batch_ids):
+            for batch_id in sorted(batch_ids or list(batches),
+                                   key=lambda batch_id: batches[batch_id][3][0][0]._save_pos_):
+                entity, status, key, items = batches.pop(batch_id)
+                if status == 'created': entity._save_created_many_(key, items)
+                elif status == 'modified': entity._save_updated_many_(key, items)
+                else: entity._save_deleted_many_(key, items)
+        for obj in cache.objects_to_save:  # can shrink during iteration
+            if obj is None: continue
+            status = obj._status_
+            if status != 'marked_to_delete' and obj._has_unsaved_principal_objects_():
+                save_batches()
+                obj._save_()
+                continue
+            entity = obj.__class__
+            if status == 'created':
+                auto_pk, attrs, values, new_dbvals = obj._construct_insert_values_()
+                batch_id = status, entity._table_
+                key = auto_pk, attrs
+            elif status == 'modified':
+                query_key, optimistic_converters, values, new_dbvals = obj._construct_update_values_()
+                if query_key is None:
+                    obj._save_()
+                    continue
+                batch_id = status, None
+                key = query_key, optimistic_converters
+            else:
+                assert status == 'marked_to_delete'
+                query_key, optimistic_converters, values = obj._construct_delete_values_()
+                new_dbvals = None
+                batch_id = status, None
+                key = query_key, optimistic_converters
+            if any(other_id[0] != status for other_id in batches): save_batches()
+            batch = batches.get(batch_id)
+            if batch is not None and (batch[0] is not entity or batch[2] != key):
+                save_batches(batch_id)
+                batch = None
+            if batch is None: batch = batches[batch_id] = entity, status, key, []
+            batch[3].append((obj, values, new_dbvals))
+        save_batches()
     def call_after_save_hooks(cache):
         saved_objects = cache.saved_objects
         cache.saved_objects = []
@@ -2074,6 +2418,12 @@ class Attribute(object):
                 val = None
             else: val = attr.py_type._get_by_raw_pkval_(vals)
         return val
+    def parse_record_value(attr, row, offsets):
+        if not attr.reverse: return attr.validate(row[offsets[0]], None, attr.entity, from_db=True)
+        vals = [ row[offset] for offset in offsets ]
+        if None in vals: return None
+        vals = tuple(converter.sql2py(val) for converter, val in izip(attr.converters, vals))
+        return vals[0] if len(vals) == 1 else vals
     def load(attr, obj):
         cache = obj._session_cache_
         if cache is None or not cache.is_alive: throw_db_session_is_over('load attribute', obj, attr)
@@ -2087,6 +2437,14 @@ class Attribute(object):
 
         if attr.lazy:
             entity = attr.entity
+            group = cache.fetched_groups.get(obj)
+            if group is not None:
+                objects = [ obj2 for obj2 in group if isinstance(obj2, entity) and attr not in obj2._vals_
+                                                     and obj2._status_ not in created_or_deleted_statuses
+                                                     and obj2._session_cache_ is cache ]
+                if len(objects) > 1:
+                    attr.load_many(objects)
+                    return obj._vals_[attr]
             database = entity._database_
             if not attr.lazy_sql_cache:
                 select_list = [ 'ALL' ] + [ [ 'COLUMN', None, column ] for column in attr.columns ]
@@ -2107,6 +2465,44 @@ class Attribute(object):
             attr.db_set(obj, dbval)
         else: obj._load_()
         return obj._vals_[attr]
+    def load_many(attr, objects):
+        objects = [ obj for obj in objects if attr not in obj._vals_
+                                              and obj._status_ not in created_or_deleted_statuses ]
+        if not objects: return
+        entity = attr.entity
+        database = entity._database_
+        max_batch_size = database.provider.max_params_count // len(entity._pk_columns_)
+        for i in xrange(0, len(objects), max_batch_size):
+            batch = objects[i:i+max_batch_size]
+            if not attr.columns:
+                reverse = attr.reverse
+                assert reverse is not None and reverse.columns
+                sql, adapter, attr_offsets = reverse.entity._construct_batchload_sql_(len(batch), reverse)
+                cursor = database._exec_sql(sql, adapter(batch))
+                reverse.entity._fetch_objects(cursor, attr_offsets)
+                for obj in batch:
+                    if attr not in obj._vals_: obj._vals_[attr] = None
+            else:
+                assert attr.lazy
+                pk_columns = entity._pk_columns_
+                query_key = 'lazy', attr, len(batch)
+                cached_sql = entity._batchload_sql_cache_.get(query_key)
+                if cached_sql is None:
+                    select_list = [ 'ALL' ] + [ [ 'COLUMN', None, column ]
+                                                for column in chain(pk_columns, attr.columns) ]
+                    from_list = [ 'FROM', [ None, 'TABLE', entity._table_ ] ]
+                    row_value_syntax = database.provider.translator_cls.row_value_syntax
+                    criteria_list = construct_batchload_criteria_list(
+                        None, pk_columns, entity._pk_converters_, len(batch), row_value_syntax)
+                    sql_ast = [ 'SELECT', select_list, from_list, [ 'WHERE' ] + criteria_list ]
+                    cached_sql = entity._batchload_sql_cache_[query_key] = database._ast2sql(sql_ast)
+                sql, adapter = cached_sql
+                cursor = database._exec_sql(sql, adapter(batch))
+                pk_len = len(pk_columns)
+                offsets = tuple(xrange(pk_len, pk_len + len(attr.columns)))
+                for row in cursor.fetchall():
+                    obj = entity._get_by_raw_pkval_(row[:pk_len])
+                    if attr not in obj._vals_: attr.db_set(obj, attr.parse_value(row, offsets))
     @cut_traceback
     def __get__(attr, obj, cls=None):
         if obj is None: return attr
@@ -2131,6 +2527,7 @@ class Attribute(object):
     def __set__(attr, obj, new_val, undo_funcs=None):
         cache = obj._session_cache_
         if cache is None or not cache.is_alive: throw_db_session_is_over('assign new value to', obj, attr)
+        if cache.read_only: throw_db_session_is_read_only('assign new value to', obj, attr)
         if obj._status_ in del_statuses: throw_object_was_deleted(obj)
         reverse = attr.reverse
         new_val = attr.validate(new_val, obj, from_db=False)
@@ -2236,18 +2633,20 @@ class Attribute(object):
                       % (attr.entity.__name__, old_dbval, attr.reverse)
             throw(UnrepeatableReadError, msg)
 
+        wbits = obj._wbits_
+        wbit = bool(wbits and wbits & bit)
+        old_val = obj._vals_.get(attr, NOT_LOADED)  # in read-only session _dbvals_ is the same dict as _vals_
         if new_dbval is NOT_LOADED: obj._dbvals_.pop(attr, None)
         else: obj._dbvals_[attr] = new_dbval
 
-        wbit = bool(obj._wbits_ & bit)
         if not wbit:
-            old_val = obj._vals_.get(attr, NOT_LOADED)
             assert old_val == old_dbval, (old_val, old_dbval)
             if attr.is_part_of_unique_index:
                 if attr.is_unique: cache.db_update_simple_index(obj, attr, old_val, new_dbval)
                 get_val = obj._vals_.get
                 for attrs, i in attr.composite_keys:
                     vals = [ get_val(a) for a in attrs ]  # In Python 2 var name leaks into the function scope!
+                    vals[i] = old_val
                     old_vals = tuple(vals)
                     vals[i] = new_dbval
                     new_vals = tuple(vals)
@@ -2709,34 +3108,75 @@ class Set(Collection):
                 setdata_list.append(setdata2)
                 if len(objects) >= max_batch_size: break
 
+        attr.load_batch(objects, setdata_list)
+        cache.collection_statistics[attr] = counter + 1
+        return setdata
+    def load_many(attr, objects):
+        objects_to_load = []
+        setdata_list = []
+        for obj in objects:
+            if obj._status_ in created_or_deleted_statuses: continue
+            setdata = obj._vals_.get(attr)
+            if setdata is None: setdata = obj._vals_[attr] = SetData()
+            elif setdata.is_fully_loaded: continue
+            objects_to_load.append(obj)
+            setdata_list.append(setdata)
+        if not objects_to_load: return
+        entity = attr.entity
+        max_batch_size = entity._database_.provider.max_params_count // len(entity._pk_columns_)
+        for i in xrange(0, len(objects_to_load), max_batch_size):
+            attr.load_batch(objects_to_load[i:i+max_batch_size], setdata_list[i:i+max_batch_size], load_items=True)
+    def load_batch(attr, objects, setdata_list, load_items=False):
+        entity = attr.entity
+        reverse = attr.reverse
+        rentity = reverse.entity
+        database = entity._database_
         if not reverse.is_collection:
             sql, adapter, attr_offsets = rentity._construct_batchload_sql_(len(objects), reverse)
             arguments = adapter(objects)
             cursor = database._exec_sql(sql, arguments)
             items = rentity._fetch_objects(cursor, attr_offsets)
         else:
-            sql, adapter = attr.construct_sql_m2m(len(objects))
-            arguments = adapter(objects)
-            cursor = database._exec_sql(sql, arguments)
             pk_len = len(entity._pk_columns_)
             d = {}
-            if len(objects) > 1:
+            if load_items:
+                sql, adapter, attr_offsets = attr.construct_sql_m2m_join(len(objects))
+                cursor = database._exec_sql(sql, adapter(objects))
+                parse_row = rentity._get_row_parser_(attr_offsets)
+                loaded_items = {}
+                for row in cursor.fetchall():
+                    real_entity_subclass, pkval, avdict = parse_row(row)
+                    item = loaded_items.get(pkval)
+                    if item is None:
+                        item = loaded_items[pkval] = \
+                            real_entity_subclass._get_from_identity_map_(pkval, 'loaded')
+                        if item._status_ not in del_statuses: item._db_set_(avdict)
+                    obj2 = entity._get_by_raw_pkval_(row[-pk_len:])
+                    items = d.get(obj2)
+                    if items is None: items = d[obj2] = set()
+                    items.add(item)
+            elif len(objects) > 1:
+                sql, adapter = attr.construct_sql_m2m(len(objects))
+                cursor = database._exec_sql(sql, adapter(objects))
                 for row in cursor.fetchall():
                     obj2 = entity._get_by_raw_pkval_(row[:pk_len])
                     item = rentity._get_by_raw_pkval_(row[pk_len:])
                     items = d.get(obj2)
                     if items is None: items = d[obj2] = set()
                     items.add(item)
-            else: d[obj] = {rentity._get_by_raw_pkval_(row) for row in cursor.fetchall()}
+            else:
+                sql, adapter = attr.construct_sql_m2m(1)
+                cursor = database._exec_sql(sql, adapter(objects))
+                d[objects[0]] = {rentity._get_by_raw_pkval_(row) for row in cursor.fetchall()}
             for obj2, items in iteritems(d):
                 setdata2 = obj2._vals_.get(attr)
-                if setdata2 is None: setdata2 = obj._vals_[attr] = SetData()
+                if setdata2 is None: setdata2 = obj2._vals_[attr] = SetData()
                 else:
                     phantoms = setdata2 - items
                     if setdata2.added: phantoms -= setdata2.added
                     if phantoms: throw(UnrepeatableReadError,
                         'Phantom object %s disappeared from collection %s.%s'
-                        % (safe_repr(phantoms.pop()), safe_repr(obj), attr.name))
+                        % (safe_repr(phantoms.pop()), safe_repr(obj2), attr.name))
                 items -= setdata2
                 if setdata2.removed: items -= setdata2.removed
                 setdata2 |= items
@@ -2746,8 +3186,60 @@ class Set(Collection):
             setdata2.is_fully_loaded = True
             setdata2.absent = None
             setdata2.count = len(setdata2)
-        cache.collection_statistics[attr] = counter + 1
-        return setdata
+    def load_counts(attr, objects):
+        objects_to_load = []
+        for obj in objects:
+            if obj._status_ in del_statuses: continue
+            setdata = obj._vals_.get(attr)
+            if setdata is None: setdata = obj._vals_[attr] = SetData()
+            elif setdata.count is not None: continue
+            objects_to_load.append(obj)
+        if not objects_to_load: return
+        entity = attr.entity
+        database = entity._database_
+        cache = database._get_cache()
+        max_batch_size = database.provider.max_params_count // len(entity._pk_columns_)
+        for i in xrange(0, len(objects_to_load), max_batch_size):
+            batch = objects_to_load[i:i+max_batch_size]
+            sql, adapter = attr.construct_sql_count(len(batch))
+            if len(batch) == 1: arguments = adapter(batch[0]._get_raw_pkval_())
+            else: arguments = adapter(batch)
+            with cache.flush_disabled():
+                cursor = database._exec_sql(sql, arguments)
+            if len(batch) == 1: counts = {batch[0]: cursor.fetchone()[0]}
+            else: counts = {entity._get_by_raw_pkval_(row[:-1]): row[-1] for row in cursor.fetchall()}
+            for obj in batch:
+                setdata = obj._vals_[attr]
+                setdata.count = counts.get(obj, 0)
+                if setdata.added: setdata.count += len(setdata.added)
+                if setdata.removed: setdata.count -= len(setdata.removed)
+    def construct_sql_count(attr, batch_size=1):
+        if batch_size == 1:
+            cached_sql = attr.cached_count_sql
+            if cached_sql is not None: return cached_sql
+        else:
+            cached_sql = attr.cached_load_sql.get(('count', batch_size))
+            if cached_sql is not None: return cached_sql
+        reverse = attr.reverse
+        database = attr.entity._database_
+        if not reverse.is_collection: table_name = reverse.entity._table_
+        else: table_name = attr.table
+        from_list = [ 'FROM', [ None, 'TABLE', table_name ] ]
+        if batch_size == 1:
+            where_list = [ 'WHERE' ]
+            for i, (column, converter) in enumerate(izip(reverse.columns, reverse.converters)):
+                where_list.append([ converter.EQ, [ 'COLUMN', None, column ], [ 'PARAM', (i, None, None), converter ] ])
+            sql_ast = [ 'SELECT', [ 'AGGREGATES', [ 'COUNT', 'ALL' ] ], from_list, where_list ]
+            cached_sql = attr.cached_count_sql = database._ast2sql(sql_ast)
+            return cached_sql
+        columns = [ [ 'COLUMN', None, column ] for column in reverse.columns ]
+        row_value_syntax = database.provider.translator_cls.row_value_syntax
+        where_list = [ 'WHERE' ] + construct_batchload_criteria_list(
+            None, reverse.columns, reverse.converters, batch_size, row_value_syntax)
+        sql_ast = [ 'SELECT', [ 'ALL' ] + columns + [ [ 'COUNT', 'ALL' ] ], from_list, where_list,
+                    [ 'GROUP_BY' ] + columns ]
+        cached_sql = attr.cached_load_sql[('count', batch_size)] = database._ast2sql(sql_ast)
+        return cached_sql
     def construct_sql_m2m(attr, batch_size=1, items_count=0):
         if items_count:
             assert batch_size == 1
@@ -2784,6 +3276,32 @@ class Set(Collection):
         sql_ast = [ 'SELECT', select_list, from_list, where_list ]
         sql, adapter = attr.cached_load_sql[cache_key] = database._ast2sql(sql_ast)
         return sql, adapter
+    def construct_sql_m2m_join(attr, batch_size):
+        cache_key = 'join', batch_size
+        cached_sql = attr.cached_load_sql.get(cache_key)
+        if cached_sql is not None: return cached_sql
+        reverse = attr.reverse
+        rentity = reverse.entity
+        if not attr.symmetric:
+            columns = attr.columns
+            rcolumns = reverse.columns
+            rconverters = reverse.converters
+        else:
+            columns = attr.reverse_columns
+            rcolumns = attr.columns
+            rconverters = attr.converters
+        select_list, attr_offsets = rentity._construct_select_clause_('T2', all_attributes=True)
+        select_list.extend([ 'COLUMN', 'T1', column ] for column in rcolumns)
+        from_list = [ 'FROM', [ 'T1', 'TABLE', attr.table ], [ 'T2', 'TABLE', rentity._table_ ] ]
+        database = attr.entity._database_
+        row_value_syntax = database.provider.translator_cls.row_value_syntax
+        where_list = [ 'WHERE' ] + [ [ 'EQ', [ 'COLUMN', 'T1', column ], [ 'COLUMN', 'T2', pk_column ] ]
+                                     for column, pk_column in izip(columns, rentity._pk_columns_) ]
+        where_list += construct_batchload_criteria_list('T1', rcolumns, rconverters, batch_size, row_value_syntax)
+        sql_ast = [ 'SELECT', select_list, from_list, where_list ]
+        sql, adapter = database._ast2sql(sql_ast)
+        cached_sql = attr.cached_load_sql[cache_key] = sql, adapter, attr_offsets
+        return cached_sql
     def copy(attr, obj):
         if obj._status_ in del_statuses: throw_object_was_deleted(obj)
         if obj._vals_ is None: throw_db_session_is_over('read value of', obj, attr)
@@ -2795,8 +3313,8 @@ class Set(Collection):
             for item in setdata:
                 if item in added: continue
                 bit = item._bits_except_volatile_[reverse]
-                assert item._wbits_ is not None
-                if not item._wbits_ & bit: item._rbits_ |= bit
+                wbits = item._wbits_
+                if wbits is not None and not wbits & bit: item._rbits_ |= bit
         return set(setdata)
     @cut_traceback
     def __get__(attr, obj, cls=None):
@@ -2811,6 +3329,7 @@ class Set(Collection):
             return  # after += or -=
         cache = obj._session_cache_
         if cache is None or not cache.is_alive: throw_db_session_is_over('change collection', obj, attr)
+        if cache.read_only: throw_db_session_is_read_only('change collection', obj, attr)
         if obj._status_ in del_statuses: throw_object_was_deleted(obj)
         with cache.flush_disabled():
             new_items = attr.validate(new_items, obj)
@@ -3126,27 +3645,24 @@ class SetInstance(object):
         if setdata is None: setdata = obj._vals_[attr] = SetData()
         elif setdata.count is not None: return setdata.count
         if cache is None or not cache.is_alive: throw_db_session_is_over('read value of', obj, attr)
-        entity = attr.entity
-        reverse = attr.reverse
-        database = entity._database_
-        cached_sql = attr.cached_count_sql
-        if cached_sql is None:
-            where_list = [ 'WHERE' ]
-            for i, (column, converter) in enumerate(izip(reverse.columns, reverse.converters)):
-                where_list.append([ converter.EQ, [ 'COLUMN', None, column ], [ 'PARAM', (i, None, None), converter ] ])
-            if not reverse.is_collection: table_name = reverse.entity._table_
-            else: table_name = attr.table
-            sql_ast = [ 'SELECT', [ 'AGGREGATES', [ 'COUNT', 'ALL' ] ],
-                                  [ 'FROM', [ None, 'TABLE', table_name ] ], where_list ]
-            sql, adapter = database._ast2sql(sql_ast)
-            attr.cached_count_sql = sql, adapter
-        else: sql, adapter = cached_sql
-        arguments = adapter(obj._get_raw_pkval_())
-        with cache.flush_disabled():
-            cursor = database._exec_sql(sql, arguments)
-        setdata.count = cursor.fetchone()[0]
-        if setdata.added: setdata.count += len(setdata.added)
-        if setdata.removed: setdata.count -= len(setdata.removed)
+        counter = cache.collection_statistics.setdefault((attr, 'count'), 0)
+        nplus1_threshold = attr.nplus1_threshold
+        prefetching = options.PREFETCHING and nplus1_threshold is not None \
+                      and (counter >= nplus1_threshold or cache.noflush_counter)
+        objects = [ obj ]
+        if prefetching:
+            entity = attr.entity
+            pk_index = cache.indexes[entity._pk_attrs_]
+            max_batch_size = entity._database_.provider.max_params_count // len(entity._pk_columns_)
+            for obj2 in itervalues(pk_index):
+                if obj2 is obj or not isinstance(obj2, entity): continue
+                if obj2._status_ in created_or_deleted_statuses: continue
+                setdata2 = obj2._vals_.get(attr)
+                if setdata2 is not None and setdata2.count is not None: continue
+                objects.append(obj2)
+                if len(objects) >= max_batch_size: break
+        attr.load_counts(objects)
+        cache.collection_statistics[attr, 'count'] = counter + 1
         return setdata.count
     @cut_traceback
     def __iter__(wrapper):
@@ -3218,6 +3734,7 @@ class SetInstance(object):
         attr = wrapper._attr_
         cache = obj._session_cache_
         if cache is None or not cache.is_alive: throw_db_session_is_over('change collection', obj, attr)
+        if cache.read_only: throw_db_session_is_read_only('change collection', obj, attr)
         if obj._status_ in del_statuses: throw_object_was_deleted(obj)
         with cache.flush_disabled():
             reverse = attr.reverse
@@ -3257,6 +3774,7 @@ class SetInstance(object):
         attr = wrapper._attr_
         cache = obj._session_cache_
         if cache is None or not cache.is_alive: throw_db_session_is_over('change collection', obj, attr)
+        if cache.read_only: throw_db_session_is_read_only('change collection', obj, attr)
         if obj._status_ in del_statuses: throw_object_was_deleted(obj)
         with cache.flush_disabled():
             reverse = attr.reverse
@@ -3450,6 +3968,17 @@ class EntityMeta(type):
         entity._id_ = next(entity_id_counter)
         direct_bases = [ c for c in entity.__bases__ if issubclass(c, Entity) and c.__name__ != 'Entity' ]
         entity._direct_bases_ = direct_bases
+        shared_cache = entity.__dict__.get('_cache_')
+        if shared_cache is True: shared_cache = EntityCache()
+        elif shared_cache is False: shared_cache = None
+        elif shared_cache is not None:
+            for method_name in ('get', 'set', 'delete', 'clear'):
+                if not hasattr(shared_cache, method_name): throw(TypeError,
+                    '%s._cache_ must be True or cache object with get(), set(), delete() and clear() methods. Got: %r'
+                    % (entity.__name__, shared_cache))
+        if direct_bases and (shared_cache is not None or any(base._cache_ is not None for base in direct_bases)):
+            throw(ERDiagramError, 'Shared cache cannot be used with entity inheritance (entity %s)' % entity.__name__)
+        entity._cache_ = shared_cache
         all_bases = entity._all_bases_ = set()
         entity._subclasses_ = set()
         for base in direct_bases:
@@ -3571,6 +4100,8 @@ class EntityMeta(type):
         entity._insert_sql_cache_ = {}
         entity._update_sql_cache_ = {}
         entity._delete_sql_cache_ = {}
+        entity._record_types_ = {}
+        entity._row_parsers_ = {}
 
         entity._propagation_mixin_ = None
         entity._set_wrapper_subclass_ = None
@@ -3592,6 +4123,16 @@ class EntityMeta(type):
         entity._default_genexpr_ = inner_expr
 
         entity._access_rules_ = defaultdict(set)
+    def _init_vals_type_(entity):
+        root = entity._root_
+        if root is not entity: entity._vals_type_ = root._vals_type_
+        elif not entity.__dict__.get('_compact_', False): entity._vals_type_ = dict
+        else:
+            attrs = list(entity._attrs_)
+            for subclass in sorted(entity._subclasses_, key=attrgetter('_id_')): attrs.extend(subclass._new_attrs_)
+            layout = tuple((attr, '_%d' % i) for i, attr in enumerate(attrs))
+            entity._vals_type_ = type(str(entity.__name__ + 'Values'), (CompactValues,), {
+                '__slots__': tuple(name for attr, name in layout), '_layout_': layout, '_slot_names_': dict(layout)})
     def _initialize_bits_(entity):
         entity._bits_ = {}
         entity._bits_except_volatile_ = {}
@@ -3816,9 +4357,47 @@ class EntityMeta(type):
             if attr.is_collection:
                 throw(TypeError, 'Collection attribute %s cannot be specified as search criteria' % attr)
         obj, unique = entity._find_in_cache_(pkval, avdict, for_update)
+        if obj is None and unique and entity._cache_ is not None and not for_update:
+            obj = entity._find_in_shared_cache_(pkval, avdict)
         if obj is None: obj = entity._find_in_db_(avdict, unique, for_update, nowait)
         if obj is None: throw(ObjectNotFound, entity, pkval)
         return obj
+    def _find_in_shared_cache_(entity, pkval, avdict):
+        if pkval is None:
+            if any(attr.reverse for attr in entity._pk_attrs_): return None
+            for attr in entity._simple_keys_:
+                val = avdict.get(attr)
+                if val is None or attr.reverse: continue
+                raw_pkval = entity._cache_.get((entity.__name__, attr.name, val))
+                if raw_pkval is not None: break
+            else: return None
+            pkval = raw_pkval if entity._pk_is_composite_ else raw_pkval[0]
+        obj = entity._load_from_shared_cache_(pkval)
+        if obj is None: return None
+        for attr, val in iteritems(avdict):
+            if attr.__get__(obj) != val: return None
+        entity._set_rbits((obj,), avdict)
+        return obj
+    def _load_from_shared_cache_(entity, pkval):
+        cache = entity._database_._get_cache()
+        if pkval in cache.indexes[entity._pk_attrs_]: return None
+        raw_pkval = []
+        for attr, val in izip(entity._pk_attrs_, pkval if entity._pk_is_composite_ else (pkval,)):
+            if attr.reverse: raw_pkval.extend(val._get_raw_pkval_())
+            else: raw_pkval.append(val)
+        data = entity._cache_.get((entity.__name__, tuple(raw_pkval)))
+        if data is None: return None
+        avdict = {}
+        for attr in entity._shared_cache_attrs_:
+            val = data.get(attr.name, NOT_LOADED)
+            if val is NOT_LOADED: return None
+            avdict[attr] = val
+        obj = entity._get_from_identity_map_(pkval, 'loaded')
+        for attr in entity._shared_cache_attrs_:
+            val = avdict[attr]
+            if attr.reverse and val is not None: avdict[attr] = attr.py_type._get_by_raw_pkval_(val, from_db=False)
+        obj._db_set_(avdict)
+        return obj
     def _find_in_cache_(entity, pkval, avdict, for_update=False):
         cache = entity._database_._get_cache()
         cache_indexes = cache.indexes
@@ -3927,11 +4506,12 @@ class EntityMeta(type):
         discr_values = [ [ 'VALUE', cls._discriminator_ ] for cls in entity._subclasses_ ]
         discr_values.append([ 'VALUE', entity._discriminator_])
         return [ 'IN', [ 'COLUMN', alias, discr_attr.column ], discr_values ]
-    def _construct_batchload_sql_(entity, batch_size, attr=None, from_seeds=True):
-        query_key = batch_size, attr, from_seeds
+    def _construct_batchload_sql_(entity, batch_size, attr=None, from_seeds=True, attrs_to_prefetch=()):
+        query_key = batch_size, attr, from_seeds, attrs_to_prefetch
         cached_sql = entity._batchload_sql_cache_.get(query_key)
         if cached_sql is not None: return cached_sql
-        select_list, attr_offsets = entity._construct_select_clause_(all_attributes=True)
+        select_list, attr_offsets = entity._construct_select_clause_(
+            all_attributes=True, attrs_to_prefetch=attrs_to_prefetch)
         from_list = [ 'FROM', [ None, 'TABLE', entity._table_ ]]
         if attr is None:
             columns = entity._pk_columns_
@@ -3999,19 +4579,53 @@ class EntityMeta(type):
                 throw(TooManyObjectsFoundError,
                     'Found more then pony.options.MAX_FETCH_COUNT=%d objects' % options.MAX_FETCH_COUNT)
         else: rows = cursor.fetchall()
+        return entity._rows_to_objects_(rows, attr_offsets, for_update, used_attrs)
+    def _rows_to_objects_(entity, rows, attr_offsets, for_update=False, used_attrs=()):
         objects = []
         if attr_offsets is None:
             objects = [ entity._get_by_raw_pkval_(row, for_update) for row in rows ]
             entity._load_many_(objects)
         else:
+            parse_row = entity._get_row_parser_(attr_offsets)
             for row in rows:
-                real_entity_subclass, pkval, avdict = entity._parse_row_(row, attr_offsets)
+                real_entity_subclass, pkval, avdict = parse_row(row)
                 obj = real_entity_subclass._get_from_identity_map_(pkval, 'loaded', for_update)
                 if obj._status_ in del_statuses: continue
                 obj._db_set_(avdict)
                 objects.append(obj)
+            if entity._has_lazy_attrs_ and len(objects) > 1:
+                fetched_groups = entity._database_._get_cache().fetched_groups
+                for obj in objects: fetched_groups[obj] = objects
+            if entity._cache_ is not None and not for_update:
+                cache = entity._database_._get_cache()
+                if not cache.in_transaction or cache.read_transaction:
+                    for obj in objects: obj._store_in_shared_cache_()
         if used_attrs: entity._set_rbits(objects, used_attrs)
         return objects
+    def _rows_to_records_(entity, rows, attr_offsets):
+        discr_attr = entity._discriminator_attr_
+        layouts = {}
+        records = []
+        for row in rows:
+            if not discr_attr: real_entity_subclass = entity
+            else:
+                discr_value = discr_attr.validate(row[attr_offsets[discr_attr][0]], None, entity, from_db=True)
+                real_entity_subclass = discr_attr.code2cls[discr_value]
+            layout = layouts.get(real_entity_subclass)
+            if layout is None:
+                attrs = tuple(attr for attr in real_entity_subclass._attrs_ if attr in attr_offsets)
+                record_type = real_entity_subclass._get_record_type_(attrs)
+                layout = layouts[real_entity_subclass] = record_type, [ (attr, attr_offsets[attr]) for attr in attrs ]
+            record_type, attrs_and_offsets = layout
+            records.append(record_type(attr.parse_record_value(row, offsets) for attr, offsets in attrs_and_offsets))
+        return records
+    def _get_record_type_(entity, attrs):
+        record_type = entity._record_types_.get(attrs)
+        if record_type is None:
+            cls_dict = {'__slots__': (), '_entity_': entity, '_fields': tuple(attr.name for attr in attrs)}
+            for i, attr in enumerate(attrs): cls_dict[attr.name] = property(itemgetter(i))
+            record_type = entity._record_types_[attrs] = type(str(entity.__name__ + 'Record'), (EntityRecord,), cls_dict)
+        return record_type
     def _set_rbits(entity, objects, attrs):
         rbits_dict = {}
         get_rbits = rbits_dict.get
@@ -4044,6 +4658,73 @@ class EntityMeta(type):
         assert None not in pkval
         if not entity._pk_is_composite_: pkval = pkval[0]
         return real_entity_subclass, pkval, avdict
+    def _get_row_parser_(entity, attr_offsets):
+        key = tuple(sorted((attr.id, tuple(offsets)) for attr, offsets in iteritems(attr_offsets)))
+        parser = entity._row_parsers_.get(key)
+        if parser is not None: return parser
+        discr_attr = entity._discriminator_attr_
+        if not discr_attr: parser = entity._generate_row_parser_(entity, attr_offsets)
+        else:
+            discr_offset = attr_offsets[discr_attr][0]
+            code2cls = discr_attr.code2cls
+            subclass_parsers = {}
+            def parser(row):
+                discr_value = discr_attr.validate(row[discr_offset], None, entity, from_db=True)
+                real_entity_subclass = code2cls[discr_value]
+                parse_row = subclass_parsers.get(real_entity_subclass)
+                if parse_row is None:
+                    parse_row = subclass_parsers[real_entity_subclass] = \
+                        entity._generate_row_parser_(real_entity_subclass, attr_offsets)
+                return parse_row(row)
+        entity._row_parsers_[key] = parser
+        return parser
+    def _generate_row_parser_(entity, real_entity_subclass, attr_offsets):
+        namespace = {'entity': entity, 'subclass': real_entity_subclass, 'attr_offsets': attr_offsets}
+        def name_of(obj):
+            name = '_%d' % len(namespace)
+            namespace[name] = obj
+            return name
+        lines = []
+        avdict_items = []
+        attr_vars = {}
+        for i, attr in enumerate(real_entity_subclass._attrs_):
+            offsets = attr_offsets.get(attr)
+            if offsets is None or attr.is_discriminator: continue
+            var = attr_vars[attr] = 'v%d' % i
+            if not attr.reverse:
+                validator_cls = next(cls for cls in attr.__class__.__mro__ if 'validate' in cls.__dict__)
+                if validator_cls in (Attribute, Required) and len(offsets) == 1 \
+                        and len(attr.converters) == 1 and attr.converters[0] is not None:
+                    lines.append('%s = row[%d]' % (var, offsets[0]))
+                    lines.append('if %s is not None: %s = %s(%s)'
+                                 % (var, var, name_of(attr.converters[0].sql2py), var))
+                    if validator_cls is Required:  # let validate() warn about incorrect empty values
+                        lines.append("if %s is None or %s == '': %s = %s.parse_value(row, %r)"
+                                     % (var, var, var, name_of(attr), list(offsets)))
+                else: lines.append('%s = %s.parse_value(row, %r)' % (var, name_of(attr), list(offsets)))
+            elif len(offsets) == 1:
+                lines.append('%s = row[%d]' % (var, offsets[0]))
+                lines.append('if %s is not None: %s = %s((%s,))'
+                             % (var, var, name_of(attr.py_type._get_by_raw_pkval_), var))
+            else:
+                lines.append('%s = (%s)' % (var, ', '.join('row[%d]' % offset for offset in offsets)))
+                lines.append('%s = None if None in %s else %s(%s)'
+                             % (var, var, name_of(attr.py_type._get_by_raw_pkval_), var))
+            if attr not in entity._pk_attrs_: avdict_items.append('%s: %s' % (name_of(attr), var))
+        pk_vars = [ attr_vars.get(attr) or name_of(real_entity_subclass._discriminator_)
+                    for attr in entity._pk_attrs_ ]
+        if entity._pk_is_composite_: pkval = '(%s)' % ', '.join(pk_vars)
+        else: pkval = pk_vars[0]
+        source = '\n'.join([
+            'def parse_row(row):',
+            '    try:' ] + [ '        ' + line for line in lines ] + [
+            '    except UnicodeDecodeError: return entity._parse_row_(row, attr_offsets)',
+            '    pkval = %s' % pkval,
+            '    assert %s' % ' and '.join('%s is not None' % var for var in pk_vars),
+            '    return subclass, pkval, {%s}' % ', '.join(avdict_items) ])
+        code = compile(source, '<%s row parser>' % real_entity_subclass.__name__, 'exec')
+        exec(code, namespace)
+        return namespace['parse_row']
     def _load_many_(entity, objects):
         database = entity._database_
         cache = database._get_cache()
@@ -4063,6 +4744,160 @@ class EntityMeta(type):
                 for obj in result:
                     if obj not in batch: throw(UnrepeatableReadError,
                                                'Phantom object %s disappeared' % safe_repr(obj))
+    def _construct_insert_sql_(entity, attrs, auto_pk, rows_count=None):
+        query_key = attrs if rows_count is None else (attrs, rows_count)
+        cached_sql = entity._insert_sql_cache_.get(query_key)
+        if cached_sql is not None: return cached_sql
+        columns = []
+        converters = []
+        for attr in attrs:
+            columns.extend(attr.columns)
+            converters.extend(attr.converters)
+        assert len(columns) == len(converters)
+        database = entity._database_
+        if rows_count is not None:
+            n = len(converters)
+            rows = [ [ [ 'PARAM', (k*n + i, None, None), converter ] for i, converter in enumerate(converters) ]
+                     for k in xrange(rows_count) ]
+            sql_ast = [ 'INSERT_MANY', entity._table_, columns, rows ]
+        elif not columns and database.provider.dialect == 'Oracle':
+            sql_ast = [ 'INSERT', entity._table_, entity._pk_columns_,
+                        [ [ 'DEFAULT' ] for column in entity._pk_columns_ ] ]
+        else:
+            params = [ [ 'PARAM', (i, None, None), converter ] for i, converter in enumerate(converters) ]
+            sql_ast = [ 'INSERT', entity._table_, columns, params ]
+        if auto_pk and rows_count is None: sql_ast.append(entity._pk_columns_[0])
+        cached_sql = database._ast2sql(sql_ast)
+        entity._insert_sql_cache_[query_key] = cached_sql
+        return cached_sql
+    def _save_created_many_(entity, key, items):
+        auto_pk, attrs = key
+        database = entity._database_
+        provider = database.provider
+        if len(items) == 1 or not attrs or auto_pk and provider.insert_many_ids is None:
+            for obj, values, new_dbvals in items: obj._save_()
+            return
+        if not provider.insert_many_syntax:
+            assert not auto_pk
+            sql, adapter = entity._construct_insert_sql_(attrs, False)
+            arguments = [ adapter(values) for obj, values, new_dbvals in items ]
+            entity._exec_insert_many_(sql, arguments, items)
+            for obj, values, new_dbvals in items:
+                obj._set_inserted_(False, None, new_dbvals)
+                obj._finalize_save_()
+            return
+        rows_per_statement = max(1, provider.max_params_count // len(items[0][1]))
+        for start in xrange(0, len(items), rows_per_statement):
+            chunk = items[start:start+rows_per_statement]
+            if len(chunk) == 1:
+                chunk[0][0]._save_()
+                continue
+            if auto_pk and provider.insert_many_ids == 'sequence':
+                # ids are taken from the sequence before the insert, because the order
+                # of rows returned by INSERT ... RETURNING is not guaranteed
+                new_ids = entity._get_next_ids_(len(chunk))
+                if None in new_ids:
+                    for obj, values, new_dbvals in chunk: obj._save_()
+                    continue
+                sql, adapter = entity._construct_insert_sql_(entity._pk_attrs_ + attrs, False, len(chunk))
+                arguments = adapter([ value for (obj, values, new_dbvals), new_id in izip(chunk, new_ids)
+                                            for value in chain((new_id,), values) ])
+                entity._exec_insert_many_(sql, arguments, chunk)
+            else:
+                sql, adapter = entity._construct_insert_sql_(attrs, auto_pk, len(chunk))
+                arguments = adapter([ value for obj, values, new_dbvals in chunk for value in values ])
+                cursor = entity._exec_insert_many_(sql, arguments, chunk)
+                step = provider.insert_many_id_step
+                if not auto_pk: new_ids = repeat(None)
+                elif provider.insert_many_ids == 'first':
+                    new_ids = xrange(cursor.lastrowid, cursor.lastrowid + len(chunk) * step, step)
+                elif provider.insert_many_ids == 'last':
+                    new_ids = xrange(cursor.lastrowid - (len(chunk) - 1) * step, cursor.lastrowid + 1, step)
+                else: assert False, provider.insert_many_ids  # pragma: no cover
+            for (obj, values, new_dbvals), new_id in izip(chunk, new_ids):
+                obj._set_inserted_(auto_pk, new_id, new_dbvals)
+                obj._finalize_save_()
+    def _save_updated_many_(entity, key, items):
+        if len(items) == 1:
+            items[0][0]._save_()
+            return
+        query_key, optimistic_converters = key
+        obj = items[0][0]
+        sql, adapter = obj._construct_update_sql_(query_key, optimistic_converters)
+        arguments = [ adapter(values) for obj, values, new_dbvals in items ]
+        cursor = entity._database_._exec_sql(sql, arguments, start_transaction=True)
+        if 0 <= cursor.rowcount < len(items) and obj._session_cache_.db_session.optimistic:
+            for obj, values, new_dbvals in items:
+                diff = obj._find_updated_attributes_(new_dbvals)
+                if diff is None or diff: throw(OptimisticCheckError, obj.find_updated_attributes())
+            throw(OptimisticCheckError, 'Object %s or one of %d other %s objects was updated outside of current transaction'
+                                        % (safe_repr(items[0][0]), len(items) - 1, entity.__name__))
+        for obj, values, new_dbvals in items:
+            obj._set_updated_(new_dbvals)
+            obj._finalize_save_()
+    def _save_deleted_many_(entity, key, items):
+        if len(items) == 1 or entity._self_referencing_attrs_():
+            for obj, values, new_dbvals in items: obj._save_()
+            return
+        query_key, optimistic_converters = key
+        database = entity._database_
+        provider = database.provider
+        objects = [ obj for obj, values, new_dbvals in items ]
+        if query_key[0]:
+            sql, adapter = objects[0]._construct_delete_sql_(query_key, optimistic_converters)
+            batches = [ (objects, sql, [ adapter(values) for obj, values, new_dbvals in items ]) ]
+        else:
+            batches = []
+            max_batch_size = provider.max_params_count // len(entity._pk_columns_)
+            for start in xrange(0, len(objects), max_batch_size):
+                batch = objects[start:start+max_batch_size]
+                sql, adapter = entity._construct_batch_delete_sql_(len(batch))
+                batches.append((batch, sql, adapter(batch)))
+        optimistic = objects[0]._session_cache_.db_session.optimistic
+        for batch, sql, arguments in batches:
+            if not optimistic:
+                database._exec_sql(sql, arguments, start_transaction=True)
+                continue
+            database._exec_sql('SAVEPOINT pony_delete', start_transaction=True)
+            cursor = database._exec_sql(sql, arguments, start_transaction=True)
+            if 0 <= cursor.rowcount < len(batch):
+                # rows deleted by the batch are restored and the objects are deleted one by one,
+                # so the object which was changed or deleted outside of current transaction is reported
+                database._exec_sql('ROLLBACK TO SAVEPOINT pony_delete')
+                if provider.release_savepoint_syntax: database._exec_sql('RELEASE SAVEPOINT pony_delete')
+                for obj in batch: obj._save_()
+            elif provider.release_savepoint_syntax: database._exec_sql('RELEASE SAVEPOINT pony_delete')
+        for obj in objects:
+            if obj._status_ == 'marked_to_delete':
+                obj._set_deleted_()
+                obj._finalize_save_()
+    def _construct_batch_delete_sql_(entity, batch_size):
+        cached_sql = entity._delete_sql_cache_.get(batch_size)
+        if cached_sql is not None: return cached_sql
+        row_value_syntax = entity._database_.provider.translator_cls.row_value_syntax
+        criteria_list = construct_batchload_criteria_list(
+            None, entity._pk_columns_, entity._pk_converters_, batch_size, row_value_syntax)
+        from_ast = [ 'FROM', [ None, 'TABLE', entity._table_ ] ]
+        sql_ast = [ 'DELETE', None, from_ast, [ 'WHERE' ] + criteria_list ]
+        cached_sql = entity._database_._ast2sql(sql_ast)
+        entity._delete_sql_cache_[batch_size] = cached_sql
+        return cached_sql
+    def _self_referencing_attrs_(entity):
+        root = entity._root_
+        return [ attr for attr in entity._attrs_with_columns_
+                 if attr.reverse and attr.py_type._root_ is root ]
+    def _get_next_ids_(entity, count):
+        database = entity._database_
+        sql, arguments = database.provider.get_next_ids_sql(entity._table_, entity._pk_columns_[0], count)
+        cursor = database._exec_sql(sql, arguments, start_transaction=True)
+        return [ row[0] for row in cursor.fetchall() ]
+    def _exec_insert_many_(entity, sql, arguments, items):
+        try: return entity._database_._exec_sql(sql, arguments, start_transaction=True)
+        except (IntegrityError, DatabaseError) as e:
+            msg = " ".join(tostring(arg) for arg in e.args)
+            exc_class = TransactionIntegrityError if isinstance(e, IntegrityError) else UnexpectedError
+            throw(exc_class, 'Object %r or one of %d other %s objects cannot be stored in the database. %s: %s'
+                             % (items[0][0], len(items) - 1, entity.__name__, e.__class__.__name__, msg), e)
     def _select_all(entity):
         return Query(entity._default_iter_name_, entity._default_genexpr_, {}, { '.0' : entity })
     def _query_from_args_(entity, args, kwargs, frame_depth):
@@ -4123,8 +4958,8 @@ class EntityMeta(type):
                 cache.objects.add(obj)
                 obj._pkval_ = pkval
                 obj._status_ = status
-                obj._vals_ = {}
-                obj._dbvals_ = {}
+                obj._vals_ = vals = entity._vals_type_()
+                obj._dbvals_ = vals if cache.read_only else entity._vals_type_()
                 obj._save_pos_ = None
                 obj._session_cache_ = cache
                 if pkval is not None:
@@ -4135,7 +4970,8 @@ class EntityMeta(type):
                 else: pairs = ((pk_attrs[0], pkval),)
                 if status == 'loaded':
                     assert undo_funcs is None
-                    obj._rbits_ = obj._wbits_ = 0
+                    obj._rbits_ = 0
+                    obj._wbits_ = None if cache.read_only else 0
                     for attr, val in pairs:
                         obj._vals_[attr] = val
                         if attr.reverse: attr.db_update_reverse(obj, NOT_LOADED, val)
@@ -4169,6 +5005,9 @@ class EntityMeta(type):
             pkval.append(val)
         if not entity._pk_is_composite_: pkval = pkval[0]
         else: pkval = tuple(pkval)
+        if entity._cache_ is not None and not for_update:
+            obj = entity._load_from_shared_cache_(pkval)
+            if obj is not None: return obj
         obj = entity._get_from_identity_map_(pkval, 'loaded', for_update)
         assert obj._status_ != 'cancelled'
         return obj
@@ -4312,6 +5151,54 @@ def unpickle_entity(d):
 def safe_repr(obj):
     return Entity.__repr__(obj)
 
+class CompactValues(object):
+    __slots__ = ()
+    _layout_ = ()
+    _slot_names_ = {}
+    def __getitem__(vals, attr):
+        try: return getattr(vals, vals._slot_names_[attr])
+        except AttributeError: raise KeyError(attr)
+    def __setitem__(vals, attr, val):
+        setattr(vals, vals._slot_names_[attr], val)
+    def __delitem__(vals, attr):
+        try: delattr(vals, vals._slot_names_[attr])
+        except AttributeError: raise KeyError(attr)
+    def __contains__(vals, attr):
+        name = vals._slot_names_.get(attr)
+        return name is not None and hasattr(vals, name)
+    def __len__(vals):
+        return sum(1 for attr, name in vals._layout_ if hasattr(vals, name))
+    def __iter__(vals):
+        return (attr for attr, name in vals._layout_ if hasattr(vals, name))
+    def get(vals, attr, default=None):
+        name = vals._slot_names_.get(attr)
+        if name is None: return default
+        return getattr(vals, name, default)
+    def pop(vals, attr, *default):
+        name = vals._slot_names_.get(attr)
+        try:
+            if name is None: raise AttributeError
+            val = getattr(vals, name)
+        except AttributeError:
+            if default: return default[0]
+            raise KeyError(attr)
+        delattr(vals, name)
+        return val
+    def update(vals, other):
+        for attr, val in iteritems(other): vals[attr] = val
+    def iteritems(vals):
+        for attr, name in vals._layout_:
+            val = getattr(vals, name, NOT_LOADED)
+            if val is not NOT_LOADED: yield attr, val
+    def items(vals):
+        return list(vals.iteritems())
+    def itervalues(vals):
+        for attr, val in vals.iteritems(): yield val
+    def values(vals):
+        return list(vals.itervalues())
+    def keys(vals):
+        return list(vals)
+
 class Entity(with_metaclass(EntityMeta)):
     __slots__ = '_session_cache_', '_status_', '_pkval_', '_newid_', '_dbvals_', '_vals_', '_rbits_', '_wbits_', '_save_pos_', '__weakref__'
     def __reduce__(obj):
@@ -4347,6 +5234,8 @@ class Entity(with_metaclass(EntityMeta)):
 
         undo_funcs = []
         cache = entity._database_._get_cache()
+        if cache.read_only: throw(TransactionError,
+            'Cannot create %s object: the database session is read-only' % entity.__name__)
         cache_indexes = cache.indexes
         indexes_update = {}
         with cache.flush_disabled():
@@ -4512,6 +5401,7 @@ class Entity(with_metaclass(EntityMeta)):
     def _attr_changed_(obj, attr):
         cache = obj._session_cache_
         if cache is None or not cache.is_alive: throw_db_session_is_over('assign new value to', obj, attr)
+        if cache.read_only: throw_db_session_is_read_only('assign new value to', obj, attr)
         if obj._status_ in del_statuses: throw_object_was_deleted(obj)
         status = obj._status_
         wbits = obj._wbits_
@@ -4537,6 +5427,7 @@ class Entity(with_metaclass(EntityMeta)):
         get_dbval = obj._dbvals_.get
         rbits = obj._rbits_
         wbits = obj._wbits_
+        composite_vals = [ (attrs, [ get_val(a) for a in attrs ]) for attrs in obj._composite_keys_ ]
         for attr, new_dbval in items_list(avdict):
             assert attr.pk_offset is None
             assert new_dbval is not NOT_LOADED
@@ -4557,16 +5448,14 @@ class Entity(with_metaclass(EntityMeta)):
                       % (obj.__class__.__name__, attr.name, obj, old_dbval, new_dbval))
 
             if attr.reverse: attr.db_update_reverse(obj, old_dbval, new_dbval)
+            old_val = get_val(attr)
             obj._dbvals_[attr] = new_dbval
-            if wbits & bit: del avdict[attr]
-            if attr.is_unique:
-                old_val = get_val(attr)
-                if old_val != new_dbval:
-                    cache.db_update_simple_index(obj, attr, old_val, new_dbval)
+            if wbits and wbits & bit: del avdict[attr]
+            if attr.is_unique and old_val != new_dbval:
+                cache.db_update_simple_index(obj, attr, old_val, new_dbval)
 
-        for attrs in obj._composite_keys_:
+        for attrs, vals in composite_vals:
             if any(attr in avdict for attr in attrs):
-                vals = [ get_val(a) for a in attrs ]  # In Python 2 var name leaks into the function scope!
                 prev_vals = tuple(vals)
                 for i, attr in enumerate(attrs):
                     if attr in avdict: vals[i] = avdict[attr]
@@ -4586,6 +5475,7 @@ class Entity(with_metaclass(EntityMeta)):
         if not is_recursive_call: undo_funcs = []
         cache = obj._session_cache_
         assert cache is not None and cache.is_alive
+        if cache.read_only: throw_db_session_is_read_only('delete object', obj)
         with cache.flush_disabled():
             get_val = obj._vals_.get
             undo_list = []
@@ -4689,6 +5579,7 @@ class Entity(with_metaclass(EntityMeta)):
     def set(obj, **kwargs):
         cache = obj._session_cache_
         if cache is None or not cache.is_alive: throw_db_session_is_over('change object', obj)
+        if cache.read_only: throw_db_session_is_read_only('change object', obj)
         if obj._status_ in del_statuses: throw_object_was_deleted(obj)
         with cache.flush_disabled():
             avdict, collection_avdict = obj._keyargs_to_avdicts_(kwargs)
@@ -4834,7 +5725,15 @@ class Entity(with_metaclass(EntityMeta)):
             del vals[attr]
             dbvals.pop(attr, None)
 
-    def _save_created_(obj):
+    def _has_unsaved_principal_objects_(obj):
+        if obj._status_ == 'created': attrs = obj._attrs_with_columns_
+        else: attrs = obj._attrs_with_bit_(obj._attrs_with_columns_, obj._wbits_)
+        for attr in attrs:
+            if not attr.reverse: continue
+            val = obj._vals_[attr]
+            if val is not None and val._status_ == 'created': return True
+        return False
+    def _construct_insert_values_(obj):
         auto_pk = (obj._pkval_ is None)
         attrs = []
         values = []
@@ -4852,29 +5751,13 @@ class Entity(with_metaclass(EntityMeta)):
                 else:
                     new_dbvals[attr] = val
                     values.extend(attr.get_raw_values(val))
-        attrs = tuple(attrs)
-
+        return auto_pk, tuple(attrs), values, new_dbvals
+    def _save_created_(obj):
+        auto_pk, attrs, values, new_dbvals = obj._construct_insert_values_()
         database = obj._database_
-        cached_sql = obj._insert_sql_cache_.get(attrs)
-        if cached_sql is None:
-            columns = []
-            converters = []
-            for attr in attrs:
-                columns.extend(attr.columns)
-                converters.extend(attr.converters)
-            assert len(columns) == len(converters)
-            params = [ [ 'PARAM', (i, None, None),  converter ] for i, converter in enumerate(converters) ]
-            entity = obj.__class__
-            if not columns and database.provider.dialect == 'Oracle':
-                sql_ast = [ 'INSERT', entity._table_, obj._pk_columns_,
-                            [ [ 'DEFAULT' ] for column in obj._pk_columns_ ] ]
-            else: sql_ast = [ 'INSERT', entity._table_, columns, params ]
-            if auto_pk: sql_ast.append(entity._pk_columns_[0])
-            sql, adapter = database._ast2sql(sql_ast)
-            entity._insert_sql_cache_[attrs] = sql, adapter
-        else: sql, adapter = cached_sql
-
+        sql, adapter = obj.__class__._construct_insert_sql_(attrs, auto_pk)
         arguments = adapter(values)
+        new_id = None
         try:
             if auto_pk: new_id = database._exec_sql(sql, arguments, returning_id=True,
                                                     start_transaction=True)
@@ -4888,7 +5771,8 @@ class Entity(with_metaclass(EntityMeta)):
             msg = " ".join(tostring(arg) for arg in e.args)
             throw(UnexpectedError, 'Object %r cannot be stored in the database. %s: %s'
                                    % (obj, e.__class__.__name__, msg), e)
-
+        obj._set_inserted_(auto_pk, new_id, new_dbvals)
+    def _set_inserted_(obj, auto_pk, new_id, new_dbvals):
         if auto_pk:
             pk_attrs = obj._pk_attrs_
             cache_index = obj._session_cache_.indexes[pk_attrs]
@@ -4902,7 +5786,7 @@ class Entity(with_metaclass(EntityMeta)):
         obj._rbits_ = obj._all_bits_except_volatile_
         obj._wbits_ = 0
         obj._update_dbvals_(True, new_dbvals)
-    def _save_updated_(obj):
+    def _construct_update_values_(obj):
         update_columns = []
         values = []
         new_dbvals = {}
@@ -4917,46 +5801,55 @@ class Entity(with_metaclass(EntityMeta)):
             else:
                 new_dbvals[attr] = val
                 values.extend(attr.get_raw_values(val))
-        if update_columns:
-            for attr in obj._pk_attrs_:
-                val = obj._vals_[attr]
-                values.extend(attr.get_raw_values(val))
-            cache = obj._session_cache_
-            optimistic_session = cache.db_session is None or cache.db_session.optimistic
-            if optimistic_session and obj not in cache.for_update:
-                optimistic_ops, optimistic_columns, optimistic_converters, optimistic_values = \
-                    obj._construct_optimistic_criteria_()
-                values.extend(optimistic_values)
-            else: optimistic_columns = optimistic_converters = optimistic_ops = ()
-            query_key = tuple(update_columns), tuple(optimistic_columns), tuple(optimistic_ops)
-            database = obj._database_
-            cached_sql = obj._update_sql_cache_.get(query_key)
-            if cached_sql is None:
-                update_converters = []
-                for attr in obj._attrs_with_bit_(obj._attrs_with_columns_, obj._wbits_):
-                    update_converters.extend(attr.converters)
-                assert len(update_columns) == len(update_converters)
-                update_params = [ [ 'PARAM', (i, None, None), converter ] for i, converter in enumerate(update_converters) ]
-                params_count = len(update_params)
-                where_list = [ 'WHERE' ]
-                pk_columns = obj._pk_columns_
-                pk_converters = obj._pk_converters_
-                params_count = populate_criteria_list(where_list, pk_columns, pk_converters, repeat('EQ'), params_count)
-                if optimistic_columns: populate_criteria_list(
-                    where_list, optimistic_columns, optimistic_converters, optimistic_ops, params_count, optimistic=True)
-                sql_ast = [ 'UPDATE', obj._table_, list(izip(update_columns, update_params)), where_list ]
-                sql, adapter = database._ast2sql(sql_ast)
-                obj._update_sql_cache_[query_key] = sql, adapter
-            else: sql, adapter = cached_sql
+        if not update_columns: return None, None, values, new_dbvals
+        for attr in obj._pk_attrs_:
+            val = obj._vals_[attr]
+            values.extend(attr.get_raw_values(val))
+        cache = obj._session_cache_
+        optimistic_session = cache.db_session is None or cache.db_session.optimistic
+        if optimistic_session and obj not in cache.for_update:
+            optimistic_ops, optimistic_columns, optimistic_converters, optimistic_values = \
+                obj._construct_optimistic_criteria_()
+            values.extend(optimistic_values)
+        else: optimistic_columns = optimistic_converters = optimistic_ops = ()
+        query_key = tuple(update_columns), tuple(optimistic_columns), tuple(optimistic_ops)
+        return query_key, tuple(optimistic_converters), values, new_dbvals
+    def _construct_update_sql_(obj, query_key, optimistic_converters):
+        cached_sql = obj._update_sql_cache_.get(query_key)
+        if cached_sql is not None: return cached_sql
+        update_columns, optimistic_columns, optimistic_ops = query_key
+        update_converters = []
+        for attr in obj._attrs_with_bit_(obj._attrs_with_columns_, obj._wbits_):
+            update_converters.extend(attr.converters)
+        assert len(update_columns) == len(update_converters)
+        update_params = [ [ 'PARAM', (i, None, None), converter ] for i, converter in enumerate(update_converters) ]
+        params_count = len(update_params)
+        where_list = [ 'WHERE' ]
+        pk_columns = obj._pk_columns_
+        pk_converters = obj._pk_converters_
+        params_count = populate_criteria_list(where_list, pk_columns, pk_converters, repeat('EQ'), params_count)
+        if optimistic_columns: populate_criteria_list(
+            where_list, optimistic_columns, optimistic_converters, optimistic_ops, params_count, optimistic=True)
+        sql_ast = [ 'UPDATE', obj._table_, list(izip(update_columns, update_params)), where_list ]
+        cached_sql = obj._database_._ast2sql(sql_ast)
+        obj.__class__._update_sql_cache_[query_key] = cached_sql
+        return cached_sql
+    def _save_updated_(obj):
+        query_key, optimistic_converters, values, new_dbvals = obj._construct_update_values_()
+        if query_key is not None:
+            sql, adapter = obj._construct_update_sql_(query_key, optimistic_converters)
             arguments = adapter(values)
-            cursor = database._exec_sql(sql, arguments, start_transaction=True)
-            if cursor.rowcount == 0 and cache.db_session.optimistic:
+            cursor = obj._database_._exec_sql(sql, arguments, start_transaction=True)
+            if cursor.rowcount == 0 and obj._session_cache_.db_session.optimistic:
                 throw(OptimisticCheckError, obj.find_updated_attributes())
+        obj._set_updated_(new_dbvals)
+    def _set_updated_(obj, new_dbvals):
         obj._status_ = 'updated'
         obj._rbits_ |= obj._wbits_ & obj._all_bits_except_volatile_
         obj._wbits_ = 0
         obj._update_dbvals_(False, new_dbvals)
-    def _save_deleted_(obj):
+        if obj._cache_ is not None: obj._session_cache_.discard_from_shared_cache(obj)
+    def _construct_delete_values_(obj):
         values = []
         values.extend(obj._get_raw_pkval_())
         cache = obj._session_cache_
@@ -4967,26 +5860,85 @@ class Entity(with_metaclass(EntityMeta)):
             values.extend(optimistic_values)
         else: optimistic_columns = optimistic_converters = optimistic_ops = ()
         query_key = tuple(optimistic_columns), tuple(optimistic_ops)
-        database = obj._database_
+        return query_key, tuple(optimistic_converters), values
+    def _construct_delete_sql_(obj, query_key, optimistic_converters):
         cached_sql = obj._delete_sql_cache_.get(query_key)
-        if cached_sql is None:
-            where_list = [ 'WHERE' ]
-            params_count = populate_criteria_list(where_list, obj._pk_columns_, obj._pk_converters_, repeat('EQ'))
-            if optimistic_columns: populate_criteria_list(
-                where_list, optimistic_columns, optimistic_converters, optimistic_ops, params_count, optimistic=True)
-            from_ast = [ 'FROM', [ None, 'TABLE', obj._table_ ] ]
-            sql_ast = [ 'DELETE', None, from_ast, where_list ]
-            sql, adapter = database._ast2sql(sql_ast)
-            obj.__class__._delete_sql_cache_[query_key] = sql, adapter
-        else: sql, adapter = cached_sql
+        if cached_sql is not None: return cached_sql
+        optimistic_columns, optimistic_ops = query_key
+        where_list = [ 'WHERE' ]
+        params_count = populate_criteria_list(where_list, obj._pk_columns_, obj._pk_converters_, repeat('EQ'))
+        if optimistic_columns: populate_criteria_list(
+            where_list, optimistic_columns, optimistic_converters, optimistic_ops, params_count, optimistic=True)
+        from_ast = [ 'FROM', [ None, 'TABLE', obj._table_ ] ]
+        sql_ast = [ 'DELETE', None, from_ast, where_list ]
+        cached_sql = obj._database_._ast2sql(sql_ast)
+        obj.__class__._delete_sql_cache_[query_key] = cached_sql
+        return cached_sql
+    def _save_deleted_(obj):
+        query_key, optimistic_converters, values = obj._construct_delete_values_()
+        sql, adapter = obj._construct_delete_sql_(query_key, optimistic_converters)
         arguments = adapter(values)
-        cursor = database._exec_sql(sql, arguments, start_transaction=True)
-        if cursor.rowcount == 0 and cache.db_session.optimistic:
+        cursor = obj._database_._exec_sql(sql, arguments, start_transaction=True)
+        if cursor.rowcount == 0 and obj._session_cache_.db_session.optimistic:
             throw(OptimisticCheckError, obj.find_updated_attributes())
+        obj._set_deleted_()
+    def _set_deleted_(obj):
         obj._status_ = 'deleted'
-        cache.indexes[obj._pk_attrs_].pop(obj._pkval_)
+        obj._session_cache_.indexes[obj._pk_attrs_].pop(obj._pkval_)
+        if obj._cache_ is not None: obj._session_cache_.discard_from_shared_cache(obj)
+    def _store_in_shared_cache_(obj):
+        if obj._status_ != 'loaded': return
+        entity = obj.__class__
+        dbvals = obj._dbvals_
+        data = {}
+        for attr in entity._shared_cache_attrs_:
+            val = dbvals.get(attr, NOT_LOADED)
+            if val is NOT_LOADED: return
+            if attr.reverse and val is not None: val = val._get_raw_pkval_()
+            data[attr.name] = val
+        # the data may be read before a commit of another session which invalidated the shared cache
+        # after this session was started; such data is not stored, as it may be already outdated
+        database = entity._database_
+        version = obj._session_cache_.shared_cache_version
+        if database._shared_cache_version != version: return
+        shared_cache = entity._cache_
+        raw_pkval = obj._get_raw_pkval_()
+        key = entity.__name__, raw_pkval
+        shared_cache.set(key, data)
+        if database._shared_cache_version != version:
+            shared_cache.delete(key)
+            return
+        for attr in entity._simple_keys_:
+            val = data.get(attr.name)
+            if val is not None and not attr.reverse: shared_cache.set((entity.__name__, attr.name, val), raw_pkval)
 
+    def _evict_(obj):
+        cache = obj._session_cache_
+        if obj._status_ != 'loaded' or obj in cache.for_update: return False
+        for objects in itervalues(cache.modified_collections):
+            if obj in objects: return False
+        get_val = obj._vals_.get
+        cache_indexes = cache.indexes
+        for attr in obj._simple_keys_:
+            val = get_val(attr)
+            if val is not None: cache_indexes[attr].pop(val, None)
+        for attrs in obj._composite_keys_:
+            vals = tuple(get_val(attr) for attr in attrs)
+            if None not in vals: cache_indexes[attrs].pop(vals, None)
+        cache_indexes[obj._pk_attrs_].pop(obj._pkval_, None)
+        cache.seeds[obj._pk_attrs_].discard(obj)
+        cache.objects.discard(obj)
+        cache.fetched_groups.pop(obj, None)
+        obj._dbvals_ = obj._session_cache_ = None
+        for attr, setdata in iteritems(obj._vals_):
+            if attr.is_collection and setdata is not None and not setdata.is_fully_loaded: obj._vals_[attr] = None
+        return True
     def find_updated_attributes(obj):
+        diff = obj._find_updated_attributes_()
+        if diff is None: return "Object %s was deleted outside of current transaction" % safe_repr(obj)
+        return "Object %s was updated outside of current transaction%s" % (
+            safe_repr(obj), ('. Changes: %s' % ', '.join(diff) if diff else ''))
+    def _find_updated_attributes_(obj, new_dbvals=None):
         entity = obj.__class__
         attrs_to_select = []
         attrs_to_select.extend(entity._pk_attrs_)
@@ -5019,20 +5971,18 @@ class Entity(with_metaclass(EntityMeta)):
         arguments = adapter(obj._get_raw_pkval_())
         cursor = database._exec_sql(sql, arguments)
         row = cursor.fetchone()
-        if row is None:
-            return "Object %s was deleted outside of current transaction" % safe_repr(obj)
+        if row is None: return None
 
         real_entity_subclass, pkval, avdict = entity._parse_row_(row, attr_offsets)
         diff = []
         for attr, new_dbval in avdict.items():
-            old_dbval = obj._dbvals_[attr]
+            if new_dbvals is not None and attr in new_dbvals: old_dbval = new_dbvals[attr]
+            else: old_dbval = obj._dbvals_[attr]
             converter = attr.converters[0]
             if old_dbval != new_dbval and (
                     attr.reverse or not converter.dbvals_equal(old_dbval, new_dbval)):
                 diff.append('%s (%r -> %r)' % (attr.name, old_dbval, new_dbval))
-
-        return "Object %s was updated outside of current transaction%s" % (
-            safe_repr(obj), ('. Changes: %s' % ', '.join(diff) if diff else ''))
+        return diff
 
     def _save_(obj, dependent_objects=None):
         status = obj._status_
@@ -5044,6 +5994,8 @@ class Entity(with_metaclass(EntityMeta)):
         elif status == 'marked_to_delete': obj._save_deleted_()
         else: assert False, "_save_() called for object %r with incorrect status %s" % (obj, status)  # pragma: no cover
 
+        obj._finalize_save_()
+    def _finalize_save_(obj):
         assert obj._status_ in saved_statuses
         cache = obj._session_cache_
         assert cache is not None and cache.is_alive
@@ -5056,6 +6008,8 @@ class Entity(with_metaclass(EntityMeta)):
             objects_to_save[save_pos] = None
         obj._save_pos_ = None
     def flush(obj):
+        aio = sys.modules.get('pony.orm.aio')
+        if aio is not None and aio.in_task_session(): return aio.run(obj.flush)
         if obj._status_ not in ('created', 'modified', 'marked_to_delete'):
             return
 
@@ -5065,6 +6019,8 @@ class Entity(with_metaclass(EntityMeta)):
         with cache.flush_disabled():
             obj._before_save_() # should be inside flush_disabled to prevent infinite recursion
                                 # TODO: add to documentation that flush is disabled inside before_xxx hooks
+            cache.invalidate_query_results({obj._table_})
+            cache.modified_tables.add(obj._table_)
             obj._save_()
         cache.call_after_save_hooks()
     def _before_save_(obj):
@@ -5318,6 +6274,9 @@ class Query(object):
         query._prefetch = False
         query._entities_to_prefetch = set()
         query._attrs_to_prefetch_dict = defaultdict(set)
+        query._counts_to_prefetch = set()
+        query._cached = False
+        query._cache_ttl = None
     def _clone(query, **kwargs):
         new_query = object.__new__(Query)
         new_query.__dict__.update(query.__dict__)
@@ -5362,23 +6321,18 @@ class Query(object):
         cache = database._get_cache()
         if query._for_update: cache.immediate = True
         cache.prepare_connection_for_query_execution()  # may clear cache.query_results
-        try: result = cache.query_results[query_key]
+        try: table_names, result = cache.query_results[query_key]
         except KeyError:
-            cursor = database._exec_sql(sql, arguments)
-            if isinstance(translator.expr_type, EntityMeta):
-                entity = translator.expr_type
-                result = entity._fetch_objects(cursor, attr_offsets, for_update=query._for_update,
-                                               used_attrs=translator.get_used_attrs())
-            elif len(translator.row_layout) == 1:
-                func, slice_or_offset, src = translator.row_layout[0]
-                result = list(starmap(func, cursor.fetchall()))
+            if query._cached:
+                result = query._parse_rows(query._fetch_shared_rows(sql, arguments, query_key), attr_offsets)
             else:
-                result = [ tuple(func(sql_row[slice_or_offset])
-                                 for func, slice_or_offset, src in translator.row_layout)
-                           for sql_row in cursor.fetchall() ]
-                for i, t in enumerate(translator.expr_type):
-                    if isinstance(t, EntityMeta) and t._subclasses_: t._load_many_(row[i] for row in result)
-            if query_key is not None: cache.query_results[query_key] = result
+                cursor = database._exec_sql(sql, arguments)
+                if isinstance(translator.expr_type, EntityMeta):
+                    entity = translator.expr_type
+                    result = entity._fetch_objects(cursor, attr_offsets, for_update=query._for_update,
+                                                   used_attrs=translator.get_used_attrs())
+                else: result = query._parse_rows(cursor.fetchall(), attr_offsets)
+            if query_key is not None: cache.query_results[query_key] = translator.get_table_names(), result
         else:
             stats = database._dblocal.stats
             stat = stats.get(sql)
@@ -5387,6 +6341,98 @@ class Query(object):
 
         if query._prefetch: query._do_prefetch(result)
         return QueryResult(result, query, translator.expr_type, translator.col_names)
+    def _fetch_shared_rows(query, sql, arguments, query_key):
+        database = query._database
+        cache = database._get_cache()
+        table_names = query._translator.get_table_names()
+        modified_tables = cache.modified_tables
+        if query_key is None or None in table_names or None in modified_tables \
+                or not modified_tables.isdisjoint(table_names):
+            return database._exec_sql(sql, arguments).fetchall()
+        result_cache = database._query_result_cache
+        versions = result_cache.get_versions(table_names)
+        if cache.in_transaction and result_cache.is_newer(versions, cache.snapshot_version):
+            # the transaction sees a snapshot taken before another session changed these tables
+            return database._exec_sql(sql, arguments).fetchall()
+        rows = result_cache.get(query_key, versions)
+        if rows is not None:
+            stats = database._dblocal.stats
+            stat = stats.get(sql)
+            if stat is not None: stat.cache_count += 1
+            else: stats[sql] = QueryStat(sql)
+            return rows
+        rows = tuple(database._exec_sql(sql, arguments).fetchall())
+        if not result_cache.is_newer(versions, cache.snapshot_version):
+            result_cache.set(query_key, versions, rows, query._cache_ttl)
+        return rows
+    @cut_traceback
+    def cached(query, ttl=None):
+        if ttl is not None and ttl <= 0: throw(ValueError, 'ttl must be positive number. Got: %r' % ttl)
+        return query._clone(_cached=True, _cache_ttl=ttl)
+    def _parse_rows(query, rows, attr_offsets):
+        translator = query._translator
+        if isinstance(translator.expr_type, EntityMeta):
+            entity = translator.expr_type
+            return entity._rows_to_objects_(rows, attr_offsets, query._for_update, translator.get_used_attrs())
+        if len(translator.row_layout) == 1:
+            func, slice_or_offset, src = translator.row_layout[0]
+            return list(starmap(func, rows))
+        result = [ tuple(func(sql_row[slice_or_offset])
+                         for func, slice_or_offset, src in translator.row_layout)
+                   for sql_row in rows ]
+        for i, t in enumerate(translator.expr_type):
+            if isinstance(t, EntityMeta) and t._subclasses_: t._load_many_(row[i] for row in result)
+        return result
+    @cut_traceback
+    def iterate(query, chunk_size=1000, evict=False):
+        if chunk_size < 1: throw(ValueError, 'chunk_size must be positive number. Got: %r' % chunk_size)
+        return query._iterate(chunk_size, evict)
+    def _iterate(query, chunk_size, evict):
+        translator = query._translator
+        sql, arguments, attr_offsets, query_key = query._construct_sql_and_arguments()
+        database = query._database
+        cache = database._get_cache()
+        if query._for_update: cache.immediate = True
+        cursor = database._exec_sql(sql, arguments, server_side_cursor=True)
+        cursor.arraysize = chunk_size
+        expr_type = translator.expr_type
+        if isinstance(expr_type, EntityMeta): entity_columns = None
+        elif type(expr_type) is tuple:
+            entity_columns = [ i for i, t in enumerate(expr_type) if isinstance(t, EntityMeta) ]
+        else: entity_columns = []
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows: break
+                result = query._parse_rows(rows, attr_offsets)
+                if query._prefetch: query._do_prefetch(result)
+                for item in result: yield item
+                if not evict: continue
+                if entity_columns is None: objects = result
+                else: objects = [ row[i] for row in result for i in entity_columns ]
+                for obj in objects:
+                    if obj._session_cache_ is cache: obj._evict_()
+                cache.query_results.clear()
+        finally: cursor.close()
+    @cut_traceback
+    def as_records(query):
+        entity = query._translator.expr_type
+        if not isinstance(entity, EntityMeta): throw(TypeError,
+            'as_records() can be used only with queries which return entity instances')
+        sql, arguments, attr_offsets, query_key = query._construct_sql_and_arguments()
+        database = query._database
+        if query._for_update: database._get_cache().immediate = True
+        cursor = database._exec_sql(sql, arguments)
+        return entity._rows_to_records_(cursor.fetchall(), attr_offsets)
+    @cut_traceback
+    def to_columns(query, chunk_size=10000):
+        from pony.orm import columnar
+        return columnar.fetch_columns(query, chunk_size, use_numpy=columnar.numpy is not None)
+    @cut_traceback
+    def to_numpy(query, chunk_size=10000):
+        from pony.orm import columnar
+        if columnar.numpy is None: throw(ImportError, 'NumPy is required for to_numpy() method')
+        return columnar.fetch_columns(query, chunk_size, use_numpy=True)
     @cut_traceback
     def prefetch(query, *args):
         query = query._clone(_entities_to_prefetch=query._entities_to_prefetch.copy(),
@@ -5408,6 +6454,17 @@ class Query(object):
             else: throw(TypeError, 'Argument of prefetch() query method must be entity class or attribute. '
                                    'Got: %r' % arg)
         return query
+    @cut_traceback
+    def prefetch_count(query, *attrs):
+        query = query._clone(_counts_to_prefetch=query._counts_to_prefetch.copy())
+        query._prefetch = True
+        for attr in attrs:
+            if not isinstance(attr, Set): throw(TypeError,
+                'Argument of prefetch_count() query method must be collection attribute. Got: %r' % attr)
+            if query._database is not attr.entity._database_: throw(TypeError,
+                'Entity of attribute %s belongs to different database and cannot be prefetched' % attr)
+            query._counts_to_prefetch.add(attr)
+        return query
     def _do_prefetch(query, result):
         expr_type = query._translator.expr_type
         object_list = []
@@ -5429,44 +6486,58 @@ class Query(object):
                         add_to_object_set(obj)
                         append_to_object_list(obj)
 
-        cache = query._database._get_cache()
         entities_to_prefetch = query._entities_to_prefetch
         attrs_to_prefetch_dict = query._attrs_to_prefetch_dict
         prefetching_attrs_cache = {}
-        for obj in object_list:
-            entity = obj.__class__
-            if obj in cache.seeds[entity._pk_attrs_]: obj._load_()
+        while object_list:
+            objects_by_root = defaultdict(list)
+            for obj in object_list: objects_by_root[obj._root_].append(obj)
+            for root, objects in iteritems(objects_by_root): root._load_many_(objects)
 
-            all_attrs_to_prefetch = prefetching_attrs_cache.get(entity)
-            if all_attrs_to_prefetch is None:
-                all_attrs_to_prefetch = []
-                append = all_attrs_to_prefetch.append
-                attrs_to_prefetch = attrs_to_prefetch_dict[entity]
-                for attr in obj._attrs_:
+            objects_by_entity = defaultdict(list)
+            for obj in object_list:
+                if obj._status_ not in del_statuses: objects_by_entity[obj.__class__].append(obj)
+            level_objects = object_list
+            object_list = []
+            append_to_object_list = object_list.append
+            for entity, objects in iteritems(objects_by_entity):
+                all_attrs_to_prefetch = prefetching_attrs_cache.get(entity)
+                if all_attrs_to_prefetch is None:
+                    all_attrs_to_prefetch = []
+                    append = all_attrs_to_prefetch.append
+                    attrs_to_prefetch = attrs_to_prefetch_dict[entity]
+                    for attr in entity._attrs_:
+                        if attr.is_collection:
+                            if attr in attrs_to_prefetch: append(attr)
+                        elif attr.is_relation:
+                            if attr in attrs_to_prefetch or attr.py_type in entities_to_prefetch: append(attr)
+                        elif attr.lazy:
+                            if attr in attrs_to_prefetch: append(attr)
+                    prefetching_attrs_cache[entity] = all_attrs_to_prefetch
+
+                for attr in all_attrs_to_prefetch:
                     if attr.is_collection:
-                        if attr in attrs_to_prefetch: append(attr)
+                        if not isinstance(attr, Set): throw(NotImplementedError)
+                        attr.load_many(objects)
+                        for obj in objects:
+                            setdata = obj._vals_.get(attr)
+                            if setdata is None: continue
+                            for obj2 in setdata:
+                                if obj2 not in object_set:
+                                    add_to_object_set(obj2)
+                                    append_to_object_list(obj2)
                     elif attr.is_relation:
-                        if attr in attrs_to_prefetch or attr.py_type in entities_to_prefetch: append(attr)
-                    elif attr.lazy:
-                        if attr in attrs_to_prefetch: append(attr)
-                prefetching_attrs_cache[entity] = all_attrs_to_prefetch
-
-            for attr in all_attrs_to_prefetch:
-                if attr.is_collection:
-                    if not isinstance(attr, Set): throw(NotImplementedError)
-                    setdata = obj._vals_.get(attr)
-                    if setdata is None or not setdata.is_fully_loaded: setdata = attr.load(obj)
-                    for obj2 in setdata:
-                        if obj2 not in object_set:
-                            add_to_object_set(obj2)
-                            append_to_object_list(obj2)
-                elif attr.is_relation:
-                    obj2 = attr.get(obj)
-                    if obj2 is not None and obj2 not in object_set:
-                        add_to_object_set(obj2)
-                        append_to_object_list(obj2)
-                elif attr.lazy: attr.get(obj)
-                else: assert False  # pragma: no cover
+                        attr.load_many(objects)
+                        for obj in objects:
+                            obj2 = obj._vals_.get(attr)
+                            if obj2 is not None and obj2 not in object_set:
+                                add_to_object_set(obj2)
+                                append_to_object_list(obj2)
+                    elif attr.lazy: attr.load_many(objects)
+                    else: assert False  # pragma: no cover
+            for attr in query._counts_to_prefetch:
+                attr.load_counts([ obj for obj in level_objects
+                                   if isinstance(obj, attr.entity) and obj._status_ not in del_statuses ])
     @cut_traceback
     def show(query, width=None):
         query._fetch().show(width)
@@ -5521,6 +6592,11 @@ class Query(object):
         cache.immediate = True
         cache.prepare_connection_for_query_execution()  # may clear cache.query_results
         cursor = database._exec_sql(sql, arguments)
+        entity = translator.expr_type
+        if isinstance(entity, EntityMeta): cache.modified_tables.add(entity._table_)
+        if isinstance(entity, EntityMeta) and entity._cache_ is not None:
+            entity._cache_.clear()
+            cache.shared_cache_keys.append((entity._cache_, None))
         return cursor.rowcount
     @cut_traceback
     def __len__(query):
@@ -5719,6 +6795,13 @@ class Query(object):
         if start >= stop: return []
         return query._fetch(range=(start, stop))
     @cut_traceback
+    def fetch(query, limit=None, offset=None):
+        aio = sys.modules.get('pony.orm.aio')
+        if aio is not None and aio.in_task_session(): return aio.run(query.fetch, limit, offset)
+        if limit is not None: return query.limit(limit, offset)
+        if offset: throw(TypeError, "Parameter 'offset' of fetch() method cannot be used without 'limit'")
+        return query._fetch()
+    @cut_traceback
     def limit(query, limit, offset=None):
         start = offset or 0
         stop = start + limit
@@ -5728,14 +6811,64 @@ class Query(object):
         start = (pagenum - 1) * pagesize
         stop = pagenum * pagesize
         return query[start:stop]
+    @cut_traceback
+    def paginate_after(query, last_key, order_by=None):
+        entity = query._translator.expr_type
+        if not isinstance(entity, EntityMeta): throw(TypeError,
+            'Keyset pagination is limited to queries which return simple list of objects')
+        if order_by is None: order_by = ()
+        elif not isinstance(order_by, (tuple, list)): order_by = (order_by,)
+        keyattrs = []
+        for x in order_by:
+            if isinstance(x, DescWrapper): keyattrs.append((x.attr, True))
+            elif isinstance(x, Attribute): keyattrs.append((x, False))
+            else: throw(TypeError, 'paginate_after() method receive an argument of invalid type: %r' % x)
+        desc = keyattrs[-1][1] if keyattrs else False
+        used_attrs = set(attr for attr, _ in keyattrs)
+        keyattrs.extend((attr, desc) for attr in entity._pk_attrs_ if attr not in used_attrs)
+        query = query.order_by(*[ DescWrapper(attr) if desc else attr for attr, desc in keyattrs ])
+        if last_key is None: return query
+
+        if isinstance(last_key, Entity):
+            if not isinstance(last_key, entity): throw(TypeError,
+                'Instance of %s expected. Got: %r' % (entity.__name__, last_key))
+            values = [ attr.__get__(last_key) for attr, desc in keyattrs ]
+        else:
+            values = last_key if isinstance(last_key, tuple) else (last_key,)
+            if len(values) != len(keyattrs): throw(TypeError, 'Expected %d key values (%s). Got: %r'
+                % (len(keyattrs), ', '.join(attr.name for attr, desc in keyattrs), last_key))
+        keyset = []
+        value_dict = {}
+        next_id = query._next_kwarg_id
+        for (attr, desc), val in izip(keyattrs, values):
+            if val is None:
+                keyset.append((attr, desc, None))
+                continue
+            value_dict[next_id] = attr.validate(val, None, entity, from_db=False)
+            keyset.append((attr, desc, next_id))
+            next_id += 1
+
+        tup = (('apply_keyset', tuple(keyset)),)
+        new_key = HashableDict(query._key, filters=query._key['filters'] + tup)
+        new_filters = query._filters + tup
+        new_translator = query._database._translator_cache.get(new_key)
+        if new_translator is None:
+            new_translator = query._translator.apply_keyset(tuple(keyset))
+            query._database._translator_cache[new_key] = new_translator
+        new_query = query._clone(_key=new_key, _filters=new_filters, _translator=new_translator,
+                                 _next_kwarg_id=next_id, _vars=query._vars.copy())
+        new_query._vars.update(value_dict)
+        return new_query
     def _aggregate(query, aggr_func_name):
         translator = query._translator
         sql, arguments, attr_offsets, query_key = query._construct_sql_and_arguments(aggr_func_name=aggr_func_name)
         cache = query._database._get_cache()
-        try: result = cache.query_results[query_key]
+        try: table_names, result = cache.query_results[query_key]
         except KeyError:
-            cursor = query._database._exec_sql(sql, arguments)
-            row = cursor.fetchone()
+            if query._cached:
+                rows = query._fetch_shared_rows(sql, arguments, query_key)
+                row = rows[0] if rows else None
+            else: row = query._database._exec_sql(sql, arguments).fetchone()
             if row is not None: result = row[0]
             else: result = None
             if result is None and aggr_func_name == 'SUM': result = 0
@@ -5746,7 +6879,7 @@ class Query(object):
                 provider = query._database.provider
                 converter = provider.get_converter_by_py_type(expr_type)
                 result = converter.sql2py(result)
-            if query_key is not None: cache.query_results[query_key] = result
+            if query_key is not None: cache.query_results[query_key] = translator.get_table_names(), result
         return result
     @cut_traceback
     def sum(query):
@@ -5780,6 +6913,16 @@ def strcut(s, width):
     else:
         return s[:width-3] + '...'
 
+class EntityRecord(tuple):
+    __slots__ = ()
+    _entity_ = None
+    _fields = ()
+    def __repr__(record):
+        return '%s(%s)' % (record.__class__.__name__,
+                           ', '.join('%s=%r' % pair for pair in izip(record._fields, record)))
+    def to_dict(record):
+        return dict(izip(record._fields, record))
+
 class QueryResult(list):
     __slots__ = '_query', '_expr_type', '_col_names'
     def __init__(result, list, query, expr_type, col_names):
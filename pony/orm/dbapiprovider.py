@@ -2,6 +2,10 @@ from __future__ import absolute_import, print_function, division
 from pony.py23compat import PY2, basestring, unicode, buffer, int_types
 
 import os, re, json
+from bisect import bisect_left
+from collections import deque
+from threading import Condition, Lock
+from time import time as current_time
 from decimal import Decimal, InvalidOperation
 from datetime import datetime, date, time, timedelta
 from uuid import uuid4, UUID
@@ -92,6 +96,10 @@ class DBAPIProvider(object):
     max_time_precision = default_time_precision = 6
     uint64_support = False
     select_for_update_nowait_syntax = True
+    insert_many_syntax = True
+    insert_many_ids = None
+    insert_many_id_step = 1
+    release_savepoint_syntax = True
 
     # SQLite and PostgreSQL does not limit varchar max length.
     varchar_default_max_len = None
@@ -109,8 +117,12 @@ class DBAPIProvider(object):
 
     def __init__(provider, *args, **kwargs):
         pool_mockup = kwargs.pop('pony_pool_mockup', None)
+        provider.pool_options = { name[5:]: kwargs.pop(name) for name in shared_pool_options if name in kwargs }
         if pool_mockup: provider.pool = pool_mockup
-        else: provider.pool = provider.get_pool(*args, **kwargs)
+        else:
+            pool = provider.get_pool(*args, **kwargs)
+            if provider.pool_options: pool = SharedPool(pool, **provider.pool_options)
+            provider.pool = pool
         connection = provider.connect()
         provider.inspect_connection(connection)
         provider.release(connection)
@@ -248,6 +260,29 @@ class DBAPIProvider(object):
         if core.local.debug: core.log_orm('DISCONNECT')
         provider.pool.disconnect()
 
+    def server_side_cursor(provider, connection):
+        return connection.cursor()
+
+    explain_prefix = 'EXPLAIN '
+
+    @wrap_dbapi_exceptions
+    def explain(provider, connection, sql, arguments=None, in_transaction=False):
+        cursor = connection.cursor()
+        if not in_transaction:
+            provider.execute(cursor, provider.explain_prefix + sql, arguments)
+            return cursor.fetchall()
+        # failed statement can abort the whole transaction (PostgreSQL), so EXPLAIN is isolated by savepoint
+        provider.execute(cursor, 'SAVEPOINT pony_explain')
+        try:
+            provider.execute(cursor, provider.explain_prefix + sql, arguments)
+            result = cursor.fetchall()
+        except:
+            provider.execute(cursor, 'ROLLBACK TO SAVEPOINT pony_explain')
+            provider.execute(cursor, 'RELEASE SAVEPOINT pony_explain')
+            raise
+        provider.execute(cursor, 'RELEASE SAVEPOINT pony_explain')
+        return result
+
     @wrap_dbapi_exceptions
     def execute(provider, cursor, sql, arguments=None, returning_id=False):
         if type(arguments) is list:
@@ -305,41 +340,247 @@ class DBAPIProvider(object):
         sql = 'DROP TABLE %s' % provider.quote_name(table_name)
         cursor.execute(sql)
 
-class Pool(localbase):
+shared_pool_options = ('pool_max_size', 'pool_min_size', 'pool_timeout',
+                       'pool_max_idle_time', 'pool_max_lifetime', 'pool_pre_ping')
+
+class PoolStats(object):
+    wait_time_buckets = (0.001, 0.01, 0.1, 1.0, 10.0)
+    def __init__(stats):
+        stats.lock = Lock()
+        stats.opened = stats.closed = stats.dropped = 0
+        stats.checkouts = stats.in_use = stats.timeouts = stats.reconnects = 0
+        stats.sum_wait_time = stats.max_wait_time = 0.0
+        stats.wait_time_histogram = [ 0 ] * (len(stats.wait_time_buckets) + 1)
+    def copy(stats):
+        result = object.__new__(PoolStats)
+        with stats.lock:
+            result.__dict__.update(stats.__dict__)
+            result.wait_time_histogram = list(stats.wait_time_histogram)
+        result.lock = Lock()
+        return result
+    @property
+    def avg_wait_time(stats):
+        if not stats.checkouts: return None
+        return stats.sum_wait_time / stats.checkouts
+    def connection_opened(stats):
+        with stats.lock: stats.opened += 1
+    def connection_closed(stats, dropped=False):
+        with stats.lock:
+            stats.closed += 1
+            if dropped: stats.dropped += 1
+    def connection_checked_out(stats, start_time):
+        wait_time = current_time() - start_time
+        with stats.lock:
+            stats.checkouts += 1
+            stats.in_use += 1
+            stats.sum_wait_time += wait_time
+            if wait_time > stats.max_wait_time: stats.max_wait_time = wait_time
+            stats.wait_time_histogram[bisect_left(stats.wait_time_buckets, wait_time)] += 1
+    def connection_returned(stats):
+        with stats.lock: stats.in_use -= 1
+    def checkout_timed_out(stats):
+        with stats.lock: stats.timeouts += 1
+    def reconnect_requested(stats):
+        with stats.lock: stats.reconnects += 1
+
+class Pool(object):
     forked_connections = []
-    def __init__(pool, dbapi_module, *args, **kwargs): # called separately in each thread
+    def __init__(pool, dbapi_module, *args, **kwargs):
         pool.dbapi_module = dbapi_module
         pool.args = args
         pool.kwargs = kwargs
-        pool.con = pool.pid = None
+        pool.local = localbase()
+        pool.stats = PoolStats()
+    @property
+    def con(pool):
+        return getattr(pool.local, 'con', None)
+    @con.setter
+    def con(pool, con):
+        pool.local.con = con
     def connect(pool):
+        start_time = current_time()
+        local = pool.local
         pid = os.getpid()
-        if pool.con is not None and pool.pid != pid:
-            pool.forked_connections.append((pool.con, pool.pid))
-            pool.con = pool.pid = None
+        con = getattr(local, 'con', None)
+        if con is not None and local.pid != pid:
+            pool.forked_connections.append((con, local.pid))
+            local.con = con = None
         core = pony.orm.core
-        if pool.con is None:
+        if con is None:
             if core.local.debug: core.log_orm('GET NEW CONNECTION')
-            pool._connect()
-            pool.pid = pid
+            local.con = con = pool._connect()
+            local.pid = pid
+            pool.stats.connection_opened()
         elif core.local.debug: core.log_orm('GET CONNECTION FROM THE LOCAL POOL')
-        return pool.con
+        pool.stats.connection_checked_out(start_time)
+        return con
     def _connect(pool):
-        pool.con = pool.dbapi_module.connect(*pool.args, **pool.kwargs)
+        return pool.dbapi_module.connect(*pool.args, **pool.kwargs)
+    def _reset(pool, con):
+        con.rollback()
+    def _ping(pool, con):
+        cursor = con.cursor()
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+        con.rollback()
     def release(pool, con):
         assert con is pool.con
-        try: con.rollback()
+        try: pool._reset(con)
         except:
             pool.drop(con)
             raise
+        pool.stats.connection_returned()
     def drop(pool, con):
         assert con is pool.con, (con, pool.con)
         pool.con = None
+        pool.stats.connection_returned()
+        pool.stats.connection_closed(dropped=True)
         con.close()
     def disconnect(pool):
         con = pool.con
         pool.con = None
-        if con is not None: con.close()
+        if con is not None:
+            pool.stats.connection_closed()
+            con.close()
+
+class SharedPool(object):
+    forked_connections = []
+    def __init__(pool, factory, max_size=10, min_size=0, timeout=30, max_idle_time=None, max_lifetime=None,
+                 pre_ping=False):
+        if max_size < 1: throw(ValueError, 'pool_max_size must be positive integer. Got: %r' % max_size)
+        if not 0 <= min_size <= max_size: throw(ValueError,
+            'pool_min_size must be between 0 and pool_max_size. Got: %r' % min_size)
+        pool.factory = factory
+        pool.max_size = max_size
+        pool.min_size = min_size
+        pool.timeout = timeout
+        pool.max_idle_time = max_idle_time
+        pool.max_lifetime = max_lifetime
+        pool.pre_ping = pre_ping
+        pool.condition = Condition(Lock())
+        pool.idle = deque()  # of (con, created, released) triples, most recently released at the right side
+        pool.created = {}  # id(con) -> creation time for checked out connections
+        pool.size = 0
+        pool.pid = os.getpid()
+        pool.stats = PoolStats()
+    def _check_fork(pool):
+        pid = os.getpid()
+        if pool.pid == pid: return
+        with pool.condition:
+            if pool.pid == pid: return
+            pool.forked_connections.extend((con, pool.pid) for con, created, released in pool.idle)
+            pool.idle.clear()
+            pool.created.clear()
+            pool.size = 0
+            pool.pid = pid
+    def _is_expired(pool, created, released, now):
+        if pool.max_lifetime is not None and now - created >= pool.max_lifetime: return True
+        if pool.max_idle_time is not None and now - released >= pool.max_idle_time:
+            return pool.size > pool.min_size
+        return False
+    def connect(pool):
+        pool._check_fork()
+        if pool.size < pool.min_size: pool._fill()
+        core = pony.orm.core
+        start_time = current_time()
+        deadline = None if pool.timeout is None else start_time + pool.timeout
+        while True:
+            con = None
+            expired = []
+            with pool.condition:
+                while True:
+                    now = current_time()
+                    while pool.idle:
+                        con, created, released = pool.idle.pop()
+                        if not pool._is_expired(created, released, now): break
+                        expired.append(con)
+                        pool.size -= 1
+                        con = None
+                    if con is not None or pool.size < pool.max_size: break
+                    if deadline is None: pool.condition.wait()
+                    else:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            pool.stats.checkout_timed_out()
+                            throw(core.PoolTimeoutError,
+                                  'Cannot get connection from the pool in %s seconds: all %d connections are in use'
+                                  % (pool.timeout, pool.max_size))
+                        pool.condition.wait(remaining)
+                if con is None:
+                    created = now
+                    pool.size += 1
+                else: pool.created[id(con)] = created
+            for old_con in expired: pool._close(old_con)
+            if con is None: break
+            if pool.pre_ping:
+                try: pool.factory._ping(con)
+                except pool.factory.dbapi_module.Error:
+                    pool._discard(con)
+                    continue
+            if core.local.debug: core.log_orm('GET CONNECTION FROM THE SHARED POOL')
+            pool.stats.connection_checked_out(start_time)
+            return con
+        if core.local.debug: core.log_orm('GET NEW CONNECTION')
+        try: con = pool.factory._connect()
+        except:
+            with pool.condition:
+                pool.size -= 1
+                pool.condition.notify()
+            raise
+        pool.stats.connection_opened()
+        with pool.condition: pool.created[id(con)] = created
+        pool.stats.connection_checked_out(start_time)
+        return con
+    def release(pool, con):
+        try: pool.factory._reset(con)
+        except:
+            pool.drop(con)
+            raise
+        pool.stats.connection_returned()
+        with pool.condition:
+            created = pool.created.pop(id(con), None)
+            if created is None:  # connection was checked out before fork
+                pool.forked_connections.append((con, None))
+                return
+            pool.idle.append((con, created, current_time()))
+            pool.condition.notify()
+    def drop(pool, con):
+        pool.stats.connection_returned()
+        pool._discard(con)
+    def _fill(pool):
+        # opens new connections until the pool has min_size of them
+        while True:
+            with pool.condition:
+                if pool.size >= pool.min_size: return
+                pool.size += 1
+            created = current_time()
+            try: con = pool.factory._connect()
+            except:
+                with pool.condition:
+                    pool.size -= 1
+                    pool.condition.notify()
+                raise
+            pool.stats.connection_opened()
+            with pool.condition:
+                pool.idle.appendleft((con, created, created))
+                pool.condition.notify()
+    def _discard(pool, con):
+        with pool.condition:
+            if pool.created.pop(id(con), None) is not None:
+                pool.size -= 1
+                pool.condition.notify()
+        pool._close(con, dropped=True)
+    def _close(pool, con, dropped=False):
+        pool.stats.connection_closed(dropped)
+        try: con.close()
+        except pool.factory.dbapi_module.Error: pass
+    def disconnect(pool):
+        with pool.condition:
+            idle = list(pool.idle)
+            pool.idle.clear()
+            pool.size -= len(idle)
+            pool.condition.notify_all()
+        for con, created, released in idle: pool._close(con)
 
 class Converter(object):
     EQ = 'EQ'
@@ -223,6 +223,13 @@ class MySQLProvider(DBAPIProvider):
             provider.max_time_precision = 6
         cursor.execute('select database()')
         provider.default_schema_name = cursor.fetchone()[0]
+        cursor.execute("SHOW VARIABLES LIKE 'innodb_autoinc_lock_mode'")
+        row = cursor.fetchone()
+        if row is not None and row[1] in ('0', '1', 0, 1):
+            provider.insert_many_ids = 'first'  # ids generated by a single multi-row INSERT are consecutive
+            cursor.execute("SHOW VARIABLES LIKE 'auto_increment_increment'")
+            row = cursor.fetchone()
+            if row is not None: provider.insert_many_id_step = int(row[1])
 
     def should_reconnect(provider, exc):
         return isinstance(exc, mysql_module.OperationalError) and exc.args[0] == 2006
@@ -267,6 +274,13 @@ class MySQLProvider(DBAPIProvider):
                 cursor.execute(sql)
             cache.saved_fk_state = bool(fk)
             cache.in_transaction = True
+        if cache.read_only:
+            cursor = connection.cursor()
+            sql = 'START TRANSACTION READ ONLY'
+            if core.local.debug: log_orm(sql)
+            cursor.execute(sql)
+            cache.in_transaction = True
+            return
         cache.immediate = True
         if db_session is not None and db_session.serializable:
             cursor = connection.cursor()
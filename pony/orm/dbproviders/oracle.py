@@ -6,6 +6,7 @@ os.environ["NLS_LANG"] = "AMERICAN_AMERICA.UTF8"
 
 import re
 from datetime import datetime, date, time, timedelta
+from time import time as current_time
 from decimal import Decimal
 from uuid import UUID
 
@@ -16,7 +17,7 @@ from pony.orm.core import log_orm, log_sql, DatabaseError, TranslationError
 from pony.orm.dbschema import DBSchema, DBObject, Table, Column
 from pony.orm.ormtypes import Json
 from pony.orm.sqlbuilding import SQLBuilder, Value
-from pony.orm.dbapiprovider import DBAPIProvider, wrap_dbapi_exceptions, get_version_tuple
+from pony.orm.dbapiprovider import DBAPIProvider, PoolStats, wrap_dbapi_exceptions, get_version_tuple
 from pony.utils import throw, is_ident
 from pony.converting import timedelta2str
 
@@ -121,6 +122,7 @@ class OraTranslator(sqltranslation.SQLTranslator):
     rowid_support = True
     json_path_wildcard_syntax = True
     json_values_are_comparable = False
+    nulls_are_largest = True
     NoneMonad = OraNoneMonad
     ConstMonad = OraConstMonad
 
@@ -387,6 +389,8 @@ class OraProvider(DBAPIProvider):
     index_if_not_exists_syntax = False
     varchar_default_max_len = 1000
     uint64_support = True
+    insert_many_syntax = False
+    release_savepoint_syntax = False
 
     dbapi_module = cx_Oracle
     dbschema_cls = OraSchema
@@ -441,6 +445,13 @@ class OraProvider(DBAPIProvider):
     def set_transaction_mode(provider, connection, cache):
         assert not cache.in_transaction
         db_session = cache.db_session
+        if cache.read_only:
+            cursor = connection.cursor()
+            sql = 'SET TRANSACTION READ ONLY'
+            if core.local.debug: log_orm(sql)
+            cursor.execute(sql)
+            cache.in_transaction = True
+            return
         if db_session is not None and db_session.serializable:
             cursor = connection.cursor()
             sql = 'SET TRANSACTION ISOLATION LEVEL SERIALIZABLE'
@@ -467,7 +478,19 @@ class OraProvider(DBAPIProvider):
             if arguments is None: cursor.execute(sql)
             else: cursor.execute(sql, arguments)
 
+    explain_prefix = 'EXPLAIN PLAN FOR '
+
+    @wrap_dbapi_exceptions
+    def explain(provider, connection, sql, arguments=None, in_transaction=False):
+        # failed statement does not abort transaction in Oracle, so savepoint is not necessary
+        cursor = connection.cursor()
+        provider.execute(cursor, provider.explain_prefix + sql, arguments)
+        cursor.execute('SELECT plan_table_output FROM TABLE(DBMS_XPLAN.DISPLAY())')
+        return cursor.fetchall()
+
     def get_pool(provider, *args, **kwargs):
+        if provider.pool_options: throw(TypeError,
+            'Oracle provider uses cx_Oracle.SessionPool. Use min, max and increment options instead')
         user = password = dsn = None
         if len(args) == 1:
             conn_str = args[0]
@@ -566,7 +589,9 @@ class OraPool(object):
         pool.kwargs = kwargs
         pool.cx_pool = cx_Oracle.SessionPool(**kwargs)
         pool.pid = os.getpid()
+        pool.stats = PoolStats()
     def connect(pool):
+        start_time = current_time()
         pid = os.getpid()
         if pool.pid != pid:
             pool.forked_pools.append((pool.cx_pool, pool.pid))
@@ -575,11 +600,15 @@ class OraPool(object):
         if core.local.debug: log_orm('GET CONNECTION')
         con = pool.cx_pool.acquire()
         con.outputtypehandler = output_type_handler
+        pool.stats.connection_checked_out(start_time)
         return con
     def release(pool, con):
         pool.cx_pool.release(con)
+        pool.stats.connection_returned()
     def drop(pool, con):
         pool.cx_pool.drop(con)
+        pool.stats.connection_returned()
+        pool.stats.connection_closed(dropped=True)
     def disconnect(pool):
         pass
 
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 from pony.py23compat import PY2, basestring, unicode, buffer, int_types
 
 from decimal import Decimal
+from itertools import count
 from datetime import datetime, date, time, timedelta
 from uuid import UUID
 
@@ -42,6 +43,7 @@ class PGSchema(dbschema.DBSchema):
 
 class PGTranslator(SQLTranslator):
     dialect = 'PostgreSQL'
+    nulls_are_largest = True
 
 class PGValue(Value):
     __slots__ = []
@@ -148,26 +150,23 @@ class PGJsonConverter(dbapiprovider.JsonConverter):
 
 class PGPool(Pool):
     def _connect(pool):
-        pool.con = pool.dbapi_module.connect(*pool.args, **pool.kwargs)
+        con = pool.dbapi_module.connect(*pool.args, **pool.kwargs)
         if 'client_encoding' not in pool.kwargs:
-            pool.con.set_client_encoding('UTF8')
-    def release(pool, con):
-        assert con is pool.con
-        try:
-            con.rollback()
-            con.autocommit = True
-            cursor = con.cursor()
-            cursor.execute('DISCARD ALL')
-            con.autocommit = False
-        except:
-            pool.drop(con)
-            raise
+            con.set_client_encoding('UTF8')
+        return con
+    def _reset(pool, con):
+        con.rollback()
+        con.autocommit = True
+        cursor = con.cursor()
+        cursor.execute('DISCARD ALL')
+        con.autocommit = False
 
 class PGProvider(DBAPIProvider):
     dialect = 'PostgreSQL'
     paramstyle = 'pyformat'
     max_name_len = 63
     index_if_not_exists_syntax = False
+    insert_many_ids = 'sequence'
 
     dbapi_module = psycopg2
     dbschema_cls = PGSchema
@@ -186,6 +185,10 @@ class PGProvider(DBAPIProvider):
         provider.server_version = connection.server_version
         provider.table_if_not_exists_syntax = provider.server_version >= 90100
 
+    def get_next_ids_sql(provider, table_name, column_name, count):
+        sql = 'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)'
+        return sql, (provider.quote_name(table_name), column_name, count)
+
     def should_reconnect(provider, exc):
         return isinstance(exc, psycopg2.OperationalError) \
                and exc.pgcode is exc.pgerror is exc.cursor is None
@@ -196,11 +199,17 @@ class PGProvider(DBAPIProvider):
     @wrap_dbapi_exceptions
     def set_transaction_mode(provider, connection, cache):
         assert not cache.in_transaction
-        if cache.immediate and connection.autocommit:
+        if (cache.immediate or cache.read_only) and connection.autocommit:
             connection.autocommit = False
             if core.local.debug: log_orm('SWITCH FROM AUTOCOMMIT TO TRANSACTION MODE')
         db_session = cache.db_session
-        if db_session is not None and db_session.serializable:
+        if cache.read_only:
+            cursor = connection.cursor()
+            sql = 'SET TRANSACTION READ ONLY'
+            if core.local.debug: log_orm(sql)
+            cursor.execute(sql)
+            cache.in_transaction = True
+        elif db_session is not None and db_session.serializable:
             cursor = connection.cursor()
             sql = 'SET TRANSACTION ISOLATION LEVEL SERIALIZABLE'
             if core.local.debug: log_orm(sql)
@@ -211,6 +220,12 @@ class PGProvider(DBAPIProvider):
         if db_session is not None and (db_session.serializable or db_session.ddl):
             cache.in_transaction = True
 
+    server_side_cursor_counter = count(1)
+
+    def server_side_cursor(provider, connection):
+        name = 'pony_cursor_%d' % next(provider.server_side_cursor_counter)
+        return connection.cursor(name, withhold=True)
+
     @wrap_dbapi_exceptions
     def execute(provider, cursor, sql, arguments=None, returning_id=False):
         if PY2 and isinstance(sql, unicode): sql = sql.encode('utf8')
@@ -6,8 +6,9 @@ import sqlite3 as sqlite
 from decimal import Decimal
 from datetime import datetime, date, time, timedelta
 from random import random
-from time import strptime
-from threading import Lock
+from time import strptime, time as timer
+from threading import Condition, Lock, Thread, current_thread
+from collections import deque
 from uuid import UUID
 from binascii import hexlify
 from functools import wraps
@@ -242,6 +243,7 @@ class SQLiteProvider(DBAPIProvider):
     local_exceptions = local_exceptions
     max_name_len = 1024
     select_for_update_nowait_syntax = False
+    insert_many_ids = 'last'
 
     dbapi_module = sqlite
     dbschema_cls = SQLiteSchema
@@ -276,6 +278,7 @@ class SQLiteProvider(DBAPIProvider):
     def inspect_connection(provider, conn):
         DBAPIProvider.inspect_connection(provider, conn)
         provider.json1_available = provider.check_json1(conn)
+        provider.wal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
 
     def restore_exception(provider):
         if provider.local_exceptions.exc_info is not None:
@@ -285,12 +288,18 @@ class SQLiteProvider(DBAPIProvider):
     @wrap_dbapi_exceptions
     def set_transaction_mode(provider, connection, cache):
         assert not cache.in_transaction
+        db_session = cache.db_session
+        if cache.immediate and isinstance(connection, SQLiteGroupCommitConnection) \
+                and not (db_session is not None and db_session.ddl):
+            if core.local.debug: log_orm('BEGIN WRITER THREAD TRANSACTION')
+            connection.begin()
+            cache.in_transaction = True
+            return
         if cache.immediate:
             provider.transaction_lock.acquire()
         try:
             cursor = connection.cursor()
 
-            db_session = cache.db_session
             if db_session is not None and db_session.ddl:
                 cursor.execute('PRAGMA foreign_keys')
                 fk = cursor.fetchone()
@@ -307,37 +316,38 @@ class SQLiteProvider(DBAPIProvider):
                 if core.local.debug: log_orm(sql)
                 cursor.execute(sql)
                 cache.in_transaction = True
+            elif provider.wal_mode:
+                # in WAL mode read transaction sees a consistent snapshot and does not block
+                # writers, so transaction_lock is not taken here; without WAL it would block
+                # the commit of other connections, so reads are executed in autocommit mode
+                sql = 'BEGIN DEFERRED TRANSACTION'
+                if core.local.debug: log_orm(sql)
+                cursor.execute(sql)
+                cache.in_transaction = cache.read_transaction = True
             elif core.local.debug: log_orm('SWITCH TO AUTOCOMMIT MODE')
         finally:
             if cache.immediate and not cache.in_transaction:
                 provider.transaction_lock.release()
 
     def commit(provider, connection, cache=None):
-        in_transaction = cache is not None and cache.in_transaction
-        try:
-            DBAPIProvider.commit(provider, connection, cache)
-        finally:
-            if in_transaction:
-                cache.in_transaction = False
-                provider.transaction_lock.release()
+        provider._end_transaction(DBAPIProvider.commit, connection, cache)
 
     def rollback(provider, connection, cache=None):
-        in_transaction = cache is not None and cache.in_transaction
-        try:
-            DBAPIProvider.rollback(provider, connection, cache)
-        finally:
-            if in_transaction:
-                cache.in_transaction = False
-                provider.transaction_lock.release()
+        provider._end_transaction(DBAPIProvider.rollback, connection, cache)
 
     def drop(provider, connection, cache=None):
+        provider._end_transaction(DBAPIProvider.drop, connection, cache)
+
+    def _end_transaction(provider, method, connection, cache):
         in_transaction = cache is not None and cache.in_transaction
+        locked = in_transaction and not (cache.read_transaction or cache.read_only) \
+                 and getattr(connection, 'job', None) is None
         try:
-            DBAPIProvider.drop(provider, connection, cache)
+            method(provider, connection, cache)
         finally:
             if in_transaction:
-                cache.in_transaction = False
-                provider.transaction_lock.release()
+                cache.in_transaction = cache.read_transaction = False
+                if locked: provider.transaction_lock.release()
 
     @wrap_dbapi_exceptions
     def release(provider, connection, cache=None):
@@ -354,7 +364,16 @@ class SQLiteProvider(DBAPIProvider):
                     raise
         DBAPIProvider.release(provider, connection, cache)
 
+    explain_prefix = 'EXPLAIN QUERY PLAN '
+
     def get_pool(provider, filename, create_db=False, **kwargs):
+        pragmas = []
+        for name in sqlite_pragmas:
+            if name not in kwargs: continue
+            value = kwargs.pop(name)
+            if not isinstance(value, int_types + (basestring,)) or not re.match(r'-?\w+$', str(value)):
+                throw(ValueError, 'Invalid value of %s pragma: %r' % (name, value))
+            pragmas.append((name, value))
         if filename != ':memory:':
             # When relative filename is specified, it is considered
             # not relative to cwd, but to user module where
@@ -370,7 +389,10 @@ class SQLiteProvider(DBAPIProvider):
             # 1 - SQLiteProvider.__init__()
             # 0 - pony.dbproviders.sqlite.get_pool()
             filename = absolutize_path(filename, frame_depth=cut_traceback_depth+5)
-        return SQLitePool(filename, create_db, **kwargs)
+        if provider.pool_options:
+            if filename == ':memory:': throw(TypeError, 'Shared connection pool cannot be used with in-memory database')
+            kwargs.setdefault('check_same_thread', False)
+        return SQLitePool(filename, create_db, pragmas, **kwargs)
 
     def table_exists(provider, connection, table_name, case_sensitive=True):
         return provider._exists(connection, table_name, None, case_sensitive)
@@ -516,17 +538,28 @@ def py_json_array_length(expr, path=None):
         expr = _traverse(expr, keys)
     return len(expr) if type(expr) is list else 0
 
+sqlite_pragmas = 'busy_timeout', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store'
+
 class SQLitePool(Pool):
-    def __init__(pool, filename, create_db, **kwargs): # called separately in each thread
+    def __init__(pool, filename, create_db, pragmas=(), group_commit=False, group_commit_size=100,
+                 group_commit_delay=0.05, **kwargs):
+        Pool.__init__(pool, sqlite, **kwargs)
         pool.filename = filename
         pool.create_db = create_db
-        pool.kwargs = kwargs
-        pool.con = None
+        pool.pragmas = pragmas
+        pool.writer = None
+        if group_commit:
+            if filename == ':memory:': throw(TypeError, 'Group commit cannot be used with in-memory database')
+            pool.writer = SQLiteWriter(pool, group_commit_size, group_commit_delay, kwargs.get('timeout', 5.0))
     def _connect(pool):
+        con = pool._create_connection()
+        if pool.writer is not None: con = SQLiteGroupCommitConnection(con, pool.writer)
+        return con
+    def _create_connection(pool):
         filename = pool.filename
         if filename != ':memory:' and not pool.create_db and not os.path.exists(filename):
             throw(IOError, "Database file is not found: %r" % filename)
-        pool.con = con = sqlite.connect(filename, isolation_level=None, **pool.kwargs)
+        con = sqlite.connect(filename, isolation_level=None, **pool.kwargs)
         con.text_factory = _text_factory
 
         def create_function(name, num_params, func):
@@ -545,11 +578,286 @@ class SQLitePool(Pool):
 
         if sqlite.sqlite_version_info >= (3, 6, 19):
             con.execute('PRAGMA foreign_keys = true')
+        for name, value in pool.pragmas:
+            con.execute('PRAGMA %s = %s' % (name, value))
+        return con
     def disconnect(pool):
         if pool.filename != ':memory:':
             Pool.disconnect(pool)
+        if pool.writer is not None: pool.writer.stop()
     def drop(pool, con):
         if pool.filename != ':memory:':
             Pool.drop(pool, con)
         else:
+            pool.stats.connection_returned()
             con.rollback()
+
+class SQLiteGroupCommitConnection(object):
+    def __init__(wrapper, con, writer):
+        wrapper.con = con
+        wrapper.writer = writer
+        wrapper.job = None
+    def __getattr__(wrapper, name):
+        return getattr(wrapper.con, name)
+    def begin(wrapper):
+        assert wrapper.job is None
+        wrapper.job = wrapper.writer.begin()
+    def cursor(wrapper):
+        job = wrapper.job
+        if job is None: return wrapper.con.cursor()
+        return SQLiteWriterCursor(job)
+    def execute(wrapper, sql, *args):
+        return wrapper.cursor().execute(sql, *args)
+    def commit(wrapper):
+        job = wrapper.job
+        if job is None: return wrapper.con.commit()
+        wrapper.job = None
+        job.call('commit')
+    def rollback(wrapper):
+        job = wrapper.job
+        if job is None: return wrapper.con.rollback()
+        wrapper.job = None
+        job.call('rollback')
+    def close(wrapper):
+        try:
+            if wrapper.job is not None: wrapper.rollback()
+        finally: wrapper.con.close()
+
+class SQLiteWriterCursor(object):
+    def __init__(cursor, job):
+        cursor.job = job
+        cursor.rows = deque()
+        cursor.description = None
+        cursor.rowcount = -1
+        cursor.lastrowid = None
+        cursor.arraysize = 1
+    def execute(cursor, sql, arguments=None):
+        return cursor._execute(sql, arguments, False)
+    def executemany(cursor, sql, arguments):
+        return cursor._execute(sql, list(arguments), True)
+    def _execute(cursor, sql, arguments, many):
+        rows, cursor.description, cursor.rowcount, cursor.lastrowid = cursor.job.call('execute', sql, arguments, many)
+        cursor.rows = deque(rows)
+        return cursor
+    def fetchone(cursor):
+        rows = cursor.rows
+        return rows.popleft() if rows else None
+    def fetchmany(cursor, size=None):
+        rows = cursor.rows
+        size = min(size or cursor.arraysize, len(rows))
+        return [ rows.popleft() for i in range(size) ]
+    def fetchall(cursor):
+        rows = list(cursor.rows)
+        cursor.rows.clear()
+        return rows
+    def __iter__(cursor):
+        rows = cursor.rows
+        while rows: yield rows.popleft()
+    def close(cursor):
+        cursor.rows.clear()
+
+class SQLiteWriterJob(object):
+    def __init__(job, condition):
+        job.condition = condition
+        job.request = job.response = job.failure = None
+    def call(job, *request):
+        with job.condition:
+            if job.failure is None:
+                job.request = request
+                job.condition.notify_all()
+                while job.response is None and job.failure is None: job.condition.wait()
+            if job.response is None:
+                # the writer does not serve this session anymore
+                if request[0] == 'rollback': return None
+                raise job.failure
+        return job.wait()
+    def wait(job):
+        with job.condition:
+            while job.response is None: job.condition.wait()
+            exc, result = job.response
+            job.response = None
+        if exc is not None: raise exc
+        return result
+    def get_request(job, timeout=None):
+        # returns None if the session did not send the next request within timeout
+        deadline = timer() + timeout if timeout is not None else None
+        with job.condition:
+            while job.request is None:
+                if deadline is None: job.condition.wait()
+                else:
+                    remaining = deadline - timer()
+                    if remaining <= 0: return None
+                    job.condition.wait(remaining)
+            request = job.request
+            job.request = None
+        return request
+    def respond(job, exc=None, result=None):
+        with job.condition:
+            job.response = exc, result
+            job.condition.notify_all()
+    def fail(job, exc):
+        with job.condition:
+            job.failure = exc
+            job.request = None
+            job.condition.notify_all()
+
+class SQLiteWriter(object):
+    # Write transactions of all sessions are executed one after another by a single thread,
+    # each one inside its own savepoint. Consecutive transactions are committed together,
+    # so the cost of fsync is shared by all sessions of the group.
+    #
+    # A session keeps the writer busy while it runs application code between its statements.
+    # Sessions that have already committed do not wait for that code: if the current session
+    # sends no request within group_commit_delay seconds, its savepoint is rolled back, the group
+    # is committed, and the statements of the current session are replayed in a new transaction.
+    # A session which sends no request within lock_timeout seconds while other sessions are waiting
+    # to begin is rolled back, and its following statements fail, so it cannot block them forever.
+    #
+    # All statements of a write session, including SELECTs, are executed by the writer thread,
+    # so each one costs a round trip between threads, and result rows are fetched completely
+    # before they are returned to the session (cursors are not streamed).
+    def __init__(writer, pool, max_group_size=100, delay=0.05, lock_timeout=5.0, idle_timeout=1.0):
+        if max_group_size < 1: throw(ValueError,
+            'group_commit_size must be positive integer. Got: %r' % max_group_size)
+        if delay is None or delay < 0: throw(ValueError,
+            'group_commit_delay must be non-negative number of seconds. Got: %r' % delay)
+        writer.pool = pool
+        writer.max_group_size = max_group_size
+        writer.delay = delay
+        writer.lock_timeout = lock_timeout
+        writer.idle_timeout = idle_timeout
+        writer.condition = Condition(Lock())
+        writer.jobs = deque()
+        writer.thread = writer.job = None
+        writer.in_transaction = False
+    def begin(writer):
+        job = SQLiteWriterJob(writer.condition)
+        with writer.condition:
+            writer.jobs.append(job)
+            if writer.thread is None:
+                writer.thread = Thread(target=writer.run, name='pony-sqlite-writer')
+                writer.thread.daemon = True
+                writer.thread.start()
+            writer.condition.notify_all()
+        job.wait()
+        return job
+    def stop(writer):
+        # a daemon thread which is still running at interpreter shutdown can crash Python 2,
+        # so the thread is stopped if it does not serve any session at the moment
+        with writer.condition:
+            thread = writer.thread
+            if thread is None or writer.job is not None or writer.jobs: return
+            writer.thread = None
+            writer.condition.notify_all()
+        thread.join()
+    def run(writer):
+        condition = writer.condition
+        thread = current_thread()
+        con = None
+        writer.in_transaction = False
+        group = []
+        try:
+            while True:
+                with condition:
+                    if writer.thread is thread and not writer.jobs: condition.wait(writer.idle_timeout)
+                    if writer.thread is not thread or not writer.jobs:
+                        if writer.thread is thread: writer.thread = None
+                        break
+                    job = writer.job = writer.jobs.popleft()
+                try:
+                    if con is None: con = writer.pool._create_connection()
+                    writer.begin_job(con)
+                except Exception as e:
+                    with condition: writer.job = None
+                    job.respond(e)
+                else:
+                    job.respond()
+                    writer.serve(con, job, group)
+                with condition:
+                    writer.job = None
+                    has_more_jobs = bool(writer.jobs)
+                if writer.in_transaction and (not has_more_jobs or len(group) >= writer.max_group_size):
+                    writer.commit_group(con, group)
+            if writer.in_transaction: writer.commit_group(con, group)
+        except:
+            with condition:
+                if writer.thread is thread: writer.thread = None
+            raise
+        finally:
+            if con is not None: con.close()
+    def begin_job(writer, con):
+        if not writer.in_transaction:
+            con.execute('BEGIN IMMEDIATE TRANSACTION')
+            writer.in_transaction = True
+        con.execute('SAVEPOINT pony_job')
+    def rollback_job(writer, con):
+        con.execute('ROLLBACK TO SAVEPOINT pony_job')
+        con.execute('RELEASE SAVEPOINT pony_job')
+    def serve(writer, con, job, group):
+        executed = []
+        while True:
+            request = job.get_request(writer.delay if group else writer.lock_timeout)
+            if request is None:
+                if group:
+                    try: writer.restart_job(con, executed, group)
+                    except Exception as e: failure = e
+                    else: continue
+                else:
+                    with writer.condition: is_waited = bool(writer.jobs)
+                    if not is_waited: continue
+                    try: writer.rollback_job(con)
+                    except Exception: pass
+                    failure = sqlite.OperationalError('Transaction was rolled back because it did not execute '
+                                                      'the next statement within %s seconds' % writer.lock_timeout)
+                with writer.condition: writer.job = None
+                job.fail(failure)
+                return
+            command = request[0]
+            if command == 'execute':
+                try: result = writer.execute(con, *request[1:])
+                except Exception as e: job.respond(e)
+                else:
+                    executed.append((request[1:], result))
+                    job.respond(None, result)
+                continue
+            exc = None
+            try:
+                if command == 'commit':
+                    con.execute('RELEASE SAVEPOINT pony_job')
+                    group.append(job)
+                    return
+                writer.rollback_job(con)
+            except Exception as e: exc = e
+            with writer.condition: writer.job = None  # the session is finished, so the writer can be stopped
+            job.respond(exc)
+            return
+    def restart_job(writer, con, executed, group):
+        # the current session is busy with its own code, so the sessions
+        # which are waiting for their commit are committed without it
+        writer.rollback_job(con)
+        writer.commit_group(con, group)
+        writer.begin_job(con)
+        for args, result in executed:
+            try:
+                if writer.execute(con, *args) == result: continue
+            except Exception: pass
+            if writer.in_transaction: writer.rollback_job(con)
+            throw(sqlite.OperationalError,
+                  'Transaction cannot be continued because the database was changed by another connection')
+    def execute(writer, con, sql, arguments, many):
+        cursor = con.cursor()
+        if many: cursor.executemany(sql, arguments)
+        elif arguments is None: cursor.execute(sql)
+        else: cursor.execute(sql, arguments)
+        rows = cursor.fetchall() if cursor.description is not None else []
+        return rows, cursor.description, cursor.rowcount, cursor.lastrowid
+    def commit_group(writer, con, group):
+        writer.in_transaction = False
+        exc = None
+        try: con.execute('COMMIT')
+        except Exception as e:
+            exc = e
+            try: con.execute('ROLLBACK')
+            except Exception: pass
+        for job in group: job.respond(exc)
+        del group[:]
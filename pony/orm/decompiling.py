@@ -13,6 +13,7 @@ from pony.utils import throw, get_codeobject_id
 ##ast.Or.__repr__ = lambda self: "Or(%s: %s)" % (getattr(self, 'endpos', '?'), repr(self.nodes),)
 
 ast_cache = {}
+disk_cache = None
 
 def decompile(x):
     cells = {}
@@ -29,8 +30,11 @@ def decompile(x):
     key = get_codeobject_id(codeobject)
     result = ast_cache.get(key)
     if result is None:
-        decompiler = Decompiler(codeobject)
-        result = decompiler.ast, decompiler.external_names
+        if disk_cache is not None: result = disk_cache.load_ast(codeobject)
+        if result is None:
+            decompiler = Decompiler(codeobject)
+            result = decompiler.ast, decompiler.external_names
+            if disk_cache is not None: disk_cache.dump_ast(codeobject, result)
         ast_cache[key] = result
     return result + (cells,)
 
@@ -0,0 +1,171 @@
+from __future__ import absolute_import, print_function, division
+from pony.py23compat import basestring, int_types
+
+import io, marshal, os, pickle, sys, tempfile, types
+from hashlib import md5
+from operator import attrgetter
+
+import pony
+from pony import options
+from pony.orm import decompiling
+from pony.orm.core import Database, EntityMeta, Attribute, DescWrapper
+from pony.orm.dbapiprovider import DBAPIProvider
+from pony.orm.ormtypes import SetType, FuncType
+from pony.utils import import_module, codeobjects, LRUCache
+
+python_version = '%d.%d' % sys.version_info[:2]
+
+def get_const_key(const):
+    if isinstance(const, types.CodeType): return get_code_hash(const)
+    if isinstance(const, frozenset): return 'frozenset', tuple(sorted(repr(item) for item in const))
+    if isinstance(const, tuple): return tuple(get_const_key(item) for item in const)
+    return type(const).__name__, const
+
+def get_code_hash(codeobject):
+    consts = tuple(get_const_key(const) for const in codeobject.co_consts)
+    filename = os.path.normcase(os.path.abspath(codeobject.co_filename))  # module can be imported by relative path
+    key = (codeobject.co_code, consts, codeobject.co_names, codeobject.co_varnames, codeobject.co_freevars,
+           codeobject.co_cellvars, filename, codeobject.co_name, codeobject.co_firstlineno,
+           codeobject.co_argcount, codeobject.co_flags)
+    return md5(repr(key).encode('utf-8')).hexdigest()
+
+def get_global_name(obj):
+    module_name = getattr(obj, '__module__', None)
+    name = getattr(obj, '__name__', None)
+    module = sys.modules.get(module_name) if module_name else None
+    if module is None or getattr(module, name, None) is not obj: return None
+    return module_name, name
+
+def get_stable_key(key):
+    if key is None or isinstance(key, (bool, float, basestring) + int_types): return key
+    t = type(key)
+    if t in (tuple, list): return tuple(get_stable_key(item) for item in key)
+    if isinstance(key, dict):
+        items = []
+        for k, v in key.items():
+            if k == 'code_key' and isinstance(v, int_types):
+                codeobject = codeobjects.get(v)
+                if codeobject is None: raise TypeError(v)
+                v = 'code', get_code_hash(codeobject)
+            else: v = get_stable_key(v)
+            items.append((get_stable_key(k), v))
+        return 'dict', tuple(sorted(items))
+    if isinstance(key, EntityMeta): return 'entity', key.__name__
+    if isinstance(key, Attribute): return 'attr', key.entity.__name__, key.name
+    if t is DescWrapper: return 'desc', get_stable_key(key.attr)
+    if t is SetType: return 'set', get_stable_key(key.item_type)
+    if t is FuncType: return 'func', get_stable_key(key.func)
+    if isinstance(key, (type, types.FunctionType, types.BuiltinFunctionType)):
+        global_name = get_global_name(key)
+        if global_name is not None: return ('global',) + global_name
+    raise TypeError(key)
+
+def get_schema_hash(database):
+    schema_json, schema_hash = database._get_schema_json(check_perms=False)
+    tables = [ (entity.__name__, entity._table_, [ (attr.name, attr.columns) for attr in entity._attrs_ ])
+               for entity in sorted(database.entities.values(), key=attrgetter('_id_')) ]
+    return md5((schema_hash + repr(tables)).encode('utf-8')).hexdigest()
+
+class DiskCache(object):
+    def __init__(cache, dirname):
+        if not os.path.isdir(dirname): os.makedirs(dirname)
+        cache.dirname = dirname
+    def get_filename(cache, key):
+        return os.path.join(cache.dirname, md5(repr(key).encode('utf-8')).hexdigest() + '.pickle')
+    def load(cache, key, unpickler_factory=pickle.Unpickler):
+        filename = cache.get_filename(key)
+        if not os.path.exists(filename): return None
+        try:
+            # unpickling can execute arbitrary code, so it is safe only if the cache directory is trusted
+            with open(filename, 'rb') as f: return unpickler_factory(f).load()
+        except Exception: return None  # cache file is corrupted or refers to missing objects
+    def dump(cache, key, value, pickler_factory=pickle.Pickler):
+        f = io.BytesIO()
+        try: pickler_factory(f, 2).dump(value)
+        except Exception: return False  # value cannot be pickled
+        fd, tmp_filename = tempfile.mkstemp(dir=cache.dirname)
+        with os.fdopen(fd, 'wb') as tmp: tmp.write(f.getvalue())
+        try: os.rename(tmp_filename, cache.get_filename(key))
+        except OSError: os.remove(tmp_filename)
+        return True
+    def load_ast(cache, codeobject):
+        return cache.load(('ast', pony.__version__, python_version, get_code_hash(codeobject)))
+    def dump_ast(cache, codeobject, result):
+        cache.dump(('ast', pony.__version__, python_version, get_code_hash(codeobject)), result)
+
+class TranslatorPickler(pickle.Pickler):
+    def persistent_id(pickler, obj):
+        if obj is Ellipsis: return 'ellipsis',
+        if isinstance(obj, Database): return 'database',
+        if isinstance(obj, DBAPIProvider): return 'provider',
+        if isinstance(obj, EntityMeta): return 'entity', obj.__name__
+        if isinstance(obj, Attribute): return 'attr', obj.entity.__name__, obj.name
+        if isinstance(obj, types.CodeType): return 'code', marshal.dumps(obj)
+        if isinstance(obj, io.BytesIO): return 'bytes', obj.getvalue()
+        if isinstance(obj, (types.FunctionType, types.BuiltinFunctionType)):
+            global_name = get_global_name(obj)
+            if global_name is not None: return ('global',) + global_name
+        return None
+
+class TranslatorUnpickler(pickle.Unpickler):
+    def __init__(unpickler, file, database):
+        pickle.Unpickler.__init__(unpickler, file)
+        unpickler.database = database
+    def persistent_load(unpickler, pid):
+        kind = pid[0]
+        database = unpickler.database
+        if kind == 'ellipsis': return Ellipsis
+        if kind == 'database': return database
+        if kind == 'provider': return database.provider
+        if kind == 'entity': return database.entities[pid[1]]
+        if kind == 'attr': return database.entities[pid[1]]._adict_[pid[2]]
+        if kind == 'code': return marshal.loads(pid[1])
+        if kind == 'bytes': return io.BytesIO(pid[1])
+        if kind == 'global': return getattr(import_module(pid[1]), pid[2])
+        raise pickle.UnpicklingError('Unsupported persistent object: %r' % (pid,))
+
+class TranslatorCache(LRUCache):
+    def __init__(cache, database, disk_cache, max_size=None):
+        LRUCache.__init__(cache, max_size)
+        cache.database = database
+        cache.disk_cache = disk_cache
+        cache.schema_hash = None
+        cache.disk_hits = cache.disk_misses = 0
+    def get_disk_key(cache, key):
+        try: stable_key = get_stable_key(key)
+        except TypeError: return None  # query key contains objects which cannot be identified across processes
+        database = cache.database
+        if cache.schema_hash is None: cache.schema_hash = get_schema_hash(database)
+        provider = database.provider
+        return ('translator', pony.__version__, python_version, provider.dialect,
+                getattr(provider, 'server_version', None), cache.schema_hash,
+                options.SIMPLE_ALIASES, options.INNER_JOIN_SYNTAX, stable_key)
+    def get(cache, key, default=None):
+        translator = LRUCache.get(cache, key)
+        if translator is not None: return translator
+        disk_key = cache.get_disk_key(key)
+        if disk_key is None: return default
+        database = cache.database
+        translator = cache.disk_cache.load(disk_key, lambda f: TranslatorUnpickler(f, database))
+        if translator is None:
+            cache.disk_misses += 1
+            return default
+        cache.disk_hits += 1
+        LRUCache.__setitem__(cache, key, translator)
+        return translator
+    def __setitem__(cache, key, translator):
+        LRUCache.__setitem__(cache, key, translator)
+        disk_key = cache.get_disk_key(key)
+        if disk_key is not None: cache.disk_cache.dump(disk_key, translator, TranslatorPickler)
+
+def set_query_cache_dir(database, dirname):
+    old_cache = database._translator_cache
+    max_size = old_cache.max_size
+    if isinstance(old_cache, TranslatorCache) and decompiling.disk_cache is old_cache.disk_cache:
+        decompiling.disk_cache = None  # decompiled code is cached in the directory of the last database
+    if dirname is None:
+        database._translator_cache = LRUCache(max_size)
+        return
+    disk_cache = DiskCache(dirname)
+    database._translator_cache = TranslatorCache(database, disk_cache, max_size)
+    decompiling.disk_cache = disk_cache
@@ -215,6 +215,11 @@ class SQLBuilder(object):
         return [ 'INSERT INTO ', builder.quote_name(table_name), ' (',
                  join(', ', [builder.quote_name(column) for column in columns ]),
                  ') VALUES (', join(', ', [builder(value) for value in values]), ')' ]
+    def INSERT_MANY(builder, table_name, columns, rows):
+        return [ 'INSERT INTO ', builder.quote_name(table_name), ' (',
+                 join(', ', [builder.quote_name(column) for column in columns ]),
+                 ') VALUES ', join(', ', [ ('(', join(', ', [builder(value) for value in values]), ')')
+                                           for values in rows ]) ]
     def DEFAULT(builder):
         return 'DEFAULT'
     def UPDATE(builder, table_name, pairs, where=None):
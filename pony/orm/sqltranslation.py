@@ -6,7 +6,7 @@ from decimal import Decimal
 from datetime import date, time, datetime, timedelta
 from random import random
 from copy import deepcopy
-from functools import update_wrapper
+from functools import update_wrapper, partial
 from uuid import UUID
 
 from pony.thirdparty.compiler import ast
@@ -66,12 +66,29 @@ def type2str(t):
     try: return t.__name__
     except: return str(t)
 
+def load_object_from_row(entity, values):
+    if None in values: return None
+    return entity._get_by_raw_pkval_(values)
+
+def load_value_from_row(converter, value):
+    if value is None: return None
+    value = converter.sql2py(value)
+    value = converter.dbval2val(value)
+    return value
+
+def collect_table_names(sql_ast, table_names):
+    if sql_ast and sql_ast[0] == 'RAWSQL': table_names.add(None)  # raw SQL fragment can refer to any table
+    elif len(sql_ast) > 2 and sql_ast[1] == 'TABLE': table_names.add(sql_ast[2])
+    for item in sql_ast:
+        if isinstance(item, (list, tuple)): collect_table_names(item, table_names)
+
 class SQLTranslator(ASTTranslator):
     dialect = None
     row_value_syntax = True
     json_path_wildcard_syntax = False
     json_values_are_comparable = True
     rowid_support = False
+    nulls_are_largest = False  # NULLs go after other values in ascending order
 
     def default_post(translator, node):
         throw(NotImplementedError)  # pragma: no cover
@@ -185,6 +202,7 @@ class SQLTranslator(ASTTranslator):
         translator.aggregated = False if not optimize else True
         translator.hint_join = False
         translator.query_result_is_cacheable = True
+        translator.table_names = None
         translator.aggregated_subquery_paths = set()
         for i, qual in enumerate(tree.quals):
             assign = qual.assign
@@ -339,19 +357,13 @@ class SQLTranslator(ASTTranslator):
                 if isinstance(expr_type, SetType): expr_type = expr_type.item_type
                 if isinstance(expr_type, EntityMeta):
                     next_offset = offset + len(expr_type._pk_columns_)
-                    def func(values, constructor=expr_type._get_by_raw_pkval_):
-                        if None in values: return None
-                        return constructor(values)
+                    func = partial(load_object_from_row, expr_type)
                     row_layout.append((func, slice(offset, next_offset), ast2src(m.node)))
                     m.orderby_columns = list(xrange(offset+1, next_offset+1))
                     offset = next_offset
                 else:
                     converter = provider.get_converter_by_py_type(expr_type)
-                    def func(value, converter=converter):
-                        if value is None: return None
-                        value = converter.sql2py(value)
-                        value = converter.dbval2val(value)
-                        return value
+                    func = partial(load_value_from_row, converter)
                     row_layout.append((func, offset, ast2src(m.node)))
                     m.orderby_columns = (offset+1,) if not m.disable_ordering else ()
                     offset += 1
@@ -389,6 +401,13 @@ class SQLTranslator(ASTTranslator):
         if translator.groupby_monads: return False
         if len(translator.aggregated_subquery_paths) != 1: return False
         return next(iter(translator.aggregated_subquery_paths))
+    def get_table_names(translator):
+        if translator.table_names is None:
+            sql_ast, attr_offsets = translator.construct_sql_ast()
+            table_names = set()
+            collect_table_names(sql_ast, table_names)
+            translator.table_names = frozenset(table_names)
+        return translator.table_names
     def construct_sql_ast(translator, range=None, distinct=None, aggr_func_name=None, for_update=False, nowait=False,
                           attrs_to_prefetch=(), is_not_null_checks=False):
         attr_offsets = None
@@ -597,6 +616,39 @@ class SQLTranslator(ASTTranslator):
                 monads.append(CmpMonad('==', attr_monad, param_monad))
         for m in monads: translator.conditions.extend(m.getsql())
         return translator
+    def apply_keyset(translator, keyattrs):
+        translator = deepcopy(translator)
+        object_monad = translator.tree.expr.monad
+        left_sql, right_sql, desc_flags, nullable_flags = [], [], [], []
+        for attr, desc, id in keyattrs:
+            attr_monad = object_monad.getattr(attr.name)
+            columns = attr_monad.getsql()
+            left_sql.extend(columns)
+            if id is None: right_sql.extend([ None ] * len(columns))  # key value is NULL
+            else:
+                param_monad = translator.ParamMonad.new(translator, attr.py_type, (id, None, None))
+                right_sql.extend(param_monad.getsql())
+            desc_flags.extend([ desc ] * len(columns))
+            nullable_flags.extend([ bool(attr.nullable) ] * len(columns))
+        assert len(left_sql) == len(right_sql)
+        nulls_after = [ desc != translator.nulls_are_largest for desc in desc_flags ]
+        if translator.row_value_syntax and len(left_sql) > 1 and len(set(desc_flags)) == 1 \
+                and None not in right_sql and not (nulls_after[0] and any(nullable_flags)):
+            condition = [ 'LT' if desc_flags[0] else 'GT', [ 'ROW' ] + left_sql, [ 'ROW' ] + right_sql ]
+        else:
+            clauses = []
+            for i, desc in enumerate(desc_flags):
+                if right_sql[i] is None:
+                    if nulls_after[i]: continue
+                    last = [ 'IS_NOT_NULL', left_sql[i] ]
+                else:
+                    last = [ 'LT' if desc else 'GT', left_sql[i], right_sql[i] ]
+                    if nullable_flags[i] and nulls_after[i]: last = sqlor([ last, [ 'IS_NULL', left_sql[i] ] ])
+                clauses.append(sqland([ [ 'EQ', left_sql[j], right_sql[j] ] if right_sql[j] is not None
+                                        else [ 'IS_NULL', left_sql[j] ] for j in xrange(i) ] + [ last ]))
+            condition = sqlor(clauses)
+        translator.conditions.append(condition)
+        return translator
     def apply_lambda(translator, filter_num, order_by, func_ast, argnames, original_names, extractors, vartypes):
         translator = deepcopy(translator)
         func_ast = copy_ast(func_ast)  # func_ast = deepcopy(func_ast)
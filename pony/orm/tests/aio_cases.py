@@ -0,0 +1,140 @@
+# Python 3 only: imported by test_aio.py
+import asyncio, os, tempfile, threading, unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+from pony.orm import aio
+
+class TestAsyncio(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        db = self.db = Database('sqlite', self.filename)
+
+        class Person(db.Entity):
+            name = Required(str)
+            age = Optional(int)
+            bio = Optional(LongStr)
+
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            Person(name='John', age=20, bio='Bio')
+            Person(name='Mike', age=30)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        self.db.disconnect()
+        os.remove(self.filename)
+
+    def run_tasks(self, *coroutines):
+        result = self.loop.run_until_complete(asyncio.gather(*coroutines))
+        self.assertEqual(len(aio.task_sessions), 0)
+        return result
+
+    def test_fetch(self):
+        db = self.db
+        async def task():
+            async with db_session:
+                query = select(p.name for p in db.Person).order_by(1)
+                return await query.fetch(), await query.fetch(limit=1, offset=1)
+        self.assertEqual(self.run_tasks(task()), [ ([ 'John', 'Mike' ], [ 'Mike' ]) ])
+
+    def test_flush(self):
+        db = self.db
+        async def task():
+            async with db_session:
+                person = await aio.run(db.Person, name='Kate')
+                await person.flush()
+                return await aio.run(lambda: person.id)
+        person_id, = self.run_tasks(task())
+        self.assertTrue(person_id is not None)
+        with db_session:
+            self.assertEqual(db.Person[person_id].name, 'Kate')
+
+    def test_commit_on_exit(self):
+        db = self.db
+        async def task():
+            async with db_session:
+                await aio.run(lambda: setattr(db.Person[1], 'age', 21))
+        self.run_tasks(task())
+        with db_session:
+            self.assertEqual(db.Person[1].age, 21)
+
+    def test_rollback_on_error(self):
+        db = self.db
+        async def task():
+            try:
+                async with db_session:
+                    await aio.run(db.Person, name='Kate')
+                    1 / 0
+            except ZeroDivisionError: pass
+            else: self.fail('ZeroDivisionError was not raised')
+        self.run_tasks(task())
+        with db_session:
+            self.assertEqual(db.Person.select().count(), 2)
+
+    def test_concurrent_tasks(self):
+        db = self.db
+        async def task(name):
+            async with db_session:
+                person = await aio.run(db.Person, name=name)
+                await person.flush()
+        self.run_tasks(*[ task('P%d' % i) for i in range(5) ])
+        with db_session:
+            self.assertEqual(db.Person.select().count(), 7)
+
+    def test_nested_session(self):
+        db = self.db
+        async def task():
+            async with db_session:
+                async with db_session:
+                    await aio.run(db.Person, name='Kate')
+                self.assertEqual(len(aio.task_sessions), 1)
+        self.run_tasks(task())
+        with db_session:
+            self.assertEqual(db.Person.select().count(), 3)
+
+    def test_shared_bounded_pool(self):
+        db = self.db
+        threads = set()
+        async def task(name):
+            async with db_session:
+                person = await aio.run(db.Person, name=name)
+                await asyncio.sleep(0.01)
+                await person.flush()
+                threads.add(await aio.run(threading.get_ident))
+        pool, aio.pool = aio.pool, aio.WorkerPool(max_size=2)
+        try:
+            self.run_tasks(*[ task('P%d' % i) for i in range(6) ])
+            self.assertEqual(aio.pool.size, 2)
+        finally: aio.pool = pool
+        self.assertEqual(len(threads), 2)
+        with db_session:
+            self.assertEqual(db.Person.select().count(), 8)
+
+    def test_queries_from_event_loop_thread(self):
+        db = self.db
+        message = 'Database cannot be accessed from the event loop thread inside of `async with db_session`. ' \
+                  'Use `await aio.run(func)` instead'
+        async def task():
+            async with db_session:
+                person = await aio.run(db.Person.__getitem__, 1)
+                for func in (lambda: db.Person[2], lambda: person.bio, lambda: db.Person.select().count()):
+                    with self.assertRaises(TransactionError) as cm: func()
+                    self.assertEqual(cm.exception.args[0], message)
+                return await aio.run(lambda: person.bio)
+        self.assertEqual(self.run_tasks(task()), [ 'Bio' ])
+
+    def test_sync_calls_are_not_affected(self):
+        db = self.db
+        with db_session:
+            self.assertEqual(select(p.name for p in db.Person).order_by(1).fetch(), [ 'John', 'Mike' ])
+
+    @raises_exception(TransactionError, 'db_session is required when working with the database')
+    def test_run_without_session(self):
+        async def task():
+            aio.run(lambda: None)
+        self.run_tasks(task())
@@ -0,0 +1,14 @@
+from __future__ import absolute_import, print_function, division
+from pony.py23compat import PY2
+
+import unittest
+
+if PY2:
+    @unittest.skip('asyncio is not available in Python 2')
+    class TestAsyncio(unittest.TestCase):
+        def test_asyncio(self): pass
+else:
+    from pony.orm.tests.aio_cases import TestAsyncio
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+class TestBatchSave(unittest.TestCase):
+    def setUp(self):
+        db = self.db = Database('sqlite', ':memory:')
+
+        class Person(db.Entity):
+            name = Required(unicode)
+            age = Optional(int)
+            mentor = Optional('Person', reverse='pupils')
+            pupils = Set('Person', reverse='mentor')
+
+        class Tag(db.Entity):
+            name = PrimaryKey(unicode)
+
+        class Team(db.Entity):
+            name = Required(unicode)
+            members = Set('Member', cascade_delete=True)
+
+        class Member(db.Entity):
+            team = Required(Team)
+            number = Required(int)
+            PrimaryKey(team, number)
+
+        db.generate_mapping(create_tables=True)
+
+    def tearDown(self):
+        self.db = None
+
+    def count_statements(self, prefix):
+        return sum(stat.db_count for sql, stat in self.db.local_stats.items() if sql.startswith(prefix))
+
+    def test_insert_auto_pk(self):
+        db = self.db
+        with db_session:
+            persons = [ db.Person(name='P%d' % i, age=i) for i in range(300) ]
+            db.merge_local_stats()
+            flush()
+            self.assertEqual([ p.id for p in persons ], list(range(1, 301)))
+            self.assertTrue(1 < self.count_statements('INSERT') < 300)
+            self.assertTrue(db.Person[150] is persons[149])
+        with db_session:
+            self.assertEqual(db.Person[150].name, 'P149')
+            self.assertEqual(count(p for p in db.Person), 300)
+
+    def test_insert_manual_pk(self):
+        db = self.db
+        with db_session:
+            for i in range(10): db.Tag(name='T%d' % i)
+            db.merge_local_stats()
+        self.assertEqual(self.count_statements('INSERT'), 1)
+        with db_session:
+            self.assertEqual(select(t.name for t in db.Tag).count(), 10)
+
+    def test_insert_ids_from_sequence(self):
+        db = self.db
+        provider = db.provider
+        provider.insert_many_ids = 'sequence'
+        provider.get_next_ids_sql = lambda table_name, column_name, count: (
+            'WITH RECURSIVE s(i) AS (SELECT 101 UNION ALL SELECT i + 1 FROM s WHERE i < 100 + ?) SELECT i FROM s',
+            (count,))
+        with db_session:
+            persons = [ db.Person(name='P%d' % i) for i in range(3) ]
+            db.merge_local_stats()
+        self.assertEqual([ p.id for p in persons ], [ 101, 102, 103 ])
+        self.assertEqual(self.count_statements('INSERT'), 1)
+        with db_session:
+            self.assertEqual(db.Person[102].name, 'P1')
+
+    def test_insert_without_sequence(self):
+        db = self.db
+        provider = db.provider
+        provider.insert_many_ids = 'sequence'
+        provider.get_next_ids_sql = lambda table_name, column_name, count: ('SELECT NULL', None)
+        with db_session:
+            persons = [ db.Person(name='P%d' % i) for i in range(3) ]
+            db.merge_local_stats()
+        self.assertEqual([ p.id for p in persons ], [ 1, 2, 3 ])
+        self.assertEqual(self.count_statements('INSERT'), 3)
+
+    def test_insert_different_attrs(self):
+        db = self.db
+        with db_session:
+            a = db.Person(name='A', age=1)
+            b = db.Person(name='B')
+            c = db.Person(name='C', age=3)
+            d = db.Person(name='D')
+        self.assertEqual([ a.id, b.id, c.id, d.id ], [ 1, 2, 3, 4 ])
+        with db_session:
+            self.assertEqual(db.Person[2].age, None)
+            self.assertEqual(db.Person[3].age, 3)
+
+    def test_insert_with_unsaved_principal(self):
+        db = self.db
+        with db_session:
+            a = db.Person(name='A')
+            b = db.Person(name='B', mentor=a)
+            c = db.Person(name='C', mentor=a)
+            d = db.Person(name='D')
+            b.mentor = d
+        with db_session:
+            self.assertEqual(db.Person[b.id].mentor, db.Person[d.id])
+            self.assertEqual(db.Person[c.id].mentor, db.Person[a.id])
+
+    @raises_exception(TransactionIntegrityError)
+    def test_insert_integrity_error(self):
+        db = self.db
+        with db_session:
+            db.Tag(name='T1')
+        with db_session:
+            db.Tag(name='T0')
+            db.Tag(name='T1')
+
+    def test_update(self):
+        db = self.db
+        with db_session:
+            for i in range(10): db.Person(name='P%d' % i, age=i)
+        with db_session:
+            for p in db.Person.select(): p.age += 100
+            db.merge_local_stats()
+        self.assertEqual(self.count_statements('UPDATE'), 1)
+        with db_session:
+            self.assertEqual(select(p.age for p in db.Person).min(), 100)
+
+    def test_update_optimistic_check(self):
+        db = self.db
+        with db_session:
+            for i in range(10): db.Person(name='P%d' % i, age=i)
+        with db_session:
+            persons = db.Person.select()[:]
+            db.execute("update Person set name = 'X' where id = 3")
+            for p in persons: p.name += '!'
+            try: flush()
+            except OptimisticCheckError as e:
+                self.assertTrue(str(e).startswith('Object Person[3] was updated outside of current transaction'))
+                rollback()
+            else: self.fail('OptimisticCheckError was not raised')
+
+    def test_delete(self):
+        db = self.db
+        with db_session:
+            for i in range(10): db.Tag(name='T%d' % i)
+        with db_session:
+            db.Tag.select().delete()
+            db.merge_local_stats()
+        self.assertEqual(self.count_statements('DELETE'), 1)
+        with db_session:
+            self.assertEqual(db.Tag.select().count(), 0)
+
+    def test_delete_updated_outside(self):
+        db = self.db
+        with db_session:
+            for i in range(10): db.Team(name='T%d' % i)
+        with db_session:
+            teams = db.Team.select()[:]
+            db.execute("update Team set name = 'X' where id = 3")
+            for team in teams:
+                team.name
+                team.delete()
+            try: flush()
+            except OptimisticCheckError as e:
+                self.assertTrue(str(e).startswith('Object Team[3] was updated outside of current transaction. Changes: name'))
+                rollback()
+            else: self.fail('OptimisticCheckError was not raised')
+        with db_session:
+            self.assertEqual(db.Team.select().count(), 10)
+
+    def test_delete_cascade_composite_pk(self):
+        db = self.db
+        with db_session:
+            team = db.Team(name='A')
+            for i in range(300): db.Member(team=team, number=i)
+            db.Team(name='B')
+        with db_session:
+            db.Team[1].delete()
+            db.merge_local_stats()
+        self.assertEqual(self.count_statements('DELETE'), 4)
+        with db_session:
+            self.assertEqual(db.Member.select().count(), 0)
+            self.assertEqual(select(t.name for t in db.Team)[:], [ 'B' ])
+
+    def test_delete_self_referencing(self):
+        db = self.db
+        with db_session:
+            a = db.Person(name='A')
+            db.Person(name='B', mentor=a)
+            db.Person(name='C', mentor=a)
+        with db_session:
+            db.Person.select(lambda p: p.mentor).delete()
+            db.merge_local_stats()
+        self.assertEqual(self.count_statements('DELETE'), 2)
+        with db_session:
+            self.assertEqual(select(p.name for p in db.Person)[:], [ 'A' ])
+
+    def test_delete_optimistic_check(self):
+        db = self.db
+        with db_session:
+            for i in range(10): db.Tag(name='T%d' % i)
+        with db_session:
+            tags = db.Tag.select()[:]
+            t5 = repr(db.Tag['T5'])
+            db.execute("delete from Tag where name = 'T5'")
+            for tag in tags: tag.delete()
+            try: flush()
+            except OptimisticCheckError as e:
+                self.assertEqual(str(e), 'Object %s was deleted outside of current transaction' % t5)
+                rollback()
+            else: self.fail('OptimisticCheckError was not raised')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+db = Database('sqlite', ':memory:')
+
+class Post(db.Entity):
+    title = Required(unicode)
+    comments = Set('Comment')
+    tags = Set('Tag')
+
+class Comment(db.Entity):
+    post = Required(Post)
+
+class Tag(db.Entity):
+    posts = Set(Post)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    tags = [ Tag() for i in range(3) ]
+    for i in range(5):
+        post = Post(id=i+1, title='p%d' % i, tags=tags[:i])
+        for j in range(i): Comment(post=post)
+
+class TestCollectionCounts(unittest.TestCase):
+    def setUp(self):
+        db_session.__enter__()
+        db.merge_local_stats()
+
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+
+    def select_count(self):
+        return sum(stat.db_count for sql, stat in db.local_stats.items() if sql.startswith('SELECT'))
+
+    def test_batched_counts(self):
+        posts = Post.select().order_by(Post.id)[:]
+        self.assertEqual([ post.comments.count() for post in posts ], [ 0, 1, 2, 3, 4 ])
+        self.assertEqual(self.select_count(), 3)
+
+    def test_prefetch_count(self):
+        posts = Post.select().order_by(Post.id).prefetch_count(Post.comments, Post.tags)[:]
+        self.assertEqual(self.select_count(), 3)
+        self.assertEqual([ post.comments.count() for post in posts ], [ 0, 1, 2, 3, 4 ])
+        self.assertEqual([ post.tags.count() for post in posts ], [ 0, 1, 2, 3, 3 ])
+        self.assertEqual(self.select_count(), 3)
+
+    def test_unsaved_changes(self):
+        posts = Post.select().order_by(Post.id)[:]
+        Comment(post=posts[0])
+        posts[1].comments.clear()
+        self.assertEqual(posts[2].comments.count(), 2)
+        self.assertEqual(posts[0].comments.count(), 1)
+        self.assertEqual(posts[1].comments.count(), 0)
+
+    def test_batches(self):
+        provider = db.provider
+        provider.max_params_count, max_params_count = 2, provider.max_params_count
+        try: posts = Post.select().order_by(Post.id).prefetch_count(Post.comments)[:]
+        finally: provider.max_params_count = max_params_count
+        self.assertEqual(self.select_count(), 4)
+        self.assertEqual([ post.comments.count() for post in posts ], [ 0, 1, 2, 3, 4 ])
+        self.assertEqual(self.select_count(), 4)
+
+    @raises_exception(TypeError, 'Argument of prefetch_count() query method must be collection attribute. '
+                                 'Got: Post.title')
+    def test_not_collection(self):
+        Post.select().prefetch_count(Post.title)
+
+if __name__ == '__main__':
+    unittest.main()
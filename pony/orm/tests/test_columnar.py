@@ -0,0 +1,130 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+from array import array
+from datetime import date, datetime
+
+from pony.orm.core import *
+from pony.orm import columnar
+from pony.orm.tests.testutils import *
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        db = self.db = Database('sqlite', ':memory:')
+
+        class Person(db.Entity):
+            name = Required(unicode)
+            age = Optional(int)
+            weight = Optional(float)
+            active = Required(bool)
+            birthday = Optional(date)
+            registered = Optional(datetime)
+
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            Person(name='John', age=20, weight=70.5, active=True,
+                   birthday=date(1990, 1, 2), registered=datetime(2017, 1, 2, 3, 4, 5, 6))
+            Person(name='Mike', age=30, weight=80, active=False,
+                   birthday=date(1980, 3, 4), registered=datetime(2017, 5, 6, 7, 8, 9))
+            Person(name='Kate', age=None, weight=None, active=True)
+
+    def fetch(self, query, use_numpy, chunk_size=2):
+        with db_session:
+            return columnar.fetch_columns(query, chunk_size, use_numpy)
+
+    def test_arrays(self):
+        db = self.db
+        query = select((p.id, p.name, p.active, p.birthday) for p in db.Person).order_by(1)
+        ids, names, active, birthdays = self.fetch(query, False)
+        self.assertEqual(ids, array(columnar.int_typecode, [ 1, 2, 3 ]))
+        self.assertEqual(names, [ 'John', 'Mike', 'Kate' ])
+        self.assertEqual(active, array('B', [ 1, 0, 1 ]))
+        self.assertEqual(birthdays, [ date(1990, 1, 2), date(1980, 3, 4), None ])
+
+    def test_arrays_with_nulls(self):
+        db = self.db
+        ids, ages, weights = self.fetch(select((p.id, p.age, p.weight) for p in db.Person).order_by(1), False)
+        self.assertEqual(ages, [ 20, 30, None ])
+        self.assertEqual(weights.typecode, 'd')
+        self.assertEqual(weights[:2].tolist(), [ 70.5, 80.0 ])
+        self.assertTrue(weights[2] != weights[2])
+
+    def test_big_ints_with_nulls(self):
+        db = self.db
+        with db_session:
+            db.execute("update Person set age = 9007199254740993 where id = 1")
+        ids, ages = self.fetch(select((p.id, p.age) for p in db.Person).order_by(1), False)
+        self.assertEqual(ages, [ 2**53 + 1, 30, None ])
+
+    def test_values_are_converted(self):
+        db = self.db
+        with db_session:
+            db.execute('update Person set active = 2 where id = 2')
+        ids, active = self.fetch(select((p.id, p.active) for p in db.Person).order_by(1), False)
+        self.assertEqual(active, array('B', [ 1, 1, 1 ]))
+
+    def test_single_chunk(self):
+        db = self.db
+        ages = self.fetch(select(p.age for p in db.Person if p.age).order_by(1), False, chunk_size=10)
+        self.assertEqual(ages, array(columnar.int_typecode, [ 20, 30 ]))
+
+    def test_empty_result(self):
+        db = self.db
+        ids, names = self.fetch(select((p.id, p.name) for p in db.Person if p.age > 100), False)
+        self.assertEqual(ids, array(columnar.int_typecode))
+        self.assertEqual(names, [])
+
+    @unittest.skipIf(columnar.numpy is None, 'NumPy is not installed')
+    def test_numpy(self):
+        db = self.db
+        numpy = columnar.numpy
+        with db_session:
+            ids, ages, weights, active, birthdays, registered = select(
+                (p.id, p.age, p.weight, p.active, p.birthday, p.registered) for p in db.Person
+            ).order_by(1).to_numpy(chunk_size=2)
+        self.assertEqual(ids.dtype, numpy.int64)
+        self.assertEqual(ids.tolist(), [ 1, 2, 3 ])
+        self.assertEqual(ages.dtype, numpy.int64)
+        self.assertEqual(ages.tolist(), [ 20, 30, None ])
+        self.assertEqual(weights.tolist()[:2], [ 70.5, 80.0 ])
+        self.assertEqual(active.dtype, numpy.bool_)
+        self.assertEqual(active.tolist(), [ True, False, True ])
+        self.assertEqual(birthdays.dtype, numpy.dtype('datetime64[D]'))
+        self.assertEqual(birthdays.tolist(), [ date(1990, 1, 2), date(1980, 3, 4), None ])
+        self.assertEqual(registered.dtype, numpy.dtype('datetime64[us]'))
+        self.assertEqual(registered.tolist()[:2], [ datetime(2017, 1, 2, 3, 4, 5, 6), datetime(2017, 5, 6, 7, 8, 9) ])
+
+    @unittest.skipIf(columnar.numpy is None, 'NumPy is not installed')
+    def test_numpy_big_ints_with_nulls(self):
+        db = self.db
+        with db_session:
+            db.execute("update Person set age = 9007199254740993 where id = 1")
+            ids, ages = select((p.id, p.age) for p in db.Person).order_by(1).to_numpy(chunk_size=2)
+        self.assertEqual(ages.dtype, columnar.numpy.int64)
+        self.assertEqual(ages.tolist(), [ 2**53 + 1, 30, None ])
+
+    @unittest.skipIf(columnar.numpy is None, 'NumPy is not installed')
+    def test_numpy_object_column(self):
+        db = self.db
+        with db_session:
+            ids, names = select((p.id, p.name) for p in db.Person).order_by(1).to_numpy()
+        self.assertEqual(names.dtype, object)
+        self.assertEqual(names.tolist(), [ 'John', 'Mike', 'Kate' ])
+
+    @raises_exception(TypeError, 'Query returning entity instances cannot be converted to columns')
+    def test_entity_query(self):
+        with db_session:
+            self.db.Person.select().to_columns()
+
+    @raises_exception(TypeError, 'Expression p returns entity instances and cannot be converted to column')
+    def test_entity_column(self):
+        with db_session:
+            select((p, p.name) for p in self.db.Person).to_columns()
+
+    @raises_exception(ValueError, 'chunk_size must be positive number. Got: 0')
+    def test_chunk_size(self):
+        with db_session:
+            select(p.name for p in self.db.Person).to_columns(0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from __future__ import absolute_import, print_function, division
+
+import sys, unittest
+
+from pony.orm.core import *
+from pony.orm.core import CompactValues
+from pony.orm.tests.testutils import *
+
+class TestCompactValues(unittest.TestCase):
+    def setUp(self):
+        db = self.db = Database('sqlite', ':memory:')
+
+        class Person(db.Entity):
+            _compact_ = True
+            name = Required(unicode)
+            age = Optional(int)
+            friends = Set('Person', reverse='friends')
+
+        class Student(Person):
+            gpa = Optional(float)
+
+        class Tag(db.Entity):
+            name = Required(unicode)
+
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            john = Person(name='John', age=20)
+            Student(name='Mike', gpa=4.0, friends=[ john ])
+            Tag(name='tag')
+
+    def test_layout(self):
+        db = self.db
+        self.assertTrue(issubclass(db.Person._vals_type_, CompactValues))
+        self.assertTrue(db.Student._vals_type_ is db.Person._vals_type_)
+        self.assertTrue(db.Tag._vals_type_ is dict)
+        with db_session:
+            p = db.Person[1]
+            self.assertTrue(isinstance(p._vals_, db.Person._vals_type_))
+            self.assertFalse(hasattr(p._vals_, '__dict__'))
+
+    def test_load_and_modify(self):
+        db = self.db
+        with db_session:
+            p = db.Person[1]
+            self.assertEqual(p.name, 'John')
+            self.assertEqual(p.age, 20)
+            p.age = 21
+            self.assertEqual(p.to_dict(), {'id': 1, 'name': 'John', 'age': 21, 'classtype': 'Person'})
+        with db_session:
+            self.assertEqual(db.Person[1].age, 21)
+
+    def test_subclass_loaded_through_base(self):
+        db = self.db
+        with db_session:
+            mike = db.Person[2]
+            self.assertTrue(isinstance(mike, db.Student))
+            self.assertEqual(mike.gpa, 4.0)
+            self.assertEqual(set(f.name for f in db.Person[1].friends), {'Mike'})
+
+    def test_delete(self):
+        db = self.db
+        with db_session:
+            db.Person[2].delete()
+        with db_session:
+            self.assertEqual(db.Person.select().count(), 1)
+            self.assertEqual(db.Person[1].friends.count(), 0)
+
+    def test_mapping_interface(self):
+        vals = self.db.Person._vals_type_()
+        name = self.db.Person.name
+        self.assertFalse(name in vals)
+        self.assertEqual(vals.get(name), None)
+        self.assertRaises(KeyError, vals.__getitem__, name)
+        vals[name] = 'John'
+        self.assertEqual(vals.items(), [ (name, 'John') ])
+        self.assertEqual(len(vals), 1)
+        self.assertEqual(vals.pop(name), 'John')
+        self.assertEqual(vals.pop(name, None), None)
+        self.assertEqual(len(vals), 0)
+
+    def test_attribute_not_in_layout(self):
+        vals = self.db.Person._vals_type_()
+        attr = self.db.Tag.name
+        self.assertFalse(attr in vals)
+        self.assertEqual(vals.get(attr), None)
+        self.assertEqual(vals.get(attr, 'default'), 'default')
+        self.assertEqual(vals.pop(attr, None), None)
+        self.assertRaises(KeyError, vals.pop, attr)
+        self.assertRaises(KeyError, vals.__getitem__, attr)
+
+    def test_size(self):
+        db = self.db
+        with db_session:
+            p = db.Person[1]
+            vals = dict(p._vals_.items())
+            self.assertTrue(sys.getsizeof(p._vals_) < sys.getsizeof(vals))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+from __future__ import absolute_import, print_function, division
+
+import os, tempfile, threading, unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+class TestEntityCache(unittest.TestCase):
+    def setUp(self):
+        db = self.db = Database('sqlite', ':memory:')
+
+        class Country(db.Entity):
+            _cache_ = True
+            code = Required(str, unique=True)
+            name = Required(unicode)
+            capital = Optional('City', reverse='capital_of')
+            cities = Set('City', reverse='country')
+            persons = Set('Person')
+
+        class City(db.Entity):
+            _cache_ = EntityCache(max_size=10, ttl=60)
+            name = Required(unicode)
+            country = Required(Country, reverse='cities')
+            capital_of = Optional(Country, reverse='capital')
+
+        class Person(db.Entity):
+            name = Required(unicode)
+            country = Required(Country)
+
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            us = Country(code='US', name='United States')
+            fr = Country(code='FR', name='France')
+            us.capital = City(name='Washington', country=us)
+            fr.capital = City(name='Paris', country=fr)
+            Person(name='John', country=us)
+
+    def count_selects(self):
+        return sum(stat.db_count for sql, stat in self.db.local_stats.items() if sql.startswith('SELECT'))
+
+    def warm_up(self):
+        with db_session:
+            select(c for c in self.db.Country)[:]
+            select(c for c in self.db.City)[:]
+
+    def test_getitem(self):
+        db = self.db
+        self.warm_up()
+        count = self.count_selects()
+        with db_session:
+            city = db.City[1]
+            self.assertEqual(city.name, 'Washington')
+            self.assertEqual(city.country.name, 'United States')
+            self.assertTrue(city.capital_of is city.country)
+        self.assertEqual(self.count_selects(), count)
+
+    def test_get_by_unique_key(self):
+        db = self.db
+        self.warm_up()
+        count = self.count_selects()
+        with db_session:
+            fr = db.Country.get(code='FR')
+            self.assertEqual(fr.name, 'France')
+            self.assertEqual(db.Country.get(code='FR', name='France'), fr)
+        self.assertEqual(self.count_selects(), count)
+
+    def test_reference_loading(self):
+        db = self.db
+        self.warm_up()
+        with db_session:
+            p = db.Person[1]
+            count = self.count_selects()
+            self.assertEqual(p.country.name, 'United States')
+        self.assertEqual(self.count_selects(), count)
+
+    def test_miss(self):
+        db = self.db
+        with db_session:
+            self.assertEqual(db.Country[2].name, 'France')
+            self.assertEqual(db.Country.get(code='XX'), None)
+        self.assertEqual(db.Country._cache_.get(('Country', (2,)))['name'], 'France')
+
+    def test_update_invalidates(self):
+        db = self.db
+        self.warm_up()
+        with db_session:
+            db.Country[1].name = 'USA'
+        with db_session:
+            self.assertEqual(db.Country[1].name, 'USA')
+        with db_session:
+            self.assertEqual(db.Country.get(code='US').name, 'USA')
+
+    def test_key_update(self):
+        db = self.db
+        self.warm_up()
+        with db_session:
+            db.Country[1].code = 'USA'
+        with db_session:
+            self.assertEqual(db.Country.get(code='US'), None)
+            self.assertEqual(db.Country.get(code='USA').name, 'United States')
+
+    def test_delete_invalidates(self):
+        db = self.db
+        self.warm_up()
+        with db_session:
+            db.Country[2].capital.delete()
+        with db_session:
+            self.assertEqual(db.City.get(id=2), None)
+            self.assertEqual(db.Country[2].capital, None)
+
+    def test_bulk_delete_invalidates(self):
+        db = self.db
+        self.warm_up()
+        with db_session:
+            delete(c for c in db.City)
+        self.assertEqual(len(db.City._cache_.lru), 0)
+        with db_session:
+            self.assertEqual(db.City.get(id=1), None)
+
+    def test_rollback(self):
+        db = self.db
+        self.warm_up()
+        with db_session:
+            db.Country[1].name = 'USA'
+            flush()
+            rollback()
+        with db_session:
+            self.assertEqual(db.Country[1].name, 'United States')
+
+    def test_no_population_inside_transaction(self):
+        db = self.db
+        with db_session:
+            db.Person[1].name = 'Mike'
+            flush()
+            select(c for c in db.Country)[:]
+        self.assertEqual(len(db.Country._cache_.lru), 0)
+
+    def test_no_population_after_concurrent_commit(self):
+        fd, filename = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        db = Database('sqlite', filename)
+        class Country(db.Entity):
+            _cache_ = True
+            name = Required(unicode)
+        db.generate_mapping(create_tables=True)
+        try:
+            with db_session:
+                Country(id=1, name='France')
+                Country(id=2, name='Germany')
+            def update():
+                with db_session:
+                    Country[1].name = 'Republique francaise'
+            with db_session:
+                self.assertEqual(Country[2].name, 'Germany')
+                thread = threading.Thread(target=update)
+                thread.start()
+                thread.join()
+                self.assertEqual(Country[1].name, 'Republique francaise')
+            self.assertEqual(Country._cache_.get(('Country', (1,))), None)
+            with db_session:
+                self.assertEqual(Country[1].name, 'Republique francaise')
+            self.assertEqual(Country._cache_.get(('Country', (1,)))['name'], 'Republique francaise')
+        finally:
+            db.disconnect()
+            os.remove(filename)
+
+    def test_ttl(self):
+        db = self.db
+        db.City._cache_.ttl = -1
+        self.warm_up()
+        count = self.count_selects()
+        with db_session:
+            self.assertEqual(db.City[1].name, 'Washington')
+        self.assertEqual(self.count_selects(), count + 1)
+
+    def test_for_update_bypasses_cache(self):
+        db = self.db
+        self.warm_up()
+        count = self.count_selects()
+        with db_session:
+            db.Country.get_for_update(code='US')
+        self.assertEqual(self.count_selects(), count + 1)
+
+    @raises_exception(ERDiagramError, 'Shared cache cannot be used with entity inheritance (entity Student)')
+    def test_inheritance(self):
+        db = Database('sqlite', ':memory:')
+        class Person(db.Entity):
+            _cache_ = True
+            name = Required(unicode)
+        class Student(Person):
+            group = Optional(int)
+
+    @raises_exception(TypeError, 'Foo._cache_ must be True or cache object with get(), set(), delete() and clear() methods. Got: 1')
+    def test_invalid_backend(self):
+        db = Database('sqlite', ':memory:')
+        class Foo(db.Entity):
+            _cache_ = 1
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+from datetime import date
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    students = Set('Student')
+
+class Person(db.Entity):
+    name = Required(unicode)
+    birthday = Optional(date)
+    biography = Optional(LongUnicode)
+
+class Student(Person):
+    group = Required(Group)
+    gpa = Optional(float)
+
+class Teacher(Person):
+    degree = Optional(unicode)
+
+class Room(db.Entity):
+    building = Required(unicode)
+    number = Required(int)
+    PrimaryKey(building, number)
+    lessons = Set('Lesson')
+
+class Lesson(db.Entity):
+    room = Required(Room)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    g = Group(number=101)
+    Student(id=1, name='John', birthday=date(2000, 1, 2), group=g, gpa=4.5)
+    Teacher(id=2, name='Mike', degree='PhD', biography='...')
+    Lesson(room=Room(building='A', number=1))
+
+class TestEntityRecords(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+
+    def test_records(self):
+        records = select(s for s in Student).as_records()
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record.id, 1)
+        self.assertEqual(record.name, 'John')
+        self.assertEqual(record.birthday, date(2000, 1, 2))
+        self.assertEqual(record.group, 101)
+        self.assertEqual(record.gpa, 4.5)
+        self.assertEqual(record.classtype, 'Student')
+        self.assertFalse(hasattr(record, 'biography'))
+
+    def test_identity_map_is_not_used(self):
+        select(p for p in Person).as_records()
+        cache = db._get_cache()
+        self.assertEqual(len(cache.objects), 0)
+        self.assertEqual(len(cache.seeds[Group._pk_attrs_]), 0)
+
+    def test_inheritance(self):
+        records = select(p for p in Person).order_by(Person.id).as_records()
+        self.assertEqual([ type(record).__name__ for record in records ], [ 'StudentRecord', 'TeacherRecord' ])
+        self.assertEqual(records[1].degree, 'PhD')
+        self.assertFalse(hasattr(records[1], 'group'))
+
+    def test_composite_reference(self):
+        record = Lesson.select().as_records()[0]
+        self.assertEqual(record.room, ('A', 1))
+
+    def test_to_dict(self):
+        record = Group.select().as_records()[0]
+        self.assertEqual(record.to_dict(), {'number': 101})
+        self.assertEqual(repr(record), 'GroupRecord(number=101)')
+
+    def test_immutable(self):
+        record = Group.select().as_records()[0]
+        self.assertRaises(AttributeError, setattr, record, 'number', 102)
+
+    def test_record_type_is_reused(self):
+        r1 = Group.select().as_records()[0]
+        r2 = select(g for g in Group if g.number > 100).as_records()[0]
+        self.assertTrue(type(r1) is type(r2))
+
+    def test_unflushed_changes(self):
+        Group(number=102)
+        self.assertEqual(len(Group.select().as_records()), 2)
+
+    @raises_exception(TypeError, 'as_records() can be used only with queries which return entity instances')
+    def test_non_entity_query(self):
+        select(g.number for g in Group).as_records()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    students = Set('Student')
+
+class Student(db.Entity):
+    name = Required(unicode)
+    group = Required(Group)
+    age = Optional(int)
+    marks = Set('Mark')
+
+class Mark(db.Entity):
+    student = Required(Student)
+    subject = Required(unicode)
+    value = Required(int)
+    PrimaryKey(student, subject)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    for i in range(1, 4): Group(number=i)
+    for i in range(1, 21): Student(id=i, name='S%d' % (i % 5), group=i % 3 + 1, age=i % 4 or None)
+    for i in range(1, 4):
+        for subject in 'abc': Mark(student=i, subject=subject, value=i)
+
+class TestKeysetPagination(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+
+    def get_all_pages(self, query, page_size, order_by=None):
+        result = []
+        last = None
+        while True:
+            page = query.paginate_after(last, order_by)[:page_size]
+            if not page: return result
+            result.extend(page)
+            last = page[-1]
+
+    def test_by_pk(self):
+        students = self.get_all_pages(Student.select(), 3)
+        self.assertEqual([ s.id for s in students ], list(range(1, 21)))
+
+    def test_by_attribute(self):
+        students = self.get_all_pages(Student.select(), 4, Student.name)
+        expected = sorted(range(1, 21), key=lambda i: (i % 5, i))
+        self.assertEqual([ s.id for s in students ], expected)
+
+    def test_desc(self):
+        students = self.get_all_pages(Student.select(), 7, desc(Student.name))
+        expected = sorted(range(1, 21), key=lambda i: (-(i % 5), -i))
+        self.assertEqual([ s.id for s in students ], expected)
+
+    def test_mixed_directions(self):
+        students = self.get_all_pages(Student.select(), 3, (desc(Student.group), Student.name))
+        expected = sorted(range(1, 21), key=lambda i: (-(i % 3 + 1), i % 5, i))
+        self.assertEqual([ s.id for s in students ], expected)
+
+    def test_nullable_attribute(self):
+        # in SQLite NULL values go first in ascending order
+        students = self.get_all_pages(Student.select(), 3, Student.age)
+        expected = sorted(range(1, 21), key=lambda i: (i % 4, i))
+        self.assertEqual([ s.id for s in students ], expected)
+
+    def test_nullable_attribute_desc(self):
+        students = self.get_all_pages(Student.select(), 3, (desc(Student.age), Student.name))
+        expected = sorted(range(1, 21), key=lambda i: (-(i % 4), i % 5, i))
+        self.assertEqual([ s.id for s in students ], expected)
+
+    def test_none_in_tuple_key(self):
+        page = Student.select().paginate_after((None, 8), Student.age)[:3]
+        self.assertEqual([ s.id for s in page ], [ 12, 16, 20 ])
+        page = Student.select().paginate_after((None, 20), Student.age)[:3]
+        self.assertEqual([ s.id for s in page ], [ 1, 5, 9 ])
+
+    def test_nulls_are_largest(self):
+        translator_cls = db.provider.translator_cls
+        translator_cls.nulls_are_largest = True
+        db._translator_cache.clear()
+        try:
+            # SQLite still sorts NULLs first, so only the selected rows are checked
+            students = Student.select().paginate_after((2, 18), Student.age)[:]
+            self.assertEqual(sorted(s.id for s in students), [ 3, 4, 7, 8, 11, 12, 15, 16, 19, 20 ])
+            students = Student.select().paginate_after((None, 12), desc(Student.age))[:]
+            self.assertEqual(sorted(s.id for s in students), [ i for i in range(1, 21) if i % 4 or i < 12 ])
+        finally:
+            translator_cls.nulls_are_largest = False
+            db._translator_cache.clear()
+
+    def test_relation_attribute(self):
+        students = self.get_all_pages(Student.select(lambda s: s.id > 10), 4, Student.group)
+        expected = sorted(range(11, 21), key=lambda i: (i % 3 + 1, i))
+        self.assertEqual([ s.id for s in students ], expected)
+
+    def test_composite_pk(self):
+        marks = self.get_all_pages(Mark.select(), 2)
+        self.assertEqual([ (m.student.id, m.subject) for m in marks ],
+                         [ (i, subject) for i in range(1, 4) for subject in 'abc' ])
+
+    def test_tuple_key(self):
+        page = Student.select().paginate_after(('S4', 4), Student.name)[:3]
+        self.assertEqual([ s.id for s in page ], [ 9, 14, 19 ])
+
+    def test_single_value_key(self):
+        page = Student.select().paginate_after(17)[:10]
+        self.assertEqual([ s.id for s in page ], [ 18, 19, 20 ])
+
+    @raises_exception(TypeError, "Expected 2 key values (name, id). Got: ('S4',)")
+    def test_wrong_key_length(self):
+        Student.select().paginate_after(('S4',), Student.name)
+
+    @raises_exception(TypeError, 'Keyset pagination is limited to queries which return simple list of objects')
+    def test_not_entity_query(self):
+        select(s.name for s in Student).paginate_after('S1')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+db = Database('sqlite', ':memory:')
+
+class Article(db.Entity):
+    title = Required(unicode)
+    body = Optional(LongUnicode)
+
+class Review(Article):
+    verdict = Optional(LongUnicode)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    for i in range(1, 6): Article(id=i, title='a%d' % i, body='body%d' % i)
+    Review(id=6, title='r', body='body6', verdict='good')
+
+class TestLazyBatchLoading(unittest.TestCase):
+    def setUp(self):
+        db_session.__enter__()
+        db.merge_local_stats()
+
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+
+    def select_count(self):
+        return sum(stat.db_count for sql, stat in db.local_stats.items() if sql.startswith('SELECT'))
+
+    def test_siblings_are_loaded(self):
+        articles = Article.select().order_by(Article.id)[:]
+        self.assertEqual([ a.body for a in articles ], [ 'body%d' % i for i in range(1, 7) ])
+        self.assertEqual(self.select_count(), 2)
+
+    def test_only_lazy_column_is_selected(self):
+        articles = Article.select().order_by(Article.id)[:]
+        articles[0].body
+        sql = db.last_sql
+        self.assertTrue('"body"' in sql)
+        self.assertFalse('"title"' in sql)
+        self.assertFalse('"verdict"' in sql)
+
+    def test_batches(self):
+        articles = Article.select().order_by(Article.id)[:]
+        provider = db.provider
+        provider.max_params_count, max_params_count = 4, provider.max_params_count
+        try: articles[0].body
+        finally: provider.max_params_count = max_params_count
+        self.assertEqual(self.select_count(), 3)
+        self.assertEqual([ a.body for a in articles ], [ 'body%d' % i for i in range(1, 7) ])
+        self.assertEqual(self.select_count(), 3)
+
+    def test_subclass_attribute(self):
+        articles = Article.select().order_by(Article.id)[:]
+        self.assertEqual(articles[5].verdict, 'good')
+        self.assertEqual(self.select_count(), 2)
+
+    def test_other_queries_are_not_affected(self):
+        a1 = Article.select(lambda a: a.id == 1)[:][0]
+        Article.select(lambda a: a.id > 1)[:]
+        self.assertEqual(a1.body, 'body1')
+        self.assertEqual(self.select_count(), 3)
+        cache = db._get_cache()
+        self.assertEqual(len([ a for a in cache.indexes[Article._pk_attrs_].values() if Article.body in a._vals_ ]), 1)
+
+    def test_modified_object(self):
+        articles = Article.select().order_by(Article.id)[:]
+        articles[1].title = 'changed'
+        self.assertEqual(articles[0].body, 'body1')
+        self.assertEqual(articles[1].title, 'changed')
+        self.assertEqual(articles[1].body, 'body2')
+        self.assertEqual(self.select_count(), 2)
+
+    def test_evicted_objects_are_released(self):
+        for article in Article.select().order_by(Article.id).iterate(chunk_size=2, evict=True):
+            article.body
+        cache = db._get_cache()
+        self.assertEqual(cache.fetched_groups, {})
+        self.assertEqual(len(cache.objects), 0)
+
+    def test_groups_are_cleared_on_commit(self):
+        Article.select()[:]
+        cache = db._get_cache()
+        self.assertTrue(cache.fetched_groups)
+        commit()
+        self.assertEqual(cache.fetched_groups, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+db = Database('sqlite', ':memory:')
+
+class Order(db.Entity):
+    items = Set('OrderItem')
+    invoice = Optional('Invoice')
+
+class OrderItem(db.Entity):
+    order = Required(Order)
+    product = Required('Product')
+
+class Product(db.Entity):
+    name = Required(unicode)
+    description = Optional(LongUnicode)
+    items = Set(OrderItem)
+    tags = Set('Tag')
+
+class Tag(db.Entity):
+    name = Required(unicode)
+    products = Set(Product)
+
+class Invoice(db.Entity):
+    order = Required(Order)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    tags = [ Tag(name='tag%d' % i) for i in range(3) ]
+    products = [ Product(name='p%d' % i, description='text%d' % i, tags=tags[:i]) for i in range(4) ]
+    for i in range(5):
+        order = Order()
+        for product in products[i % 2:]: OrderItem(order=order, product=product)
+        if i % 2: Invoice(order=order)
+
+class TestNestedPrefetch(unittest.TestCase):
+    def setUp(self):
+        db_session.__enter__()
+        db.merge_local_stats()
+
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+
+    def select_count(self):
+        return sum(stat.db_count for sql, stat in db.local_stats.items() if sql.startswith('SELECT'))
+
+    def test_one_query_per_level(self):
+        orders = Order.select().prefetch(Order.items, OrderItem.product, Product.tags)[:]
+        self.assertEqual(self.select_count(), 4)
+        names = set()
+        for order in orders:
+            for item in order.items:
+                names.update(tag.name for tag in item.product.tags)
+        self.assertEqual(names, {'tag0', 'tag1', 'tag2'})
+        self.assertEqual(self.select_count(), 4)
+
+    def test_lazy_attribute(self):
+        orders = Order.select().prefetch(Order.items, OrderItem.product, Product.description)[:]
+        self.assertEqual(self.select_count(), 4)
+        descriptions = {item.product.description for order in orders for item in order.items}
+        self.assertEqual(descriptions, {'text0', 'text1', 'text2', 'text3'})
+        self.assertEqual(self.select_count(), 4)
+
+    def test_one_to_one_without_column(self):
+        orders = Order.select().prefetch(Order.invoice)[:]
+        self.assertEqual(self.select_count(), 2)
+        self.assertEqual(len([ order for order in orders if order.invoice is not None ]), 2)
+        self.assertEqual(self.select_count(), 2)
+
+    def test_batches(self):
+        provider = db.provider
+        provider.max_params_count, max_params_count = 2, provider.max_params_count
+        try: orders = Order.select().prefetch(Order.items)[:]
+        finally: provider.max_params_count = max_params_count
+        self.assertEqual(self.select_count(), 4)
+        self.assertEqual(sum(len(order.items) for order in orders), 18)
+        self.assertEqual(self.select_count(), 4)
+
+if __name__ == '__main__':
+    unittest.main()
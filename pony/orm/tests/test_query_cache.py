@@ -0,0 +1,148 @@
+from __future__ import absolute_import, print_function, division
+
+import os, shutil, subprocess, sys, tempfile, unittest
+
+import pony
+from pony.orm.core import *
+from pony.orm import decompiling
+from pony.utils import LRUCache
+from pony.orm.tests.testutils import *
+
+def make_db(extra_attr=False):
+    db = Database('sqlite', ':memory:')
+
+    class Group(db.Entity):
+        number = PrimaryKey(int)
+        students = Set('Student')
+
+    class Student(db.Entity):
+        name = Required(unicode)
+        group = Required(Group)
+        if extra_attr: gpa = Optional(float)
+
+    db.generate_mapping(create_tables=True)
+    with db_session:
+        g1, g2 = Group(number=1), Group(number=2)
+        Student(name='John', group=g1)
+        Student(name='Mike', group=g1)
+        Student(name='Kate', group=g2)
+    return db
+
+def run_queries(db):
+    Group, Student = db.Group, db.Student
+    with db_session:
+        return [
+            select(s.name for s in Student if s.group.number == 1).order_by(1)[:],
+            select((g.number, count(g.students)) for g in Group).order_by(1)[:],
+            [ s.name for s in Student.select(lambda s: s.name >= 'K') ],
+            [ s.name for s in select(s for s in Student).filter(lambda s: s.id > 1).order_by(Student.name) ],
+            select(s.name for s in Student if s.name in ('John', 'Kate')).order_by(1)[:],
+        ]
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        decompiling.disk_cache = None
+        shutil.rmtree(self.dirname)
+
+    def test_translators_are_loaded_from_disk(self):
+        db = make_db()
+        db.set_query_cache_dir(self.dirname)
+        expected = run_queries(db)
+        cache = db._translator_cache
+        self.assertEqual(cache.disk_hits, 0)
+        self.assertTrue(os.listdir(self.dirname))
+
+        cache.clear()
+        decompiling.ast_cache.clear()
+        self.assertEqual(run_queries(db), expected)
+        self.assertEqual(cache.disk_misses, len(cache))
+        self.assertEqual(cache.disk_hits, len(cache))
+
+    def test_other_database(self):
+        db = make_db()
+        db.set_query_cache_dir(self.dirname)
+        expected = run_queries(db)
+        db2 = make_db()
+        db2.set_query_cache_dir(self.dirname)
+        self.assertEqual(run_queries(db2), expected)
+        self.assertEqual(db2._translator_cache.disk_hits, len(db2._translator_cache))
+
+    def test_other_process(self):
+        db = make_db()
+        db.set_query_cache_dir(self.dirname)
+        expected = run_queries(db)
+        script = '\n'.join([
+            'from pony import options',
+            'options.SIMPLE_ALIASES, options.INNER_JOIN_SYNTAX = %r, %r'
+            % (pony.options.SIMPLE_ALIASES, pony.options.INNER_JOIN_SYNTAX),  # are part of the cache key
+            'from pony.orm.tests.test_query_cache import make_db, run_queries',
+            'db = make_db()',
+            'db.set_query_cache_dir(%r)' % self.dirname,
+            'result = run_queries(db)',
+            'cache = db._translator_cache',
+            'print(repr(result))',
+            'print(cache.disk_hits == len(cache) > 0)'
+        ])
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(pony.__file__))))
+        output = subprocess.check_output([ sys.executable, '-c', script ], env=env, close_fds=True).decode('utf-8').splitlines()
+        self.assertEqual(output, [ repr(expected), 'True' ])
+
+    def test_schema_change(self):
+        db = make_db()
+        db.set_query_cache_dir(self.dirname)
+        run_queries(db)
+        db2 = make_db(extra_attr=True)
+        db2.set_query_cache_dir(self.dirname)
+        run_queries(db2)
+        self.assertEqual(db2._translator_cache.disk_hits, 0)
+
+    def test_disable(self):
+        db = make_db()
+        db.set_query_cache_dir(self.dirname)
+        db.set_query_cache_dir(None)
+        self.assertEqual(type(db._translator_cache), LRUCache)
+        self.assertTrue(decompiling.disk_cache is None)
+
+    def test_disable_keeps_cache_of_other_database(self):
+        db, db2 = make_db(), make_db()
+        db.set_query_cache_dir(self.dirname)
+        db2.set_query_cache_dir(self.dirname)
+        disk_cache = decompiling.disk_cache
+        db.set_query_cache_dir(None)
+        self.assertTrue(decompiling.disk_cache is disk_cache)
+        db2.set_query_cache_dir(None)
+        self.assertTrue(decompiling.disk_cache is None)
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.get_stats(), dict(size=2, max_size=2, hits=3, misses=1, evictions=1))
+
+    def test_database_caches_are_bounded(self):
+        db = make_db()
+        db._translator_cache.max_size = 3
+        db._constructed_sql_cache.max_size = 3
+        with db_session:
+            for i in range(10): db.Student.select().limit(1, offset=i)[:]
+            Student = db.Student
+            for attr in (Student.id, Student.name, desc(Student.id), desc(Student.name)):
+                Student.select().order_by(attr)[:]
+        stats = db.query_cache_stats
+        self.assertEqual(stats['translators']['size'], 3)
+        self.assertEqual(stats['sql']['size'], 3)
+        self.assertTrue(stats['translators']['evictions'] > 0)
+        self.assertTrue(stats['sql']['evictions'] >= 7)
+        self.assertTrue(stats['translators']['hits'] > 0)
+
+if __name__ == '__main__':
+    unittest.main()
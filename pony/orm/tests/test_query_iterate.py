@@ -0,0 +1,78 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    students = Set('Student')
+
+class Student(db.Entity):
+    name = Required(unicode, unique=True)
+    group = Required(Group)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    for i in range(1, 4): Group(number=i)
+    for i in range(250): Student(name='S%03d' % i, group=i % 3 + 1)
+
+class TestQueryIterate(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+
+    def count_selects(self):
+        return sum(stat.db_count for sql, stat in db.local_stats.items() if sql.startswith('SELECT'))
+
+    def test_entities(self):
+        names = [ s.name for s in Student.select().order_by(Student.id).iterate(chunk_size=100) ]
+        self.assertEqual(names, [ 'S%03d' % i for i in range(250) ])
+
+    def test_single_column(self):
+        ids = list(select(s.id for s in Student).order_by(1).iterate(chunk_size=100))
+        self.assertEqual(ids, list(range(1, 251)))
+
+    def test_tuples(self):
+        rows = list(select((s.name, s.group) for s in Student if s.id <= 3).order_by(1).iterate(chunk_size=2))
+        self.assertEqual(rows, [ ('S000', Group[1]), ('S001', Group[2]), ('S002', Group[3]) ])
+
+    def test_prefetch(self):
+        students = list(Student.select().order_by(Student.id).prefetch(Student.group).iterate(chunk_size=100))
+        db.merge_local_stats()
+        self.assertEqual(len(set(s.group.number for s in students)), 3)
+        self.assertEqual(self.count_selects(), 0)
+
+    def test_evict(self):
+        cache = db._get_cache()
+        objects_before = len(cache.objects)
+        count = 0
+        for s in Student.select().iterate(chunk_size=50, evict=True):
+            self.assertTrue(len(cache.objects) <= objects_before + 53)
+            count += 1
+        self.assertEqual(count, 250)
+        self.assertEqual(s.name, 'S249')
+        self.assertTrue(Student.get(name='S249') is not s)
+        self.assertTrue(Student[250] is not s)
+
+    def test_evict_keeps_modified_objects(self):
+        s1 = Student[1]
+        s1.name = 'X'
+        students = list(Student.select().iterate(chunk_size=50, evict=True))
+        self.assertTrue(Student[1] is s1)
+        self.assertEqual(students[0].name, 'X')
+
+    @raises_exception(ValueError, 'chunk_size must be positive number. Got: 0')
+    def test_invalid_chunk_size(self):
+        Student.select().iterate(chunk_size=0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+from __future__ import absolute_import, print_function, division
+
+import os, shutil, tempfile, threading, time, unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+class TestQueryResultCache(unittest.TestCase):
+    def setUp(self):
+        db = self.db = Database('sqlite', ':memory:')
+
+        class Group(db.Entity):
+            number = PrimaryKey(int)
+            students = Set('Student')
+
+        class Student(db.Entity):
+            name = Required(unicode)
+            group = Required(Group)
+            courses = Set('Course')
+
+        class Course(db.Entity):
+            name = Required(unicode)
+            students = Set(Student)
+
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            g1 = Group(number=1)
+            g2 = Group(number=2)
+            Student(name='John', group=g1)
+            Student(name='Mike', group=g1)
+            Student(name='Kate', group=g2)
+            Course(name='Math')
+
+    def count_selects(self):
+        return sum(stat.db_count for sql, stat in self.db.local_stats.items() if sql.startswith('SELECT'))
+
+    def names(self):
+        return select(s.name for s in self.db.Student if s.group.number == 1).order_by(1).cached()[:]
+
+    def test_shared_between_sessions(self):
+        with db_session:
+            self.assertEqual(self.names(), [ 'John', 'Mike' ])
+        count = self.count_selects()
+        with db_session:
+            self.assertEqual(self.names(), [ 'John', 'Mike' ])
+        self.assertEqual(self.count_selects(), count)
+
+    def test_entity_query(self):
+        db = self.db
+        query = select(s for s in db.Student if s.group.number == 1).order_by(db.Student.id).cached()
+        with db_session:
+            query[:]
+        count = self.count_selects()
+        with db_session:
+            students = query[:]
+            self.assertEqual([ s.name for s in students ], [ 'John', 'Mike' ])
+            self.assertTrue(students[0] is db.Student[1])
+        self.assertEqual(self.count_selects(), count)
+
+    def test_aggregate(self):
+        db = self.db
+        with db_session:
+            self.assertEqual(db.Student.select().cached().count(), 3)
+            db.Student(name='Alex', group=db.Group[2])
+        with db_session:
+            self.assertEqual(db.Student.select().cached().count(), 4)
+
+    def test_invalidation_by_table(self):
+        db = self.db
+        with db_session:
+            self.names()
+        with db_session:
+            db.Course(name='Physics')
+        count = self.count_selects()
+        with db_session:
+            self.names()
+        self.assertEqual(self.count_selects(), count)
+        with db_session:
+            db.Group[1].students.create(name='Alex')
+        with db_session:
+            self.assertEqual(self.names(), [ 'Alex', 'John', 'Mike' ])
+
+    def test_invalidation_by_joined_table(self):
+        db = self.db
+        with db_session:
+            self.names()
+        with db_session:
+            db.Student[3].group = db.Group[1]
+        with db_session:
+            self.assertEqual(self.names(), [ 'John', 'Kate', 'Mike' ])
+
+    def test_invalidation_by_m2m_table(self):
+        db = self.db
+        query = select(c.name for c in db.Course if exists(c.students)).cached()
+        with db_session:
+            self.assertEqual(query[:], [])
+        with db_session:
+            db.Course[1].students.add(db.Student[1])
+        with db_session:
+            self.assertEqual(query[:], [ 'Math' ])
+
+    def test_uncommitted_changes_are_visible(self):
+        db = self.db
+        with db_session:
+            self.names()
+            db.Student[1].name = 'Johnny'
+            self.assertEqual(self.names(), [ 'Johnny', 'Mike' ])
+            rollback()
+        with db_session:
+            self.assertEqual(self.names(), [ 'John', 'Mike' ])
+
+    def test_bulk_delete(self):
+        db = self.db
+        with db_session:
+            self.names()
+        with db_session:
+            delete(s for s in db.Student if s.name == 'John')
+        with db_session:
+            self.assertEqual(self.names(), [ 'Mike' ])
+
+    def test_raw_sql(self):
+        db = self.db
+        with db_session:
+            self.names()
+        with db_session:
+            db.execute("update Student set name = 'Johnny' where id = 1")
+        with db_session:
+            self.assertEqual(self.names(), [ 'Johnny', 'Mike' ])
+
+    def test_insert(self):
+        db = self.db
+        with db_session:
+            self.names()
+        with db_session:
+            db.insert(db.Student, name='Adam', group=1)
+            self.assertEqual(self.names(), [ 'Adam', 'John', 'Mike' ])
+        with db_session:
+            self.assertEqual(self.names(), [ 'Adam', 'John', 'Mike' ])
+
+    def test_ttl(self):
+        db = self.db
+        query = select(s.name for s in db.Student).cached(ttl=0.01)
+        with db_session:
+            query[:]
+        count = self.count_selects()
+        time.sleep(0.02)
+        with db_session:
+            query[:]
+        self.assertEqual(self.count_selects(), count + 1)
+
+    def test_not_cached_by_default(self):
+        with db_session:
+            select(s.name for s in self.db.Student)[:]
+        self.assertEqual(self.db.query_cache_stats['results']['size'], 0)
+
+    @raises_exception(ValueError, 'ttl must be positive number. Got: 0')
+    def test_invalid_ttl(self):
+        select(s for s in self.db.Student).cached(ttl=0)
+
+class TestQueryResultCacheSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        db = self.db = Database('sqlite', os.path.join(self.dirname, 'test.sqlite'), create_db=True,
+                                journal_mode='WAL')
+
+        class Person(db.Entity):
+            name = Required(unicode)
+
+        class Group(db.Entity):
+            number = Required(int)
+
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            Person(id=1, name='old')
+            Group(number=1)
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.dirname)
+
+    def names(self):
+        return select(p.name for p in self.db.Person).cached()[:]
+
+    def update(self):
+        def update():
+            with db_session:
+                self.db.Person[1].name = 'new'
+        thread = threading.Thread(target=update)
+        thread.start()
+        thread.join()
+
+    def test_snapshot_does_not_poison_cache(self):
+        db = self.db
+        with db_session:
+            self.assertEqual(db.Group[1].number, 1)  # read transaction pins the snapshot
+            self.update()
+            self.assertEqual(self.names(), [ 'old' ])
+        with db_session:
+            self.assertEqual(self.names(), [ 'new' ])
+
+    def test_snapshot_does_not_see_newer_results(self):
+        db = self.db
+        with db_session:
+            self.assertEqual(db.Group[1].number, 1)
+            result = []
+            def read():
+                with db_session: result.append(self.names())
+            self.update()
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+            self.assertEqual(result, [ [ 'new' ] ])
+            self.assertEqual(self.names(), [ 'old' ])
+
+class TestSessionQueryResults(unittest.TestCase):
+    def setUp(self):
+        db = self.db = Database('sqlite', ':memory:')
+
+        class Person(db.Entity):
+            name = Required(unicode)
+            tags = Set('Tag')
+
+        class Tag(db.Entity):
+            name = Required(unicode)
+            persons = Set(Person)
+
+        class LogEntry(db.Entity):
+            text = Required(unicode)
+
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            Person(name='John', tags=[ Tag(name='admin') ])
+
+    def count_selects(self):
+        return sum(stat.db_count for sql, stat in self.db.local_stats.items() if sql.startswith('SELECT'))
+
+    def test_unrelated_flush_keeps_results(self):
+        db = self.db
+        with db_session:
+            query = select(p.name for p in db.Person)
+            query[:]
+            db.LogEntry(text='hello')
+            flush()
+            count = self.count_selects()
+            query[:]
+            self.assertEqual(self.count_selects(), count)
+
+    def test_related_flush_evicts_results(self):
+        db = self.db
+        with db_session:
+            query = select(p.name for p in db.Person).order_by(1)
+            self.assertEqual(query[:], [ 'John' ])
+            db.Person(name='Mike')
+            self.assertEqual(query[:], [ 'John', 'Mike' ])
+
+    def test_m2m_flush_evicts_results(self):
+        db = self.db
+        with db_session:
+            query = select(t.name for t in db.Tag if exists(t.persons))
+            self.assertEqual(query[:], [ 'admin' ])
+            db.Person[1].tags.clear()
+            self.assertEqual(query[:], [])
+
+    def test_object_flush_evicts_results(self):
+        db = self.db
+        with db_session:
+            self.assertEqual(db.Person.select().count(), 1)
+            db.Person(name='Mike').flush()
+            self.assertEqual(db.Person.select().count(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
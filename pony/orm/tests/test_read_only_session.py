@@ -0,0 +1,110 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+db = Database('sqlite', ':memory:')
+
+class Group(db.Entity):
+    number = PrimaryKey(int)
+    students = Set('Student')
+
+class Student(db.Entity):
+    name = Required(unicode, unique=True)
+    group = Required(Group)
+    courses = Set('Course')
+
+class Course(db.Entity):
+    name = Required(unicode)
+    semester = Required(int)
+    composite_key(name, semester)
+    students = Set(Student)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    g1 = Group(number=1)
+    c1 = Course(name='Math', semester=1)
+    Student(id=1, name='S1', group=g1, courses=[ c1 ])
+    Student(id=2, name='S2', group=g1)
+
+class TestReadOnlySession(unittest.TestCase):
+    def setUp(self):
+        self.session = db_session(read_only=True)
+        self.session.__enter__()
+
+    def tearDown(self):
+        rollback()
+        self.session.__exit__()
+
+    def test_select(self):
+        students = select(s for s in Student).order_by(Student.id)[:]
+        self.assertEqual([ s.name for s in students ], [ 'S1', 'S2' ])
+        self.assertEqual([ c.name for c in students[0].courses ], [ 'Math' ])
+        self.assertTrue(Student.get(name='S2') is students[1])
+        self.assertTrue(Course.get(name='Math', semester=1) is select(c for c in Course if students[0] in c.students).first())
+
+    def test_no_change_tracking(self):
+        s1 = Student[1]
+        s1.name, s1.group.students.count()
+        self.assertTrue(s1._wbits_ is None)
+        self.assertEqual(s1._rbits_, 0)
+        self.assertTrue(s1._dbvals_ is s1._vals_)
+
+    def test_reload(self):
+        s1 = Student[1]
+        s1.name
+        cache = db._get_cache()
+        cache.query_results.clear()
+        self.assertEqual(select(s for s in Student if s.id == 1)[:], [ s1 ])
+        self.assertEqual(s1.name, 'S1')
+
+    def test_autocommit_mode(self):
+        Student[1]
+        cache = db._get_cache()
+        self.assertFalse(cache.in_transaction)
+        self.assertFalse(cache.immediate)
+        self.assertTrue(db.provider.transaction_lock.acquire(False))
+        db.provider.transaction_lock.release()
+
+    @raises_exception(TransactionError, 'Cannot assign new value to Student[1].name: the database session is read-only')
+    def test_assign(self):
+        Student[1].name = 'S3'
+
+    @raises_exception(TransactionError, 'Cannot change collection Student[1].courses: the database session is read-only')
+    def test_collection_add(self):
+        Student[1].courses.clear()
+
+    @raises_exception(TransactionError, 'Cannot delete object Student[2]: the database session is read-only')
+    def test_delete(self):
+        Student[2].delete()
+
+    @raises_exception(TransactionError, 'Cannot create Group object: the database session is read-only')
+    def test_create(self):
+        Group(number=2)
+
+    @raises_exception(TransactionError, 'Cannot modify or lock data inside read-only db_session')
+    def test_for_update(self):
+        Student.select().for_update()[:]
+
+    @raises_exception(TransactionError, 'Cannot delete object Student[2]: the database session is read-only')
+    def test_query_delete(self):
+        delete(s for s in Student if s.id == 2)
+
+    @raises_exception(TransactionError, 'Cannot modify or lock data inside read-only db_session')
+    def test_bulk_delete(self):
+        select(s for s in Student if s.id == 2).delete(bulk=True)
+
+class TestReadOnlyGenerator(unittest.TestCase):
+    def test_generator(self):
+        @db_session(read_only=True)
+        def gen():
+            yield Student[1].name
+            db.get_connection()  # read-only transaction is open when the generator yields and exits
+            yield Student[2].name
+        self.assertEqual(list(gen()), [ 'S1', 'S2' ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+from __future__ import absolute_import, print_function, division
+
+import os, shutil, sqlite3, tempfile, unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+def define_entities(db):
+    class Person(db.Entity):
+        name = Required(unicode)
+
+class TestReplicas(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.primary = os.path.join(self.dirname, 'primary.sqlite')
+        db = Database('sqlite', self.primary, create_db=True)
+        define_entities(db)
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            db.Person(id=1, name='primary')
+        db.disconnect()
+        self.replicas = []
+        for i in range(2):
+            filename = os.path.join(self.dirname, 'replica%d.sqlite' % i)
+            shutil.copy(self.primary, filename)
+            con = sqlite3.connect(filename)
+            con.execute("update Person set name = 'replica%d'" % i)
+            con.commit()
+            con.close()
+            self.replicas.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def make_db(self, **kwargs):
+        db = Database('sqlite', self.primary, replicas=self.replicas, **kwargs)
+        define_entities(db)
+        db.generate_mapping()
+        return db
+
+    def read_name(self, db, **kwargs):
+        with db_session(**kwargs):
+            return db.Person[1].name
+
+    def test_round_robin(self):
+        db = self.make_db()
+        names = [ self.read_name(db) for i in range(4) ]
+        self.assertEqual(names, [ 'replica1', 'replica0', 'replica1', 'replica0' ])
+
+    def test_reads_after_write_use_primary(self):
+        db = self.make_db()
+        with db_session:
+            p = db.Person[1]
+            self.assertTrue(p.name.startswith('replica'))
+            db.Person(name='new')
+            flush()
+            self.assertEqual(db.select('name from Person where id = 1'), [ 'primary' ])
+        con = sqlite3.connect(self.primary)
+        try: self.assertEqual(con.execute('select count(*) from Person').fetchone()[0], 2)
+        finally: con.close()
+
+    def test_immediate_session_uses_primary(self):
+        db = self.make_db()
+        self.assertEqual(self.read_name(db, immediate=True), 'primary')
+
+    def test_read_only_session_stays_on_replica(self):
+        db = self.make_db()
+        with db_session(read_only=True):
+            self.assertTrue(db.Person[1].name.startswith('replica'))
+            commit()
+            self.assertTrue(db.select('name from Person where id = 1')[0].startswith('replica'))
+
+    def test_least_outstanding(self):
+        db = self.make_db(replica_policy='least_outstanding')
+        policy = db.replica_policy
+        self.assertTrue(isinstance(policy, LeastOutstandingPolicy))
+        policy.acquired(db.replicas[0])
+        self.assertEqual(self.read_name(db), 'replica1')
+        self.assertEqual(policy.outstanding[db.replicas[1]], 0)
+        policy.released(db.replicas[0])
+
+    def test_custom_policy(self):
+        class FirstReplicaPolicy(object):
+            def choose(self, replicas): return replicas[0]
+            def acquired(self, replica): pass
+            def released(self, replica): pass
+        db = self.make_db(replica_policy=FirstReplicaPolicy())
+        self.assertEqual([ self.read_name(db) for i in range(2) ], [ 'replica0', 'replica0' ])
+
+    def test_fallback_to_primary(self):
+        db = self.make_db(replica_policy='least_outstanding')
+        def connect():
+            raise sqlite3.OperationalError('unable to open database file')
+        for replica in db.replicas: replica.pool.connect = connect
+        self.assertEqual(self.read_name(db), 'primary')
+        self.assertEqual([ db.replica_policy.outstanding[replica] for replica in db.replicas ], [ 0, 0 ])
+
+    @raises_exception(ValueError, "Unknown replica policy: 'random'")
+    def test_unknown_policy(self):
+        self.make_db(replica_policy='random')
+
+    @raises_exception(TypeError, "'read_only' parameter of db_session cannot be used together "
+                                 "with 'immediate', 'ddl' or 'serializable'")
+    def test_read_only_immediate(self):
+        db_session(read_only=True, immediate=True)
+
+if __name__ == '__main__':
+    unittest.main()
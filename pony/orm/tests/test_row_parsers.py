@@ -0,0 +1,70 @@
+from __future__ import absolute_import, print_function, division
+
+import unittest, warnings
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+db = Database('sqlite', ':memory:')
+
+class Person(db.Entity):
+    name = Required(unicode)
+    age = Optional(int)
+    mentor = Optional('Person', reverse='pupils')
+    pupils = Set('Person', reverse='mentor')
+
+class Student(Person):
+    room = Optional('Room')
+
+class Room(db.Entity):
+    building = Required(unicode)
+    number = Required(int)
+    PrimaryKey(building, number)
+    students = Set(Student)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    mike = Person(id=1, name='Mike', age=40)
+    Student(id=2, name='John', mentor=mike, room=Room(building='A', number=1))
+
+class TestRowParsers(unittest.TestCase):
+    def setUp(self):
+        rollback()
+        db_session.__enter__()
+
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+
+    def test_parser_matches_parse_row(self):
+        select_list, attr_offsets = Person._construct_select_clause_()
+        sql, adapter = db._ast2sql([ 'SELECT', select_list, [ 'FROM', [ None, 'TABLE', Person._table_ ] ] ])
+        rows = db._exec_sql(sql).fetchall()
+        self.assertEqual(len(rows), 2)
+        parse_row = Person._get_row_parser_(attr_offsets)
+        for row in rows:
+            self.assertEqual(parse_row(row), Person._parse_row_(row, attr_offsets))
+
+    def test_parser_is_cached(self):
+        select_list, attr_offsets = Person._construct_select_clause_()
+        parser = Person._get_row_parser_(attr_offsets)
+        self.assertTrue(Person._get_row_parser_(dict(attr_offsets)) is parser)
+
+    def test_inheritance_and_references(self):
+        people = Person.select().order_by(Person.id)[:]
+        self.assertEqual([ p.__class__ for p in people ], [ Person, Student ])
+        john = people[1]
+        self.assertTrue(john.mentor is people[0])
+        self.assertEqual(john.room.get_pk(), ('A', 1))
+
+    def test_empty_required_value_warning(self):
+        db.execute("update Person set name = '' where id = 1")
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            p = Person[1]
+        self.assertEqual(p.name, '')
+        self.assertEqual([ x.category for x in w ], [ DatabaseContainsIncorrectEmptyValue ])
+
+if __name__ == '__main__':
+    unittest.main()
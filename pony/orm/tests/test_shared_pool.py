@@ -0,0 +1,155 @@
+from __future__ import absolute_import, print_function, division
+
+import os, tempfile, threading, unittest
+
+from pony.orm.core import *
+from pony.orm.dbapiprovider import SharedPool
+from pony.orm.tests.testutils import *
+
+class TestSharedPool(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def make_db(self, **kwargs):
+        db = Database('sqlite', self.filename, **kwargs)
+
+        class Person(db.Entity):
+            name = Required(unicode)
+
+        db.generate_mapping(create_tables=True)
+        return db
+
+    def test_per_thread_pool_by_default(self):
+        db = self.make_db()
+        self.assertFalse(isinstance(db.provider.pool, SharedPool))
+
+    def test_connections_are_reused_across_threads(self):
+        db = self.make_db(pool_max_size=2)
+        pool = db.provider.pool
+        self.assertTrue(isinstance(pool, SharedPool))
+        with db_session:
+            db.Person(name='John')
+        errors = []
+        def worker():
+            try:
+                for i in range(20):
+                    with db_session:
+                        self.assertEqual(db.Person.select().count(), 1)
+            except Exception as e: errors.append(e)
+        threads = [ threading.Thread(target=worker) for i in range(8) ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(pool.size <= 2)
+        self.assertEqual(len(pool.idle), pool.size)
+        db.disconnect()
+        self.assertEqual(pool.size, 0)
+
+    def test_checkout_timeout(self):
+        db = self.make_db(pool_max_size=1, pool_timeout=0.05)
+        pool = db.provider.pool
+        con = pool.connect()
+        self.assertRaises(PoolTimeoutError, pool.connect)
+        pool.release(con)
+        self.assertTrue(pool.connect() is con)
+
+    def test_max_idle_time(self):
+        db = self.make_db(pool_max_idle_time=0)
+        pool = db.provider.pool
+        con = pool.connect()
+        pool.release(con)
+        con2 = pool.connect()
+        self.assertFalse(con2 is con)
+        self.assertEqual(pool.size, 1)
+
+    def test_min_size_keeps_idle_connections(self):
+        db = self.make_db(pool_min_size=1, pool_max_idle_time=0)
+        pool = db.provider.pool
+        con = pool.connect()
+        pool.release(con)
+        self.assertTrue(pool.connect() is con)
+
+    def test_min_size_prefills_pool(self):
+        db = self.make_db(pool_min_size=2)
+        pool = db.provider.pool
+        con = pool.connect()
+        self.assertEqual(pool.size, 2)
+        self.assertEqual(len(pool.idle), 1)
+        pool.release(con)
+        self.assertEqual(db.pool_stats.opened - db.pool_stats.closed, 2)
+
+    def test_release_after_fork(self):
+        db = self.make_db(pool_max_size=2)
+        pool = db.provider.pool
+        con = pool.connect()
+        self.assertEqual(db.pool_stats.in_use, 1)
+        pool.pid = None  # pretend the pool was created in parent process
+        pool._check_fork()
+        forked_count = len(SharedPool.forked_connections)
+        pool.release(con)
+        self.assertEqual(db.pool_stats.in_use, 0)
+        self.assertEqual(SharedPool.forked_connections[forked_count:], [ (con, None) ])
+        del SharedPool.forked_connections[forked_count:]
+        con.close()
+
+    def test_pre_ping(self):
+        db = self.make_db(pool_pre_ping=True)
+        pool = db.provider.pool
+        con = pool.connect()
+        pool.release(con)
+        con.close()
+        con2 = pool.connect()
+        self.assertFalse(con2 is con)
+        self.assertEqual(pool.size, 1)
+
+    def test_per_thread_pool_stats(self):
+        db = self.make_db()
+        stats = db.pool_stats
+        with db_session:
+            db.Person(name='John')
+        stats2 = db.pool_stats
+        self.assertEqual(stats2.opened, stats.opened + 1)
+        self.assertEqual(stats2.checkouts, stats.checkouts + 1)
+        self.assertEqual(stats2.in_use, 0)
+        self.assertEqual(sum(stats2.wait_time_histogram), stats2.checkouts)
+        db.disconnect()
+        self.assertEqual(db.pool_stats.closed, stats2.closed + 1)
+        self.assertEqual(db.pool_stats.opened, db.pool_stats.closed)
+
+    def test_shared_pool_stats(self):
+        db = self.make_db(pool_max_size=1, pool_timeout=0)
+        pool = db.provider.pool
+        stats = db.pool_stats
+        con = pool.connect()
+        self.assertEqual(db.pool_stats.in_use, 1)
+        self.assertRaises(PoolTimeoutError, pool.connect)
+        pool.drop(con)
+        stats2 = db.pool_stats
+        self.assertEqual(stats2.opened, stats.opened + 1)
+        self.assertEqual(stats2.timeouts, 1)
+        self.assertEqual(stats2.dropped, stats.dropped + 1)
+        self.assertEqual(stats2.in_use, 0)
+        self.assertTrue(stats2.avg_wait_time is not None)
+
+    def test_reconnect_stats(self):
+        db = self.make_db()
+        db.provider.should_reconnect = lambda exc: True
+        with db_session:
+            db.Person(name='John')
+        with db_session:
+            cache = db._get_cache()
+            cache.connect()
+            try: raise OperationalError(None, 'connection lost')
+            except OperationalError as e: cache.reconnect(e)
+        self.assertEqual(db.pool_stats.reconnects, 1)
+
+    @raises_exception(TypeError, 'Shared connection pool cannot be used with in-memory database')
+    def test_in_memory_database(self):
+        Database('sqlite', ':memory:', pool_max_size=5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+from __future__ import absolute_import, print_function, division
+
+import logging, unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+db = Database('sqlite', ':memory:')
+
+class Person(db.Entity):
+    name = Required(unicode)
+    age = Required(int)
+
+db.generate_mapping(create_tables=True)
+
+with db_session:
+    Person(id=1, name='John', age=20)
+    Person(id=2, name='Mike', age=30)
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class TestSlowQueryLog(unittest.TestCase):
+    def setUp(self):
+        db.slow_queries.clear()
+        db_session.__enter__()
+
+    def tearDown(self):
+        rollback()
+        db_session.__exit__()
+        db.set_slow_query_log(None)
+
+    def test_disabled_by_default(self):
+        select(p for p in Person if p.age > 25)[:]
+        self.assertEqual(len(db.slow_queries), 0)
+
+    def test_threshold(self):
+        db.set_slow_query_log(60)
+        select(p for p in Person if p.age > 25)[:]
+        self.assertEqual(len(db.slow_queries), 0)
+
+    def test_slow_query(self):
+        db.set_slow_query_log(0)
+        x = 25
+        select(p for p in Person if p.age > x)[:]
+        self.assertEqual(len(db.slow_queries), 1)
+        query = db.slow_queries[0]
+        self.assertTrue(query.sql.startswith('SELECT'))
+        self.assertEqual(query.arguments, (25,))
+        self.assertTrue(query.duration >= 0)
+        self.assertEqual(query.function, 'test_slow_query')
+        self.assertTrue(query.filename.startswith(__file__.rstrip('co')))
+        self.assertTrue(query.explain is None)
+
+    def test_explain(self):
+        db.set_slow_query_log(0, explain=True)
+        Person.get(name='John')
+        explain = db.slow_queries[0].explain
+        self.assertTrue(explain)
+        self.assertTrue('Person' in ' '.join(' '.join(map(str, row)) for row in explain))
+
+    def test_explain_in_transaction(self):
+        db.set_slow_query_log(0, explain=True)
+        provider = db.provider
+        statements = []
+        def execute(cursor, sql, arguments=None, returning_id=False):
+            statements.append(sql)
+            if sql.startswith(provider.explain_prefix): raise provider.dbapi_module.OperationalError('explain failed')
+            return type(provider).execute(provider, cursor, sql, arguments, returning_id)
+        Person[1].age = 21
+        flush()
+        provider.execute = execute
+        try: self.assertEqual(Person.get(name='Mike').age, 30)
+        finally: del provider.execute
+        self.assertTrue(db.slow_queries[-1].explain is None)
+        self.assertEqual(statements[1], 'SAVEPOINT pony_explain')
+        self.assertEqual(statements[3:], [ 'ROLLBACK TO SAVEPOINT pony_explain', 'RELEASE SAVEPOINT pony_explain' ])
+        self.assertEqual(Person[1].age, 21)
+
+    def test_redact_arguments(self):
+        db.set_slow_query_log(0, redact_arguments=True)
+        Person.get(name='John')
+        self.assertEqual(db.slow_queries[0].arguments, ('?',))
+
+    def test_ring_buffer(self):
+        db.set_slow_query_log(0)
+        for i in range(db.slow_queries.maxlen + 10):
+            db.select('name from Person where id = $i')
+        self.assertEqual(len(db.slow_queries), db.slow_queries.maxlen)
+
+    def test_log_handler(self):
+        logger = logging.getLogger('pony.orm.slow_query')
+        handler = ListHandler()
+        logger.addHandler(handler)
+        try:
+            db.set_slow_query_log(0)
+            Person.get(name='Mike')
+        finally: logger.removeHandler(handler)
+        self.assertEqual(len(handler.messages), 1)
+        self.assertTrue(handler.messages[0].startswith('Slow query ('))
+
+    @raises_exception(ValueError, 'Slow query threshold must be non-negative number of seconds or None. Got: -1')
+    def test_negative_threshold(self):
+        db.set_slow_query_log(-1)
+
+if __name__ == '__main__':
+    unittest.main()
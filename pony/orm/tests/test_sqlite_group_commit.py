@@ -0,0 +1,201 @@
+from __future__ import absolute_import, print_function, division
+
+import os, shutil, tempfile, threading, time, unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+class TestSQLiteGroupCommit(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        db = self.db = Database('sqlite', os.path.join(self.dirname, 'test.sqlite'), create_db=True,
+                                group_commit=True)
+        class Person(db.Entity):
+            name = Required(unicode, unique=True)
+        db.generate_mapping(create_tables=True)
+        self.writer = db.provider.pool.writer
+        self.groups = []
+        commit_group = self.writer.commit_group
+        def record_group(con, group):
+            self.groups.append(len(group))
+            commit_group(con, group)
+        self.writer.commit_group = record_group
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.dirname)
+
+    def names(self):
+        with db_session:
+            return set(select(p.name for p in self.db.Person))
+
+    def test_commit(self):
+        db = self.db
+        with db_session:
+            p = db.Person(name='John')
+            flush()
+            self.assertTrue(p.id is not None)
+            self.assertEqual(select(p.name for p in db.Person)[:], [ 'John' ])
+        self.assertEqual(self.names(), {'John'})
+        self.assertEqual(self.groups, [ 1 ])
+
+    def test_rollback(self):
+        db = self.db
+        with db_session:
+            db.Person(name='John')
+            flush()
+            rollback()
+        self.assertEqual(self.names(), set())
+
+    def test_failed_session_does_not_affect_others(self):
+        db = self.db
+        with db_session:
+            db.Person(name='John')
+        try:
+            with db_session:
+                db.Person(name='John')
+        except TransactionIntegrityError: pass
+        else: self.fail('TransactionIntegrityError was not raised')
+        with db_session:
+            db.Person(name='Mike')
+        self.assertEqual(self.names(), {'John', 'Mike'})
+
+    def test_group_commit(self):
+        db = self.db
+        flushed, proceed = threading.Event(), threading.Event()
+        def first():
+            with db_session:
+                db.Person(name='first')
+                flush()
+                flushed.set()
+                proceed.wait(5)
+        def other(name):
+            with db_session:
+                db.Person(name=name)
+        threads = [ threading.Thread(target=first) ]
+        threads[0].start()
+        self.assertTrue(flushed.wait(5))
+        for name in ('second', 'third'):
+            thread = threading.Thread(target=other, args=(name,))
+            thread.start()
+            threads.append(thread)
+        for i in range(500):
+            if len(self.writer.jobs) == 2: break
+            time.sleep(0.01)
+        proceed.set()
+        for thread in threads: thread.join()
+        self.assertEqual(self.groups, [ 3 ])
+        self.assertEqual(self.names(), {'first', 'second', 'third'})
+
+    def test_committed_session_does_not_wait_for_others(self):
+        db = self.db
+        flushed, committed = threading.Event(), threading.Event()
+        result = []
+        def second():
+            with db_session:
+                p = db.Person(name='second')
+                flush()
+                flushed.set()
+                result.append(committed.wait(5))
+                db.Person(name='third')
+                flush()
+                result.append(p.id)
+        thread = threading.Thread(target=second)
+        with db_session:
+            db.Person(name='first')
+            flush()
+            thread.start()
+            for i in range(500):
+                if len(self.writer.jobs) == 1: break
+                time.sleep(0.01)
+        committed.set()
+        thread.join()
+        self.assertEqual(result, [ True, 2 ])
+        self.assertEqual(self.groups, [ 1, 1 ])
+        self.assertEqual(self.names(), {'first', 'second', 'third'})
+
+    def test_restarted_session_is_failed_if_database_was_changed(self):
+        db = self.db
+        flushed, proceed = threading.Event(), threading.Event()
+        errors = []
+        def second():
+            try:
+                with db_session:
+                    db.Person(name='second')
+                    flush()
+                    flushed.set()
+                    proceed.wait(5)
+                    db.Person(name='third')
+            except UnexpectedError as e: errors.append(e)
+        thread = threading.Thread(target=second)
+        execute = self.writer.execute
+        def execute_and_change(con, sql, arguments, many):
+            rows, description, rowcount, lastrowid = execute(con, sql, arguments, many)
+            if flushed.is_set(): lastrowid = None
+            return rows, description, rowcount, lastrowid
+        self.writer.execute = execute_and_change
+        with db_session:
+            db.Person(name='first')
+            flush()
+            thread.start()
+            for i in range(500):
+                if len(self.writer.jobs) == 1: break
+                time.sleep(0.01)
+        proceed.set()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertTrue('database was changed by another connection' in str(errors[0]))
+        self.assertEqual(self.names(), {'first'})
+
+    def test_stalled_session_is_failed_if_others_are_waiting(self):
+        db = self.db
+        self.writer.lock_timeout = 0.2
+        flushed, proceed = threading.Event(), threading.Event()
+        errors = []
+        def first():
+            try:
+                with db_session:
+                    db.Person(name='first')
+                    flush()
+                    flushed.set()
+                    proceed.wait(5)
+                    db.Person(name='third')
+            except UnexpectedError as e: errors.append(e)
+        thread = threading.Thread(target=first)
+        thread.start()
+        self.assertTrue(flushed.wait(5))
+        with db_session:
+            db.Person(name='second')
+        proceed.set()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertTrue('did not execute the next statement within 0.2 seconds' in str(errors[0]))
+        self.assertEqual(self.names(), {'second'})
+
+    def test_stalled_session_is_not_failed_if_nobody_is_waiting(self):
+        db = self.db
+        self.writer.lock_timeout = 0.05
+        with db_session:
+            db.Person(name='first')
+            flush()
+            time.sleep(0.2)
+            db.Person(name='second')
+        self.assertEqual(self.names(), {'first', 'second'})
+
+    def test_writer_is_stopped_on_disconnect(self):
+        db = self.db
+        with db_session:
+            db.Person(name='John')
+        thread = self.writer.thread
+        self.assertTrue(thread is not None)
+        db.disconnect()
+        self.assertTrue(self.writer.thread is None)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.names(), {'John'})
+
+    @raises_exception(TypeError, 'Group commit cannot be used with in-memory database')
+    def test_in_memory(self):
+        Database('sqlite', ':memory:', group_commit=True)
+
+if __name__ == '__main__':
+    unittest.main()
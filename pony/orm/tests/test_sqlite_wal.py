@@ -0,0 +1,91 @@
+from __future__ import absolute_import, print_function, division
+
+import os, shutil, tempfile, threading, unittest
+
+from pony.orm.core import *
+from pony.orm.tests.testutils import *
+
+class TestSQLiteWAL(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        db = self.db = Database('sqlite', os.path.join(self.dirname, 'test.sqlite'), create_db=True,
+                                journal_mode='WAL', busy_timeout=3000, synchronous='NORMAL',
+                                cache_size=-4000, temp_store='MEMORY')
+        class Person(db.Entity):
+            name = Required(unicode)
+        db.generate_mapping(create_tables=True)
+        with db_session:
+            Person(id=1, name='John')
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.dirname)
+
+    def test_pragmas(self):
+        db = self.db
+        self.assertTrue(db.provider.wal_mode)
+        with db_session:
+            con = db.get_connection()
+            self.assertEqual(con.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(con.execute('PRAGMA busy_timeout').fetchone()[0], 3000)
+            self.assertEqual(con.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(con.execute('PRAGMA cache_size').fetchone()[0], -4000)
+            self.assertEqual(con.execute('PRAGMA temp_store').fetchone()[0], 2)
+
+    @raises_exception(ValueError, "Invalid value of journal_mode pragma: 'wal; drop table Person'")
+    def test_invalid_pragma(self):
+        Database('sqlite', ':memory:', journal_mode='wal; drop table Person')
+
+    def test_read_transaction(self):
+        db = self.db
+        lock = db.provider.transaction_lock
+        with db_session:
+            self.assertEqual(db.Person[1].name, 'John')
+            cache = db._get_cache()
+            self.assertTrue(cache.in_transaction and cache.read_transaction)
+            self.assertTrue(lock.acquire(False))
+            lock.release()
+            db.Person[1].name = 'Mike'
+            flush()
+            self.assertTrue(cache.in_transaction)
+            self.assertFalse(cache.read_transaction)
+            self.assertFalse(lock.acquire(False))
+        self.assertTrue(lock.acquire(False))
+        lock.release()
+        with db_session:
+            self.assertEqual(db.Person[1].name, 'Mike')
+
+    def test_read_only_transaction(self):
+        db = self.db
+        with db_session(read_only=True):
+            self.assertEqual(db.Person[1].name, 'John')
+            cache = db._get_cache()
+            self.assertTrue(cache.in_transaction and cache.read_transaction)
+            commit()
+            self.assertFalse(cache.in_transaction)
+            self.assertEqual(select(p.name for p in db.Person)[:], [ 'John' ])
+            self.assertTrue(cache.in_transaction and cache.read_transaction)
+
+    def test_reader_is_not_blocked_by_writer(self):
+        db = self.db
+        written, read = threading.Event(), threading.Event()
+        def writer():
+            with db_session:
+                db.Person[1].name = 'Mike'
+                flush()
+                written.set()
+                read.wait(5)
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            self.assertTrue(written.wait(5))
+            with db_session:
+                self.assertEqual(db.Person[1].name, 'John')
+        finally:
+            read.set()
+            thread.join()
+        with db_session:
+            self.assertEqual(db.Person[1].name, 'Mike')
+
+if __name__ == '__main__':
+    unittest.main()
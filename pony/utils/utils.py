@@ -7,7 +7,8 @@ from datetime import datetime
 from itertools import count as _count
 from inspect import isfunction
 from time import strptime
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from threading import Lock
 from functools import update_wrapper, wraps
 from xml.etree import cElementTree
 from copy import deepcopy
@@ -405,6 +406,45 @@ def _hashable_wrap(func):
         return func(self, *args, **kwargs)
     return new_func
 
+class LRUCache(object):
+    def __init__(cache, max_size=None):
+        cache.max_size = max_size
+        cache.data = OrderedDict()
+        cache.lock = Lock()
+        cache.hits = cache.misses = cache.evictions = 0
+    def __len__(cache):
+        return len(cache.data)
+    def __contains__(cache, key):
+        return key in cache.data
+    def get(cache, key, default=None):
+        data = cache.data
+        with cache.lock:
+            try: value = data.pop(key)
+            except KeyError:
+                cache.misses += 1
+                return default
+            data[key] = value
+            cache.hits += 1
+        return value
+    def __setitem__(cache, key, value):
+        data = cache.data
+        with cache.lock:
+            data.pop(key, None)
+            data[key] = value
+            max_size = cache.max_size
+            if max_size is not None:
+                while len(data) > max_size:
+                    data.popitem(last=False)
+                    cache.evictions += 1
+    def pop(cache, key, default=None):
+        with cache.lock: return cache.data.pop(key, default)
+    def clear(cache):
+        with cache.lock: cache.data.clear()
+    def get_stats(cache):
+        with cache.lock:
+            return dict(size=len(cache.data), max_size=cache.max_size,
+                        hits=cache.hits, misses=cache.misses, evictions=cache.evictions)
+
 class HashableDict(dict):
     def __hash__(self):
         result = getattr(self, '_hash', None)